@@ -109,18 +109,18 @@ bpy.types.Scene.positrons = bpy.props.IntProperty(
 
 bpy.types.Scene.electrons_atoms = bpy.props.IntProperty(
     name = "Electrons",
-    default = 1, min = 0, max = 20,
+    default = 1, min = 0, max = 118,
     description = "The number of electrons to simulate for atoms")
 
 bpy.types.Scene.protons = bpy.props.IntProperty(
     name = "Protons",
-    default = 1, min = 1, max = 20,
+    default = 1, min = 1, max = 118,
     description = "The number of protons to simulate",
     update = proton_changed)
 
 bpy.types.Scene.neutrons = bpy.props.IntProperty(
     name = "Neutrons",
-    default = 0, min = 0, max = 20,
+    default = 0, min = 0, max = 118,
     description = "The number of neutrons to simulate")
 
 bpy.types.Scene.hydrogen_atoms = bpy.props.IntProperty(
@@ -573,68 +573,20 @@ class EWT_PT_Settings_1(EWTPanel, bpy.types.Panel):
 
 def main(operator, context, phase):
 
-    # Clear the simulation
-    from common import reset
-    importlib.reload(reset)
-    reset.clear_simulation()
-
-    # Import configs
+    # Clear the simulation and build the phase from the UI settings.  The runner also builds phases without the UI (see common/runner.py).
+    from common import runner
+    importlib.reload(runner)
+    settings = runner.scene_settings(context.scene)
     from common import config
     importlib.reload(config)
-
-    # Set common config variables to the UI inputs
-    config.show_neutrino_motion = context.scene.show_neutrino_motion
-    config.wave_amplitude = context.scene.wave_amplitude
-    config.wave_speed = context.scene.wave_speed
-    config.spin = context.scene.spin
-    config.external_force = context.scene.external_force
-    config.ext_force_strength = context.scene.ext_force_strength
-    config.show_calculations = context.scene.show_calculations
-    config.show_forces = context.scene.show_forces
-    config.num_frames = context.scene.num_frames
-    config.longitudinal_wave = context.scene.longitudinal_wave
-    config.transverse_wave = context.scene.transverse_wave
-    config.spacetime_length = context.scene.spacetime_length
-    config.dimensions = int(context.scene.dimensions_enum)
-
-    if context.scene.view_enum == "G":
-        config.show_granules = True
+    if config.profile_build:
+        runner.profile_build(phase, settings)
     else:
-        config.show_granules = False
-
-    # Execute the correct module based on phase
-    if phase == 1:
-        from phase1 import spacetime
-        importlib.reload(spacetime)
-        spacetime.main(wave_centers = context.scene.wave_centers,
-        anti_wave_centers = context.scene.anti_wave_centers)
-
-    if phase == 2:
-        from phase2 import particles
-        importlib.reload(particles)
-        particles.main(neutrinos = context.scene.neutrinos)
-
-    if phase == 3:
-        from phase3 import nucleons
-        importlib.reload(nucleons)
-        nucleons.main(electrons = context.scene.electrons_nucleons,
-            positrons = context.scene.positrons,
-            particle_accelerator = context.scene.particle_accelerator,
-            accelerator_force = context.scene.accelerator_force)
-
-    if phase == 4:
-        from phase4 import atoms
-        importlib.reload(atoms)
-        atoms.main(protons = context.scene.protons,
-            neutrons = context.scene.neutrons,
-            electrons = context.scene.electrons_atoms,
-            show_electron_cloud = context.scene.show_electron_cloud)
-
-    if phase == 5:
-        config.ext_force_strength = context.scene.ext_force_strength_molecules
-        from phase5 import molecules
-        importlib.reload(molecules)
-        molecules.main(hydrogen_atoms = context.scene.hydrogen_atoms)
+        runner.build(phase, settings)
+
+    # If the bake cache is on, the particles are baked now, or replayed from the cache if this configuration was run before
+    if config.bake_cache:
+        runner.bake(runner.scene_key(phase, settings))
 
     # Automatically start playing
     if context.scene.auto_play == True:
@@ -648,9 +600,10 @@ def main(operator, context, phase):
     bpy.ops.view3d.view_all(center=True)
     bpy.ops.object.select_all(action='DESELECT')
     bpy.context.scene.frame_set(1)
-    bpy.ops.ptcache.free_bake_all()  # Blender has an issue with cache that affects particle systems. Workaround is to delete all bakes and then toggle gravity to clear the cache correctly.
-    bpy.context.scene.use_gravity = True
-    bpy.context.scene.use_gravity = False
+    if not config.bake_cache:                # Baked particles are replayed from their trajectories, so there are no point caches to clear
+        bpy.ops.ptcache.free_bake_all()  # Blender has an issue with cache that affects particle systems. Workaround is to delete all bakes and then toggle gravity to clear the cache correctly.
+        bpy.context.scene.use_gravity = True
+        bpy.context.scene.use_gravity = False
 
 
 #------------------------------------------------------------------------------------------------------
@@ -0,0 +1,413 @@
+# Bake
+
+#------------------------------------------------------------------------------------------------------
+# BAKE EMITTERS WITH THE PARTICLE ENGINE
+# Moves the particles of emitters with the NumPy particle engine (common/engine.py) instead of Blender's particle solver.
+# The forces are read from the scene: the emitters' own force fields (force_field_1 and force_field_2) and every force field
+# object, including fields instanced on the vertices of a mesh (e.g. the standing wave harmonics and external force).
+# Animated strengths (e.g. the external force turning on and off) are sampled for every frame.
+# The whole simulation is calculated when the scene is built.  Each frame is written to a trajectory file on disk as it is
+# calculated (common/trajectory.py), and a frame change handler reads only the frame being viewed and writes its particle
+# locations to the particle systems, whose Blender physics is turned off.  Memory does not limit the number of frames.
+# Large systems calculate forces on all CPU cores (common/parallel.py).
+# Particle systems moved by Blender's solver can be recorded the same way (bake_scene).  Trajectory files may be kept in the
+# bake cache (common/cache.py), so that running the same configuration again replays them instead of simulating.
+# Bound clusters of particles can be tracked while frames are written (common/clusters.py).  Their event log is kept beside the
+# trajectory file, so cluster statistics never need the trajectory to be read again.
+#------------------------------------------------------------------------------------------------------
+
+import bpy
+import os
+import importlib
+import tempfile
+import numpy as np
+
+from common import engine
+importlib.reload(engine)
+from common import parallel
+importlib.reload(parallel)
+from common import octree
+importlib.reload(octree)
+from common import neighbors
+importlib.reload(neighbors)
+from common import cache
+importlib.reload(cache)
+from common import trajectory
+importlib.reload(trajectory)
+from common import clusters
+importlib.reload(clusters)
+
+
+# Trajectories of baked emitters by emitter name: the trajectory file reader and the emitter's range of particles in the file
+trajectories = {}
+
+# Directory of trajectory files that are not kept in the bake cache
+scratch_directory = os.path.join(tempfile.gettempdir(), "qscope")
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the values of an animated property for frames 0 to frames, or None if the property is not animated
+# id_data: the object or particle settings with the property
+# data_path: the path of the property, e.g. 'field.strength'
+# frames: the last frame to sample
+#------------------------------------------------------------------------------------------------------
+
+def sample_animation(id_data, data_path, frames):
+    if id_data.animation_data is None or id_data.animation_data.action is None:
+        return None
+    fcurve = id_data.animation_data.action.fcurves.find(data_path)
+    if fcurve is None:
+        return None
+    return np.array([fcurve.evaluate(frame) for frame in range(frames + 1)])
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns an engine field from Blender field settings (an object's field or a particle setting's force_field_1/2)
+# settings: the Blender FieldSettings
+# id_data: the object or particle settings the field belongs to, to sample its animation
+# data_path: the path of the field settings on id_data, e.g. 'field' or 'force_field_1'
+# frames: the last frame to sample
+#------------------------------------------------------------------------------------------------------
+
+def engine_field(settings, id_data, data_path, frames):
+    strength = settings.strength
+    scale = sample_animation(id_data, data_path + ".strength", frames)
+    if scale is not None:
+        strength = 1                                               # The sampled strengths are the scale of a unit field
+    return engine.field(settings.type, strength,
+        falloff_power=settings.falloff_power,
+        flow=settings.flow,
+        max_distance=settings.distance_max if settings.use_max_distance else 0,
+        damping=settings.harmonic_damping,
+        scale=scale)
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the world locations of a force field object.  Fields parented to a mesh that instances its vertices are at every vertex.
+#------------------------------------------------------------------------------------------------------
+
+def field_locations(o):
+    parent = o.parent
+    if parent is not None and parent.type == 'MESH' and parent.instance_type == 'VERTS':
+        vertices = np.empty(len(parent.data.vertices) * 3, dtype=np.float32)
+        parent.data.vertices.foreach_get("co", vertices)
+        matrix = np.array(parent.matrix_world)
+        offset = np.array(o.matrix_world.translation) - matrix[:3, 3]
+        return vertices.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3] + offset
+    return np.array([o.matrix_world.translation])
+
+
+#------------------------------------------------------------------------------------------------------
+# Adds every force field object of the scene to an engine system as static effectors.  Fields with the same settings and
+# animation (e.g. the nodes of a node grid) are added as one effector with many locations.
+# system: the engine system
+# frames: the last frame to sample animation
+#------------------------------------------------------------------------------------------------------
+
+def add_scene_effectors(system, frames):
+    effectors = {}
+    for o in bpy.context.scene.objects:
+        if o.field is None or o.field.type not in engine.effector_field_types:
+            continue
+        f = engine_field(o.field, o, "field", frames)
+        collections = frozenset(c.name for c in o.users_collection)
+
+        # Fields that only differ by strength are grouped; each location keeps its own strength
+        axis = tuple(np.round(np.array(o.matrix_world)[:3, 2], 6))        # The object's z axis (vortex and wind direction)
+        key = (f["type"], f["falloff_power"], f["flow"], f["max_distance"], f["damping"], collections, axis,
+            None if f["scale"] is None else f["scale"].tobytes())
+        locations = field_locations(o)
+        effector = effectors.setdefault(key, {"field": f, "collections": collections, "axis": axis, "locations": [], "strengths": []})
+        effector["locations"].append(locations)
+        effector["strengths"].append(np.full(len(locations), f["strength"]))
+
+    for effector in effectors.values():
+        f = dict(effector["field"], strength=1)
+        engine.add_effector(system, f, np.concatenate(effector["locations"]), np.concatenate(effector["strengths"]),
+            collections=effector["collections"], axis=effector["axis"])
+
+
+#------------------------------------------------------------------------------------------------------
+# Adds the particles of an emitter to an engine system.  Particles are emitted at rest from the surface of the emitter sphere.
+# system: the engine system
+# o: the emitter object
+# frames: the last frame to sample animation
+# seed (optional): the seed for the emission.  By default the seed of the particle system.
+#------------------------------------------------------------------------------------------------------
+
+def add_emitter_particles(system, o, frames, seed=None):
+    ps = o.particle_systems[0]
+    pset = ps.settings
+    radius = max(o.dimensions) / 2
+    positions = engine.emit_sphere(pset.count, radius, tuple(o.matrix_world.translation), seed=ps.seed if seed is None else seed)
+    fields = [engine_field(pset.force_field_1, pset, "force_field_1", frames),
+        engine_field(pset.force_field_2, pset, "force_field_2", frames)]
+    ew = pset.effector_weights
+    weights = {"all": ew.all, "CHARGE": ew.charge, "FORCE": ew.force, "HARMONIC": ew.harmonic, "LENNARDJ": ew.lennardjones,
+        "VORTEX": ew.vortex, "WIND": ew.wind}
+    return engine.add_particles(system, o.name, positions,
+        mass=pset.mass,
+        size=pset.particle_size,
+        fields=fields,
+        self_effect=pset.use_self_effect,
+        weights=weights,
+        collections=frozenset(c.name for c in o.users_collection),
+        effector_collection=ew.collection.name if ew.collection else None)
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the baked particle locations of an emitter at a frame, read from its trajectory file, or None if the emitter is not
+# replayed from a trajectory.  Other frame change handlers use this to read the locations of a frame without depending on the
+# order that handlers run in.
+# name: the name of the emitter
+# frame: the frame number
+#------------------------------------------------------------------------------------------------------
+
+def baked_locations(name, frame):
+    baked = trajectories.get(name)
+    o = bpy.data.objects.get(name)
+    if baked is None or o is None or not o.particle_systems or o.particle_systems[0].settings.physics_type != 'NO':
+        return None
+    reader = baked["reader"]
+    return trajectory.read_frame(reader, frame - reader["first_frame"])[baked["start"]:baked["end"]]
+
+
+#------------------------------------------------------------------------------------------------------
+# Writes the baked particle locations of the current frame to the particle systems.  Only the current frame is read from disk.
+#------------------------------------------------------------------------------------------------------
+
+def update_particles(scene, depsgraph=None):
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    for name in trajectories:
+        locations = baked_locations(name, scene.frame_current)
+        if locations is None:
+            continue
+        o = bpy.data.objects.get(name)
+        if o is None:
+            continue
+        particles = o.evaluated_get(depsgraph).particle_systems[0].particles
+        if len(particles) == len(locations):
+            particles.foreach_set("location", np.ascontiguousarray(locations).ravel())
+
+
+#------------------------------------------------------------------------------------------------------
+# Adds the frame change handler that writes baked locations to the particle systems.  Handlers from previous runs are
+# replaced, because this module is reloaded with each phase.
+#------------------------------------------------------------------------------------------------------
+
+def install_handler():
+    handlers = bpy.app.handlers.frame_change_post
+    for handler in [h for h in handlers if h.__name__ == update_particles.__name__]:
+        handlers.remove(handler)
+    handlers.append(update_particles)
+
+
+#------------------------------------------------------------------------------------------------------
+# Closes the trajectory files of the replayed emitters and forgets them.  Called when the simulation is reset, because the
+# frame change handler and this module's state outlive the emitters they refer to.
+#------------------------------------------------------------------------------------------------------
+
+def clear_trajectories():
+    readers = {id(baked["reader"]): baked["reader"] for baked in trajectories.values()}
+    for reader in readers.values():
+        trajectory.close_reader(reader)
+    trajectories.clear()
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the file of the cluster event log of a trajectory file.  Logs are keyed by the bond distance and the source of the
+# cluster tracker, so a log is not reused for another distance or after the tracker changes.
+#------------------------------------------------------------------------------------------------------
+
+def events_path(path, cluster_distance):
+    return path + "." + cache.key("clusters", float(cluster_distance), cache.source_hash(clusters))[:16] + ".events"
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the cluster event log file of a trajectory, tracking the clusters of the trajectory if it has no log for the distance
+# (e.g. a trajectory from the bake cache that was baked without tracking)
+# reader: the reader of the trajectory file
+# cluster_distance: the bond distance of clusters
+#------------------------------------------------------------------------------------------------------
+
+def cluster_events(reader, cluster_distance):
+    path = events_path(reader["path"], cluster_distance)
+    if not os.path.exists(path):
+        temporary = path + "." + str(os.getpid()) + ".tmp"
+        clusters.track(reader, cluster_distance, temporary)
+        os.replace(temporary, path)
+    return path
+
+
+#------------------------------------------------------------------------------------------------------
+# Writes frames to a trajectory file as they are calculated, and adds the file to the bake cache when it is complete
+# frames: an iterable of (positions, velocities) for each frame, e.g. from the engine's steps
+# count: the number of particles
+# first_frame: the Blender frame of the first frame
+# groups: the range of particles of each emitter by name, {name: [start, end]}
+# entry_key (optional): the bake cache key.  Without a key the file is kept outside of the cache until the next bake of the same emitters.
+# cache_budget (optional): the size budget of the bake cache in bytes
+# cluster_distance (optional): if set, bound clusters of particles are tracked as frames are written and their event log is saved
+#     beside the trajectory file (see events_path).  The path of the log is the reader's "events".
+# RETURNS the reader of the written file
+#------------------------------------------------------------------------------------------------------
+
+def write_trajectory(frames, count, first_frame, groups, entry_key=None, cache_budget=cache.default_budget, cluster_distance=0):
+    if entry_key:
+        path = cache.writing_path(entry_key)
+    else:
+        os.makedirs(scratch_directory, exist_ok=True)
+        scratch = os.path.join(scratch_directory, cache.key(sorted(groups)) + ".traj")
+        path = scratch + "." + str(os.getpid()) + ".tmp"
+    writer = trajectory.open_writer(path, count, first_frame, {"groups": groups})
+    tracker = clusters.create_tracker(count, cluster_distance, first_frame, path + ".events.tmp") if cluster_distance else None
+    try:
+        for positions, velocities in frames:
+            trajectory.write_frame(writer, positions, velocities)
+            if tracker:
+                clusters.update(tracker, positions)
+    except BaseException:
+        trajectory.close_writer(writer)
+        os.remove(path)
+        if tracker:
+            clusters.finish(tracker)
+            os.remove(tracker["path"])
+        raise
+    trajectory.close_writer(writer)
+    if tracker:
+        clusters.finish(tracker)
+
+    # Files are renamed into place, so that a file still mapped by the previous bake keeps its contents
+    if entry_key:
+        path = cache.commit(path, entry_key, budget=cache_budget)
+    else:
+        os.replace(path, scratch)
+        path = scratch
+    reader = trajectory.open_reader(path)
+    if tracker:
+        reader["events"] = events_path(path, cluster_distance)
+        os.replace(tracker["path"], reader["events"])
+    return reader
+
+
+#------------------------------------------------------------------------------------------------------
+# Replaces the Blender physics of emitters with the trajectories of a trajectory file and installs the frame change handler
+# reader: the reader of the trajectory file, with the range of particles of each emitter in its metadata
+#------------------------------------------------------------------------------------------------------
+
+def replay(reader):
+    for name, (start, end) in reader["metadata"]["groups"].items():
+        trajectories[name] = {"reader": reader, "start": start, "end": end}
+        o = bpy.data.objects.get(name)
+        if o is not None and o.particle_systems:
+            o.particle_systems[0].settings.physics_type = 'NO'
+    install_handler()
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the cluster statistics (see clusters.statistics) of the replayed trajectories that have a cluster event log, by the
+# names of their emitters
+#------------------------------------------------------------------------------------------------------
+
+def cluster_statistics():
+    readers = {id(baked["reader"]): baked["reader"] for baked in trajectories.values() if "events" in baked["reader"]}
+    return {", ".join(sorted(reader["metadata"]["groups"])): clusters.statistics(clusters.read_events(reader["events"]))
+        for reader in readers.values()}
+
+
+#------------------------------------------------------------------------------------------------------
+# Bakes emitters with the particle engine and replaces their Blender physics with the baked locations
+# names: the names of the emitter objects to bake together (they act on each other)
+# frames: the number of frames to bake
+# seed (optional): the seed for emitting particles (each emitter adds its position in names).  By default each emitter's particle system seed is used.
+# substeps (optional): the number of engine steps per frame
+# backend (optional): the engine backend for charge and force fields ('direct', 'octree' or 'auto')
+# theta (optional): the opening angle of the octree backend
+# workers (optional): the number of processes calculating forces (0 for the number of CPUs).  Small systems use one process.
+# use_cache (optional): if True, the trajectories are loaded from the bake cache when the same system was baked before, and stored otherwise
+# cache_budget (optional): the size budget of the bake cache in bytes
+# cluster_distance (optional): if set, bound clusters of the particles are tracked (see write_trajectory)
+# RETURNS the engine system after the last frame
+#------------------------------------------------------------------------------------------------------
+
+def bake_emitters(names, frames, seed=None, substeps=1, backend="auto", theta=0.5, workers=1, use_cache=False, cache_budget=cache.default_budget, cluster_distance=0):
+    emitters = [bpy.data.objects[name] for name in names]
+    settings = emitters[0].particle_systems[0].settings
+    system = engine.create_system(timestep=settings.timestep, substeps=substeps, backend=backend, theta=theta)
+    system["frame"] = first_frame = int(settings.frame_start)
+
+    groups = [add_emitter_particles(system, o, frames, None if seed is None else seed + i) for i, o in enumerate(emitters)]
+    add_scene_effectors(system, frames)
+
+    # The engine is deterministic, so the system before the run (which includes the emitted positions of each seed) and the engine code identify the result.
+    # Octree forces depend on how particles are split between workers, so the number of workers is part of the key.
+    entry_key = cache.key("engine", dict(system, neighbors=None), frames, workers or os.cpu_count(),
+        cache.source_hash(engine, octree, neighbors)) if use_cache else None
+    path = cache.lookup(entry_key) if entry_key else None
+    if path is not None:
+        reader = trajectory.open_reader(path)
+        system["positions"] = trajectory.read_frame(reader, frames).astype(np.float64)
+        system["velocities"] = trajectory.read_frame(reader, frames, "velocities").astype(np.float64)
+        system["frame"] += frames
+        if cluster_distance:
+            reader["events"] = cluster_events(reader, cluster_distance)
+    else:
+        steps = ((state["positions"], state["velocities"]) for state in parallel.steps(system, frames, workers))
+        reader = write_trajectory(steps, len(system["positions"]), first_frame,
+            {o.name: [group["start"], group["end"]] for o, group in zip(emitters, groups)}, entry_key, cache_budget, cluster_distance)
+    replay(reader)
+    return system
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the particle locations and velocities of emitters at the current frame, as one array of each for all emitters
+#------------------------------------------------------------------------------------------------------
+
+def scene_particles(emitters):
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    locations = []
+    velocities = []
+    for o in emitters:
+        particles = o.evaluated_get(depsgraph).particle_systems[0].particles
+        for values, attribute in ((locations, "location"), (velocities, "velocity")):
+            array = np.empty(len(particles) * 3, dtype=np.float32)
+            particles.foreach_get(attribute, array)
+            values.append(array.reshape(-1, 3))
+    return np.concatenate(locations), np.concatenate(velocities)
+
+
+#------------------------------------------------------------------------------------------------------
+# Bakes the particle systems moved by Blender's solver by stepping every frame and recording the particles to a trajectory
+# file, then replaces their physics with the recorded locations.  Particle systems already baked by the particle engine are not recorded.
+# entry_key (optional): the bake cache key of the scene (e.g. from runner.scene_key).  If the cache has the key, its
+#     trajectories are replayed without stepping any frames; otherwise the recorded trajectories are stored with the key.
+# cache_budget (optional): the size budget of the bake cache in bytes
+# cluster_distance (optional): if set, bound clusters of the particles are tracked (see write_trajectory)
+# RETURNS True if the trajectories were loaded from the cache
+#------------------------------------------------------------------------------------------------------
+
+def bake_scene(entry_key=None, cache_budget=cache.default_budget, cluster_distance=0):
+    scene = bpy.context.scene
+    emitters = [o for o in scene.objects if o.particle_systems and o.particle_systems[0].settings.physics_type != 'NO']
+    if not emitters:
+        return False
+    path = cache.lookup(entry_key) if entry_key else None
+    reader = trajectory.open_reader(path) if path else None
+    cached = reader is not None and all(o.name in reader["metadata"]["groups"] for o in emitters)
+
+    if not cached:
+        scene.frame_set(scene.frame_start)
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        counts = np.cumsum([0] + [len(o.evaluated_get(depsgraph).particle_systems[0].particles) for o in emitters])
+        groups = {o.name: [int(counts[i]), int(counts[i + 1])] for i, o in enumerate(emitters)}
+
+        # Frames are recorded while Blender steps through them
+        def frames():
+            for frame in range(scene.frame_start, scene.frame_end + 1):
+                scene.frame_set(frame)
+                yield scene_particles(emitters)
+        reader = write_trajectory(frames(), int(counts[-1]), scene.frame_start, groups, entry_key, cache_budget, cluster_distance)
+    elif cluster_distance:
+        reader["events"] = cluster_events(reader, cluster_distance)
+    replay(reader)
+    return cached
@@ -0,0 +1,273 @@
+# Benchmark
+
+#------------------------------------------------------------------------------------------------------
+# BENCHMARK SUITE
+# Measures the performance of building and baking every phase across scaled inputs, so that performance work can be measured
+# and regressions are caught.  Each case runs in its own background Blender process through common/runner.py (the same as a
+# sweep configuration, see common/sweep.py) and records:
+#   build_time: the seconds to build the scene
+#   bake_time_per_frame: the seconds to bake each frame
+#   peak_memory: the peak resident memory of the Blender process in bytes
+#   objects, datablocks: the number of objects and datablocks of the scene
+# Every run is appended to a JSON history.  Each case is compared to the median of the previous runs on the same machine and
+# Blender version, and is a regression when a measure is worse by more than its threshold.
+#
+#   python -m common.benchmark --output benchmarks/ --check
+#   python -m common.benchmark --output benchmarks/ --phase 4 --quick
+#
+# Cases run one at a time by default, so that they do not compete for the CPU and memory being measured.
+# This module does not import bpy; it runs outside of Blender and starts Blender for each case.
+#------------------------------------------------------------------------------------------------------
+
+import sys
+import os
+import argparse
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+from common import sweep
+from phase3 import equilibrium
+
+
+# External force strength of each Phase 5 condition (ext_force_enum in the UI)
+ext_force_conditions = {"Normal": 100, "Nuclear": 100000, "Collider": 1000000, "Supernova": 10000000}
+
+# Measures recorded for each case, and the ratio to the baseline above which a measure is a regression.  Changes smaller than
+# the noise floor are never regressions, so that short timings and small scenes do not fail on noise.
+thresholds = {"build_time": 1.25, "bake_time_per_frame": 1.25, "peak_memory": 1.15, "objects": 1.0, "datablocks": 1.0}
+noise_floor = {"build_time": 0.05, "bake_time_per_frame": 0.0005, "peak_memory": 32 * 1024 ** 2, "objects": 0, "datablocks": 0}
+
+# The number of previous runs that the baseline of each case is the median of
+baseline_runs = 5
+
+# The number of frames baked for each case.  Fewer frames than the UI default keep the suite short.
+default_frames = 250
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the benchmark cases: a list of (case name, phase, settings)
+# quick (optional): if True, only the smallest and largest inputs of each phase are included
+#------------------------------------------------------------------------------------------------------
+
+def benchmark_cases(quick=False):
+    def scale(values):
+        return [values[0], values[-1]] if quick else values
+
+    cases = []
+    for length in scale([10, 30, 50]):
+        for dimensions in scale(['1', '2', '3']):
+            cases.append(("phase1-length" + str(length) + "-" + dimensions + "d", 1, {"spacetime_length": length, "dimensions_enum": dimensions}))
+    for neutrinos in scale([1, 10, 50, 100, 200]):
+        cases.append(("phase2-neutrinos" + str(neutrinos), 2, {"neutrinos": neutrinos}))
+    for name, (electrons, positrons, free) in composite_cases(quick):
+        cases.append(("phase3-" + name.lower().replace(" ", "-").replace("(", "").replace(")", ""), 3,
+            {"electrons_nucleons": electrons + free, "positrons": positrons}))
+    for protons in scale([1, 5, 10, 20]):
+        for cloud in (False, True):
+            cases.append(("phase4-protons" + str(protons) + ("-cloud" if cloud else ""), 4,
+                {"protons": protons, "electrons_atoms": protons, "neutrons": 0 if protons == 1 else protons, "show_electron_cloud": cloud}))
+    for atoms in scale([1, 10, 50, 100]):
+        for condition, strength in ext_force_conditions.items():
+            cases.append(("phase5-atoms" + str(atoms) + "-" + condition.lower(), 5, {"hydrogen_atoms": atoms, "ext_force_strength_molecules": strength}))
+    return cases
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the composite particles of Phase 3 to benchmark (every combination, or the smallest and largest when quick)
+#------------------------------------------------------------------------------------------------------
+
+def composite_cases(quick=False):
+    cases = list(equilibrium.composite_particles.items())
+    return [cases[0], cases[-1]] if quick else cases
+
+
+#------------------------------------------------------------------------------------------------------
+# Runs one case and returns its measures
+# phase: the phase number (1 to 5)
+# settings: the settings of the case
+# directory: the output directory of the case
+# blender (optional): the Blender executable
+# threads (optional): the number of threads for Blender to use
+# repeat (optional): the number of times the case is run.  The fastest time and the lowest memory of the runs are kept.
+# RETURNS a dictionary of the status and measures of the case
+#------------------------------------------------------------------------------------------------------
+
+def run_case(phase, settings, directory, blender="blender", threads=1, repeat=1):
+    measures = {}
+    for run in range(repeat):
+        row = sweep.run_configuration(phase, settings, directory, blender, threads)
+        if row["status"] != "ok":
+            return {"status": row["status"]}
+        with open(os.path.join(directory, "results.json")) as f:
+            results = json.load(f)
+        current = {
+            "build_time": results["build_time"],
+            "bake_time_per_frame": results["bake_time"] / results["frames"] if results["frames"] else None,
+            "peak_memory": results.get("peak_memory"),
+            "objects": results["objects"],
+            "datablocks": sum(results.get("datablocks", {}).values()),
+            "blender": results.get("blender"),
+        }
+        for name, value in current.items():
+            if name not in measures or measures[name] is None:
+                measures[name] = value
+            elif value is not None and name in thresholds:
+                measures[name] = min(measures[name], value)
+    measures["status"] = "ok"
+    return measures
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the commit of the project directory, or None if it is not a git repository
+#------------------------------------------------------------------------------------------------------
+
+def current_commit():
+    try:
+        process = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=sweep.project_dir, capture_output=True, text=True)
+    except OSError:
+        return None
+    return process.stdout.strip() if process.returncode == 0 else None
+
+
+#------------------------------------------------------------------------------------------------------
+# Reads the history of benchmark runs (an empty list if there is no history yet)
+#------------------------------------------------------------------------------------------------------
+
+def read_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the baseline of a case: the median of each measure over the previous runs of the case on the same machine and Blender
+# version, or None if there are no previous runs
+# history: the previous runs
+# name: the case name
+# run: the current run, whose machine and Blender version are matched
+#------------------------------------------------------------------------------------------------------
+
+def baseline(history, name, run):
+    previous = [r["cases"][name] for r in history if r["machine"] == run["machine"] and name in r["cases"]
+        and r["cases"][name]["status"] == "ok" and r["cases"][name].get("blender") == run["cases"][name].get("blender")][-baseline_runs:]
+    if not previous:
+        return None
+    medians = {}
+    for measure in thresholds:
+        values = [case[measure] for case in previous if case.get(measure) is not None]
+        medians[measure] = statistics.median(values) if values else None
+    return medians
+
+
+#------------------------------------------------------------------------------------------------------
+# Compares a run to the history and returns its regressions: a list of (case name, measure, baseline, value)
+#------------------------------------------------------------------------------------------------------
+
+def regressions(history, run):
+    found = []
+    for name, case in run["cases"].items():
+        if case["status"] != "ok":
+            continue
+        base = baseline(history, name, run)
+        if base is None:
+            continue
+        for measure, ratio in thresholds.items():
+            value, reference = case.get(measure), base[measure]
+            if value is None or reference is None:
+                continue
+            if value > reference * ratio and value - reference > noise_floor[measure]:
+                found.append((name, measure, reference, value))
+    return found
+
+
+#------------------------------------------------------------------------------------------------------
+# Runs the benchmark suite and appends it to the history
+# output: the directory for the history (history.json) and the outputs of each case
+# phases (optional): the phases to benchmark (all by default)
+# quick (optional): if True, only the smallest and largest inputs of each phase are run
+# frames (optional): the number of frames baked for each case
+# blender (optional): the Blender executable
+# threads (optional): the number of threads for each Blender process
+# workers (optional): the number of cases run at once.  More than one is faster but the measures are less reliable.
+# repeat (optional): the number of times each case is run
+# RETURNS (run, regressions) - the run added to the history and its regressions
+#------------------------------------------------------------------------------------------------------
+
+def run_benchmarks(output, phases=(1, 2, 3, 4, 5), quick=False, frames=default_frames, blender="blender", threads=1, workers=1, repeat=1):
+    cases = [case for case in benchmark_cases(quick) if case[1] in phases]
+    print("Benchmark: " + str(len(cases)) + " cases on " + str(workers) + " workers")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {name: pool.submit(run_case, phase, dict(settings, num_frames=frames), os.path.join(output, "cases", name), blender, threads, repeat)
+            for name, phase, settings in cases}
+        results = {name: future.result() for name, future in futures.items()}
+
+    run = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": current_commit(),
+        "machine": platform.node() + " (" + platform.machine() + ")",
+        "frames": frames,
+        "cases": results,
+    }
+    history_path = os.path.join(output, "history.json")
+    history = read_history(history_path)
+    found = regressions(history, run)
+    os.makedirs(output, exist_ok=True)
+    with open(history_path, "w") as f:
+        json.dump(history + [run], f, indent=2)
+    return run, found
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the measures of a run as a text table
+#------------------------------------------------------------------------------------------------------
+
+def format_run(run):
+    lines = ["{:<36} {:>10} {:>16} {:>12} {:>8} {:>11}".format("Case", "Build (s)", "Bake (ms/frame)", "Peak (MB)", "Objects", "Datablocks")]
+    for name, case in run["cases"].items():
+        if case["status"] != "ok":
+            lines.append("{:<36} {}".format(name, case["status"]))
+            continue
+        bake = case["bake_time_per_frame"] * 1000 if case["bake_time_per_frame"] is not None else float("nan")
+        peak = case["peak_memory"] / 1024 ** 2 if case["peak_memory"] is not None else float("nan")
+        lines.append("{:<36} {:>10.3f} {:>16.3f} {:>12.1f} {:>8} {:>11}".format(name, case["build_time"], bake, peak, case["objects"], case["datablocks"]))
+    return "\n".join(lines)
+
+
+#------------------------------------------------------------------------------------------------------
+# Command line entry point
+#------------------------------------------------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark building and baking the Quantum Microscope phases")
+    parser.add_argument("--output", required=True, help="directory for the history (history.json) and the outputs of each case")
+    parser.add_argument("--phase", type=int, action="append", choices=[1, 2, 3, 4, 5], help="a phase to benchmark (may be repeated; default all)")
+    parser.add_argument("--quick", action="store_true", help="only run the smallest and largest inputs of each phase")
+    parser.add_argument("--frames", type=int, default=default_frames, help="frames baked for each case")
+    parser.add_argument("--blender", default="blender", help="the Blender executable")
+    parser.add_argument("--threads", type=int, default=1, help="threads per Blender process")
+    parser.add_argument("--workers", type=int, default=1, help="cases run at once (more is faster but less reliable)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs of each case; the best measures are kept")
+    parser.add_argument("--check", action="store_true", help="exit with an error if a case failed or regressed")
+    args = parser.parse_args(argv)
+
+    run, found = run_benchmarks(args.output, phases=args.phase or (1, 2, 3, 4, 5), quick=args.quick, frames=args.frames,
+        blender=args.blender, threads=args.threads, workers=args.workers, repeat=args.repeat)
+    print(format_run(run))
+    for name, measure, reference, value in found:
+        print("Regression: " + name + " " + measure + " " + format(reference, ".4g") + " -> " + format(value, ".4g")
+            + " (threshold x" + str(thresholds[measure]) + ")")
+    failed = [name for name, case in run["cases"].items() if case["status"] != "ok"]
+    print("Benchmark complete: " + str(len(run["cases"]) - len(failed)) + " ok, " + str(len(failed)) + " failed, "
+        + str(len(found)) + " regressions. History in " + os.path.join(args.output, "history.json"))
+    return 1 if args.check and (failed or found) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
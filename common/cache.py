@@ -0,0 +1,177 @@
+# Cache
+
+#------------------------------------------------------------------------------------------------------
+# BAKE CACHE
+# Stores baked particle trajectories on disk, addressed by a hash of everything that determines them: the effective
+# configuration (the common.config module after a phase has changed it), the particle system seeds, the settings of the
+# run and the source code of the modules that calculate the simulation.  Running an identical configuration again loads
+# the trajectories instead of simulating them.  Any change to a setting, a seed or the code gives a different key, so an
+# entry never needs to be invalidated.
+# Entries are trajectory files (common/trajectory.py) that are written while the simulation runs and then moved into the
+# cache.  The least recently used entries are deleted when the cache is larger than its size budget.
+# This module does not import bpy so that it can be used outside of Blender.
+#------------------------------------------------------------------------------------------------------
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+# Default directory and size budget (bytes) of the cache.  The cache is kept in the user's temporary directory (beside the
+# scratch files of common/bake.py) rather than the add-on directory, which may be read-only when the add-on is installed.
+default_directory = os.path.join(tempfile.gettempdir(), "qscope", "bake_cache")
+default_budget = 1024 ** 3
+
+
+#------------------------------------------------------------------------------------------------------
+# Adds a value to a hash in a canonical form: dictionaries in key order, arrays by type, shape and contents, and
+# floats by their exact representation.  Values of different types never hash the same.
+#------------------------------------------------------------------------------------------------------
+
+def _update(h, value):
+    if isinstance(value, dict):
+        h.update(b"d%d" % len(value))
+        for k in sorted(value, key=repr):
+            _update(h, k)
+            _update(h, value[k])
+    elif isinstance(value, (list, tuple)):
+        h.update(b"l%d" % len(value))
+        for item in value:
+            _update(h, item)
+    elif isinstance(value, (set, frozenset)):
+        _update(h, sorted(value, key=repr))
+    elif isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        h.update(b"a" + value.dtype.str.encode() + repr(value.shape).encode())
+        h.update(value.tobytes())
+    else:
+        h.update(type(value).__name__.encode() + b":" + repr(value).encode() + b";")
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the cache key of a set of values: a hex digest of their canonical form
+# parts: any values (numbers, strings, lists, dictionaries, sets or NumPy arrays)
+#------------------------------------------------------------------------------------------------------
+
+def key(*parts):
+    h = hashlib.sha256()
+    _update(h, parts)
+    return h.hexdigest()
+
+
+# Types of values that are part of a module's state.  Other values (modules, functions, Blender data such as the screen areas
+# left in config's loop variables) do not define the configuration, and their representation changes between sessions.
+state_types = (bool, int, float, complex, str, bytes, type(None), tuple, list, dict, set, frozenset, np.ndarray, np.generic)
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the state of a module as a dictionary of its public variables, e.g. the effective config after a phase changed it.
+# exclude (optional): names of variables that are not part of the state (e.g. the cache's own settings)
+#------------------------------------------------------------------------------------------------------
+
+def module_state(module, exclude=()):
+    return {name: value for name, value in vars(module).items()
+        if not name.startswith("_") and name not in exclude and isinstance(value, state_types)}
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns a hash of the source files of modules, so that cache entries are not reused after the code changes
+#------------------------------------------------------------------------------------------------------
+
+def source_hash(*modules):
+    h = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the file of a cache entry
+#------------------------------------------------------------------------------------------------------
+
+def entry_path(entry_key, directory=default_directory):
+    return os.path.join(directory, entry_key + ".traj")
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the file of a cache entry and marks it as recently used, or None if there is no entry
+# entry_key: the key returned by key
+# directory (optional): the cache directory
+#------------------------------------------------------------------------------------------------------
+
+def lookup(entry_key, directory=default_directory):
+    path = entry_path(entry_key, directory)
+    try:
+        os.utime(path)                                                  # The modification time orders entries by last use
+    except OSError:
+        return None
+    return path
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns a temporary file to write a new entry to.  The entry is added to the cache by commit when it is complete.
+# entry_key: the key returned by key
+# directory (optional): the cache directory
+#------------------------------------------------------------------------------------------------------
+
+def writing_path(entry_key, directory=default_directory):
+    os.makedirs(directory, exist_ok=True)
+    return entry_path(entry_key, directory) + "." + str(os.getpid()) + ".tmp"
+
+
+#------------------------------------------------------------------------------------------------------
+# Adds a completely written file to the cache, then deletes the least recently used entries if the cache is over its budget.
+# The file is renamed into place, so other processes never read a partly written entry, and an entry that is being read
+# (memory mapped) when it is replaced keeps its contents until it is closed.
+# temporary: the file returned by writing_path
+# entry_key: the key returned by key
+# directory (optional): the cache directory
+# budget (optional): the largest total size of the cache in bytes
+# RETURNS the file of the entry
+#------------------------------------------------------------------------------------------------------
+
+def commit(temporary, entry_key, directory=default_directory, budget=default_budget):
+    path = entry_path(entry_key, directory)
+    os.replace(temporary, path)
+    evict(directory, budget, keep=path)
+    return path
+
+
+#------------------------------------------------------------------------------------------------------
+# Deletes the least recently used entries until the cache is within its budget, with the files kept beside them (e.g. cluster
+# event logs, named after the entry's file).  Files that are being written are not deleted.
+# directory (optional): the cache directory
+# budget (optional): the largest total size of the cache in bytes
+# keep (optional): the path of an entry that is not deleted (e.g. the entry just stored)
+# RETURNS the number of entries deleted
+#------------------------------------------------------------------------------------------------------
+
+def evict(directory=default_directory, budget=default_budget, keep=None):
+    entries = []
+    names = os.listdir(directory) if os.path.isdir(directory) else []
+    for name in names:
+        path = os.path.join(directory, name)
+        if name.endswith(".traj"):
+            status = os.stat(path)
+            entries.append((status.st_mtime, status.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    deleted = 0
+    for _, size, path in sorted(entries):
+        if total <= budget:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        for name in names:
+            if name.startswith(os.path.basename(path) + ".") and name.endswith(".events"):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+        total -= size
+        deleted += 1
+    return deleted
@@ -0,0 +1,392 @@
+# Calculations
+
+#------------------------------------------------------------------------------------------------------
+# EWT CALCULATION TABLES
+# The values shown by "Show Calculations" in each phase, precomputed as NumPy arrays: the energy, radius and charge of a
+# particle for every K (number of neutrinos at its core), the neutrino and proton values, and the orbital distances and
+# energies of every atom and ion (common/data.py, with atoms heavier than calcium from the orbital solver in common/orbitals.py).
+# Tables are built once, when they are first queried, and query returns the values of one configuration by indexing the
+# arrays, so phases and batch exports do not recalculate them.  A query of one atom only looks up (or solves) that atom, so
+# phases never build the whole atom table.  Queries of every atom (e.g. ionization_energies) are single array expressions on the table.
+#
+#   python -m common.calculations --table particles --max-neutrinos 1000 --output particles.csv
+#   python -m common.calculations --table atoms --max-protons 118 --output atoms.npz
+#
+# writes a table to CSV (one row per configuration) or a compressed NumPy file of its arrays, without building a Blender scene.
+# Equations are from https://energywavetheory.com/equations/ (see the phases that display them).
+# This module does not import bpy so that it can be used outside of Blender.
+#------------------------------------------------------------------------------------------------------
+
+import sys
+import argparse
+import csv
+import importlib
+import numpy as np
+
+from common import config
+importlib.reload(config)
+from common import data
+importlib.reload(data)
+from common import orbitals
+importlib.reload(orbitals)
+
+
+# Largest K of the particle table when it is first built.  Querying a larger K rebuilds the table up to that K.
+default_max_neutrinos = 200
+
+# Conversion from joules to electron-volts (eV)
+joules_to_ev = 6.242e+18
+
+# Orbitals of the atom table, in the order of the fill sequence
+orbital_names = data.orbital_names
+
+# Atoms in the data file's tables (hydrogen to calcium).  Heavier atoms are calculated by the orbital solver.
+data_protons = data.orbital_count.shape[1] - 1
+
+# Tables that have been built, by name
+tables = {}
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the table of particles with K = 0 to max_neutrinos, indexed by K.  Values are in the order the phases calculate them.
+# neutrinos: K
+# wavelength: the standing wavelength at the particle core in the simulation (K neutrino wavelengths)
+# radius: the particle radius (m) - the simulation's fundamental wavelength of 2 is scaled to the fundamental wavelength
+# shell_multiplier: the sum of the wave centers added by each shell n, (n^3 - (n-1)^3) / n^4, for n = 1 to K
+# energy: the particle energy (eV) from https://energywavetheory.com/subatomic-particles/equation/
+# charge: the core charge of the particle in the simulation (constructive wave interference of K neutrinos)
+#------------------------------------------------------------------------------------------------------
+
+def particle_table(max_neutrinos=default_max_neutrinos):
+    k = np.arange(max_neutrinos + 1)
+    n = k[1:]
+    shell_multiplier = np.zeros(len(k))
+    shell_multiplier[1:] = np.cumsum((n ** 3 - (n - 1) ** 3) / n ** 4)
+    wavelength = k * config.neutrino_wavelength
+    table = {
+        "neutrinos": k,
+        "wavelength": wavelength,
+        "radius": config.fundamental_wavelength * k * wavelength / 2,
+        "shell_multiplier": shell_multiplier,
+        "energy": config.fundamental_energy * k.astype(np.float64) ** 5 * shell_multiplier,
+        "charge": config.neutrino_charge * k,
+    }
+    return table
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the values of a single neutrino (Phase 1)
+# radius: the neutrino standing wavelength (m), which is the fundamental wavelength
+# energy_joules: the energy of the neutrino's standing wave granules (J)
+# energy: the same energy in eV
+#------------------------------------------------------------------------------------------------------
+
+def neutrino_table():
+    energy_joules = ( (4/3) * config.pi * config.fundamental_density * (config.fundamental_amplitude ** 6) * config.fundamental_wavespeed ** 2 ) / (config.fundamental_wavelength_no_gfactor ** 3)
+    table = {
+        "radius": config.fundamental_wavelength,
+        "energy_joules": energy_joules,
+        "energy": energy_joules * joules_to_ev,
+    }
+    return table
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the values of the proton (Phase 3), made of electrons (K=10) and a positron.  See https://energywavetheory.com/physics-constants/proton-radius
+# radius_simulation: the proton radius in the simulation
+# radius: the proton radius (m)
+# attractive_force: Coulomb force of the positron (J*m), decreasing at 1/r^2
+# repelling_force: orbital force (J*m^2), decreasing at 1/r^3
+#------------------------------------------------------------------------------------------------------
+
+def proton_table():
+    radius_simulation = (10 * config.neutrino_wavelength * 5) * ((3/8) ** (1/2))
+    table = {
+        "radius_simulation": radius_simulation,
+        "radius": radius_simulation / 2 * config.fundamental_wavelength_no_gfactor,
+        "attractive_force": config.electron_energy * config.electron_radius,
+        "repelling_force": config.electron_energy * (config.electron_radius ** 2) / (config.fine_structure ** 2),
+    }
+    return table
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the name of an atom or ion, e.g. "Li" or "Li1+"
+#------------------------------------------------------------------------------------------------------
+
+def atom_name(protons, electrons):
+    if electrons == protons:
+        return data.atoms[protons]
+    return data.atoms[protons] + str(protons - electrons) + "+"
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the orbital distances (m) and energies (J) from orbital ratios and amplitude factors.  Orbital energy is based on
+# Coulomb's law: constructive wave interference divided by the radius.  Energies are 0 where there is no orbital.
+#------------------------------------------------------------------------------------------------------
+
+def orbital_values(ratio, amplitude):
+    distance = ratio * config.bohr_radius
+    energy_constants = (1/2) * config.coulomb_constant * config.elementary_charge ** 2
+    energy = np.divide(energy_constants * amplitude, distance, out=np.zeros(distance.shape), where=distance != 0)
+    return distance, energy
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the table of atoms and ions up to max_protons, indexed by [electrons, protons] like the data file's arrays.
+# Electrons go one past max_protons; the last electron index stands for any count with more electrons than protons.
+# Values are from the data file (common/data.py) for atoms up to calcium.  Atoms and ions heavier than calcium, or every atom if
+# config.orbital_solver is set, are calculated together by the orbital solver (common/orbitals.py).  Ions up to calcium that are not
+# in the data file (more than 12 electrons) are not supported unless config.orbital_solver is set, because the errors of their
+# values exceed 10% (see the Phase 4 README).
+# name: the atom name, e.g. "Li" or "Li1+", or "Atom not supported"
+# supported: False if the configuration is not an atom or ion (no electrons, or more electrons than protons), or is an ion up to
+#     calcium that is not in the data file.  Unsupported configurations have the values of the neutral atom, which is what Phase 4
+#     shows for them.
+# solved: True if the values are from the orbital solver instead of the data file
+# orbitals: the number of orbitals of the configuration
+# ratio: (orbitals,) orbital distances relative to the Bohr radius, 0 beyond the number of orbitals
+# amplitude: (orbitals,) constructive wave interference factors of the orbital energies
+# distance: (orbitals,) orbital distances (m)
+# energy: (orbitals,) orbital energies (J) from Coulomb's law, 0 where there is no orbital
+#------------------------------------------------------------------------------------------------------
+
+def atom_table(max_protons=data_protons):
+    max_protons = max(max_protons, data_protons)
+    shape = (max_protons + 2, max_protons + 1)
+    name = np.full(shape, "Atom not supported", dtype=object)
+    supported = np.zeros(shape, dtype=bool)
+    solved = np.zeros(shape, dtype=bool)
+    counts = np.zeros(shape, dtype=np.int64)
+    ratio = np.zeros(shape + (len(orbital_names),))
+    amplitude = np.zeros(shape + (len(orbital_names),))
+
+    # Atoms and ions in the data file
+    electrons, protons, file_orbitals = data.orbital_ratio.shape
+    ratio[:electrons, :protons, :file_orbitals] = data.orbital_ratio
+    amplitude[:electrons, :protons, :file_orbitals] = data.amplitude_ratio
+    counts[:electrons, :protons] = data.orbital_count
+    supported[:electrons, :protons] = data.orbital_count > 0
+
+    # Atoms and ions heavier than the data file (or every atom) are solved
+    electrons, protons = np.nonzero((np.arange(shape[0])[:, None] >= 1) & (np.arange(shape[0])[:, None] <= np.arange(shape[1])[None, :]))
+    if not config.orbital_solver:
+        keep = protons > data_protons
+        electrons, protons = electrons[keep], protons[keep]
+    for e, z, atom in zip(electrons, protons, orbitals.solve_atoms(protons, electrons)):
+        ratio[e, z] = atom["ratio"]
+        amplitude[e, z] = atom["amplitude"]
+        counts[e, z] = atom["orbitals"]
+        supported[e, z] = solved[e, z] = True
+    for z in range(1, shape[1]):
+        name[1:z + 1, z] = np.where(supported[1:z + 1, z], [atom_name(z, e) for e in range(1, z + 1)], "Atom not supported")
+
+    # Unsupported configurations have the values of the neutral atom
+    unsupported = ~supported
+    unsupported[:, 0] = False
+    protons = np.nonzero(unsupported)[1]
+    ratio[unsupported] = ratio[protons, protons]
+    amplitude[unsupported] = amplitude[protons, protons]
+    counts[unsupported] = counts[protons, protons]
+    solved[unsupported] = solved[protons, protons]
+
+    distance, energy = orbital_values(ratio, amplitude)
+    table = {
+        "name": name,
+        "supported": supported,
+        "solved": solved,
+        "orbitals": counts,
+        "ratio": ratio,
+        "amplitude": amplitude,
+        "distance": distance,
+        "energy": energy,
+    }
+    return table
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the values of one atom or ion, the same as its entry in the atom table (see atom_table), without building the table.
+# Atoms from the orbital solver are solved alone, or read from the solver's cache (see common/orbitals.py).
+# protons: the number of protons (Z)
+# electrons: the number of electrons
+#------------------------------------------------------------------------------------------------------
+
+def atom_values(protons, electrons):
+    use_solver = config.orbital_solver or protons > data_protons
+    if not 1 <= electrons <= protons or not (use_solver or data.orbital_count[electrons, protons] > 0):
+        values = atom_values(protons, protons)                          # Unsupported configurations have the values of the neutral atom
+        values["name"] = "Atom not supported"
+        values["supported"] = False
+        return values
+
+    if use_solver:
+        atom = orbitals.solve(protons, electrons)
+        ratio, amplitude, count = atom["ratio"], atom["amplitude"], atom["orbitals"]
+    else:
+        padding = (0, len(orbital_names) - data.orbital_ratio.shape[2])
+        ratio = np.pad(data.orbital_ratio[electrons, protons], padding)
+        amplitude = np.pad(data.amplitude_ratio[electrons, protons], padding)
+        count = int(data.orbital_count[electrons, protons])
+    distance, energy = orbital_values(ratio, amplitude)
+    values = {
+        "name": atom_name(protons, electrons),
+        "supported": True,
+        "solved": use_solver,
+        "orbitals": count,
+        "ratio": ratio,
+        "amplitude": amplitude,
+        "distance": distance,
+        "energy": energy,
+    }
+    return values
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns a table, building it if it has not been built
+# kind: 'particle', 'neutrino', 'proton' or 'atom'
+# size (optional): the largest K the particle table needs, or the largest Z the atom table needs.  The table is rebuilt if it is smaller.
+#------------------------------------------------------------------------------------------------------
+
+def table(kind, size=0):
+    if kind == "particle":
+        if kind not in tables or len(tables[kind]["neutrinos"]) <= size:
+            tables[kind] = particle_table(max(size, default_max_neutrinos))
+    elif kind == "atom":
+        if kind not in tables or tables[kind]["orbitals"].shape[1] <= size:
+            tables[kind] = atom_table(max(size, data_protons))
+    elif kind not in tables:
+        if kind == "neutrino":
+            tables[kind] = neutrino_table()
+        elif kind == "proton":
+            tables[kind] = proton_table()
+        else:
+            raise ValueError("unknown calculation table: " + str(kind))
+    return tables[kind]
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns a NumPy scalar as a Python number, so that it is formatted in text the same as a calculated value
+#------------------------------------------------------------------------------------------------------
+
+def _scalar(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the calculated values of one configuration as a dictionary of the table's columns
+# kind: 'particle', 'neutrino', 'proton' or 'atom'
+# index: K for particles; protons and electrons for atoms; nothing for the neutrino and proton.  Only the queried atom is looked
+#     up or solved (see atom_values); the atom table is built by the queries of every atom (rows, export, ionization_energies).
+#   query("particle", 10)["energy"]         the electron energy (eV)
+#   query("atom", 3, 2)["distance"]         the orbital distances of Li1+ (m)
+#------------------------------------------------------------------------------------------------------
+
+def query(kind, *index):
+    if kind == "particle":
+        k = int(index[0])
+        columns = table(kind, k)
+        return {column: _scalar(values[k]) for column, values in columns.items()}
+    if kind == "atom":
+        protons, electrons = int(index[0]), int(index[1])
+        if not 1 <= protons < len(data.atoms) or electrons < 0:
+            raise ValueError("atom is not supported: " + str(protons) + " protons, " + str(electrons) + " electrons")
+        return {column: _scalar(values) for column, values in atom_values(protons, electrons).items()}
+    return dict(table(kind))
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the ionization energy of every atom up to max_protons: the energy of its last orbital in the fill sequence (the
+# electron that Phase 4 shows as ionized), or 0 where the amplitude factor is not known
+# electrons (optional): the number of electrons removed before ionizing, e.g. 1 for the second ionization energy
+# include_solved (optional): if True, energies from the orbital solver are included.  They are 0 by default (unless
+#     config.orbital_solver is set), because the solver places outer orbitals too far out and its energies are not reliable.
+# RETURNS (max_protons + 1,) array of energies (J) indexed by protons
+#------------------------------------------------------------------------------------------------------
+
+def ionization_energies(max_protons=data_protons, electrons=0, include_solved=None):
+    if include_solved is None:
+        include_solved = config.orbital_solver
+    columns = table("atom", max_protons)
+    z = np.arange(max_protons + 1)
+    e = np.maximum(z - electrons, 0)
+    ratio = columns["ratio"][e, z]
+    last = ratio.shape[1] - 1 - np.argmax(ratio[:, ::-1] != 0, axis=1)
+    known = columns["supported"][e, z] & (include_solved | ~columns["solved"][e, z])
+    return np.where(known, columns["energy"][e, z, last], 0)
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns a table as a list of rows for export, one dictionary per configuration
+# kind: 'particle' (K = 1 to max_neutrinos) or 'atom' (every atom up to max_protons, with 1 electron up to its number of protons)
+# max_neutrinos (optional): the largest K of the particle rows
+# max_protons (optional): the largest Z of the atom rows
+#------------------------------------------------------------------------------------------------------
+
+def rows(kind, max_neutrinos=default_max_neutrinos, max_protons=data_protons):
+    result = []
+    if kind == "particle":
+        columns = table(kind, max_neutrinos)
+        for k in range(1, max_neutrinos + 1):
+            result.append({"neutrinos": k, "radius (m)": columns["radius"][k], "energy (eV)": columns["energy"][k],
+                "charge": columns["charge"][k], "shell_multiplier": columns["shell_multiplier"][k]})
+    elif kind == "atom":
+        columns = table(kind, max_protons)
+        for protons in range(1, max_protons + 1):
+            for electrons in range(1, protons + 1):
+                row = {"protons": protons, "electrons": electrons, "name": columns["name"][electrons, protons],
+                    "solved": bool(columns["solved"][electrons, protons])}
+                for i, orbital in enumerate(orbital_names):
+                    row[orbital + " distance (m)"] = columns["distance"][electrons, protons, i]
+                    row[orbital + " energy (J)"] = columns["energy"][electrons, protons, i]
+                result.append(row)
+    else:
+        raise ValueError("table has no rows to export: " + str(kind))
+    return result
+
+
+#------------------------------------------------------------------------------------------------------
+# Writes a table to a CSV file, one row per configuration, or to a compressed NumPy file (.npz) of the table's arrays
+# path: the file (.csv or .npz), or None to write CSV to standard output
+# RETURNS the number of configurations written
+#------------------------------------------------------------------------------------------------------
+
+def export(kind, path=None, max_neutrinos=default_max_neutrinos, max_protons=data_protons):
+    if path and path.endswith(".npz"):
+        columns = table(kind, max_neutrinos if kind == "particle" else max_protons)
+        if kind == "atom":
+            columns = dict(columns, name=columns["name"].astype(str), atoms=np.array(data.atoms[:max_protons + 1]),
+                orbital_names=np.array(orbital_names))
+        np.savez_compressed(path, **columns)
+        return columns["orbitals"].size if kind == "atom" else len(columns["neutrinos"])
+
+    table_rows = rows(kind, max_neutrinos, max_protons)
+    f = open(path, "w", newline="") if path else sys.stdout
+    try:
+        writer = csv.DictWriter(f, fieldnames=list(table_rows[0]))
+        writer.writeheader()
+        writer.writerows(table_rows)
+    finally:
+        if path:
+            f.close()
+    return len(table_rows)
+
+
+#------------------------------------------------------------------------------------------------------
+# Command line entry point
+#------------------------------------------------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a table of EWT calculations to CSV, or to a compressed NumPy file (.npz) of its arrays.")
+    parser.add_argument("--table", default="particles", choices=["particles", "atoms"], help="the table to write")
+    parser.add_argument("--max-neutrinos", type=int, default=default_max_neutrinos, help="the largest K of the particle table")
+    parser.add_argument("--max-protons", type=int, default=data_protons, help="the largest Z of the atom table (up to " + str(len(data.atoms) - 1) + ")")
+    parser.add_argument("--output", default=None, help="the .csv or .npz file (CSV to standard output if not given)")
+    args = parser.parse_args(argv)
+    count = export(args.table[:-1], args.output, args.max_neutrinos, args.max_protons)
+    if args.output:
+        print("Wrote " + str(count) + " configurations to " + args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
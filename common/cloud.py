@@ -0,0 +1,99 @@
+# Cloud
+
+#------------------------------------------------------------------------------------------------------
+# ELECTRON CLOUD SAMPLER
+# Draws the probable positions of electrons in an orbital directly from the orbital's distance and shape, instead of simulating
+# thousands of electrons with physics to illustrate the probability cloud.  The distance of an electron from the nucleus follows
+# the radial distribution of a wave in shell n with its peak at the orbital distance r (the same standing wave shape used for the
+# enclosed charge in common/orbitals.py):
+#
+#   P(d) ~ d^(2n) exp(-2n d / r)
+#
+# which is a gamma distribution.  Electrons of an s orbital are spread evenly in every direction.  Electrons of a p orbital are
+# pushed along the axes by the axial forces of Phase 4 (https://energywavetheory.com/atoms/orbital-shapes/), so their directions
+# follow the dumbbell shape cos^2 of the angle to one of the axes.  Other orbitals (d, f) are spread evenly until their forces
+# are known.
+# This module does not import bpy so that it can be used outside of Blender.
+#------------------------------------------------------------------------------------------------------
+
+import numpy as np
+
+
+# Axes of the axial forces of a p orbital, in the order they are added in Phase 4 (a line force rotated about x, y and z)
+axes = np.array([[0.0, 1.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, 1.0]])
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the number of electrons shown in the cloud of an orbital.  Fewer electrons are shown near the core and more in each
+# shell for visibility, except for hydrogen which shows one electron for each frame.
+# orbital_name: the name of the orbital, e.g. "2p"
+# protons: the number of protons of the atom
+# num_frames: the number of frames of the simulation
+#------------------------------------------------------------------------------------------------------
+
+def electron_count(orbital_name, protons, num_frames):
+    if protons == 1:
+        return num_frames
+    return int(num_frames / 10 * (int(orbital_name[:1]) ** 2))
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the number of axial forces of a p orbital: one for each pair of valence electrons, or all three when the orbital is full
+# valence_count: the number of electrons in the orbital
+# valence (optional): True if the orbital is the outer (valence) orbital of the atom
+#------------------------------------------------------------------------------------------------------
+
+def axial_count(valence_count, valence=False):
+    if valence:
+        return min(int(np.ceil(valence_count / 2)), len(axes))
+    return len(axes)
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns random unit directions, evenly spread in every direction
+#------------------------------------------------------------------------------------------------------
+
+def _sphere(rng, count):
+    z = rng.uniform(-1, 1, count)
+    phi = rng.uniform(0, 2 * np.pi, count)
+    s = np.sqrt(1 - z * z)
+    return np.stack([s * np.cos(phi), s * np.sin(phi), z], axis=1)
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns random unit directions with a density of cos^2 of the angle to one of the axes, each axis chosen evenly (p orbital lobes)
+#------------------------------------------------------------------------------------------------------
+
+def _dumbbell(rng, count, axis_count):
+    # |cos| has the density 3 c^2 on [0, 1], so it is the cube root of a uniform number.  Both lobes are equally likely.
+    c = np.cbrt(rng.uniform(0, 1, count)) * rng.choice([-1.0, 1.0], count)
+    phi = rng.uniform(0, 2 * np.pi, count)
+    s = np.sqrt(1 - c * c)
+    local = np.stack([s * np.cos(phi), s * np.sin(phi), c], axis=1)
+
+    # Rotate each direction from the z axis to its lobe's axis with an orthonormal frame (u, v, axis)
+    axis = axes[rng.integers(0, axis_count, count)]
+    u = np.roll(axis, 1, axis=1)
+    v = np.cross(axis, u)
+    return local[:, :1] * u + local[:, 1:2] * v + local[:, 2:] * axis
+
+
+#------------------------------------------------------------------------------------------------------
+# Samples the positions of electrons in the cloud of an orbital
+# orbital_name: the name of the orbital, e.g. "2p".  Its shell number and type (s, p, d, f) set the shape of the cloud.
+# radius: the orbital distance in the simulation
+# count: the number of electrons to sample
+# axis_count (optional): the number of axial forces of a p orbital (1 to 3, see axial_count)
+# seed (optional): seed of the random numbers, so that the same cloud is drawn each run.  None draws a different cloud each time.
+# RETURNS (count, 3) float32 array of electron positions around the nucleus at (0, 0, 0)
+#------------------------------------------------------------------------------------------------------
+
+def sample(orbital_name, radius, count, axis_count=3, seed=None):
+    rng = np.random.default_rng(seed)
+    n = int(orbital_name[:1])
+    distance = rng.gamma(2 * n + 1, radius / (2 * n), count)              # Peak of d^(2n) exp(-2n d / r) is at d = r
+    if orbital_name[1:] == "p" and axis_count > 0:
+        direction = _dumbbell(rng, count, axis_count)
+    else:
+        direction = _sphere(rng, count)
+    return (direction * distance[:, None]).astype(np.float32)
@@ -0,0 +1,249 @@
+# Clusters
+
+#------------------------------------------------------------------------------------------------------
+# STREAMING CLUSTER DETECTION
+# Groups particles (e.g. wave centers) into bound clusters frame by frame, to measure when particles form and how long they last
+# before they decay.  Two particles are bound when they are closer than a bond distance, and a cluster is every particle connected
+# by bonds.  Bonds are found with the cell list (common/neighbors.py), which is updated from the previous frame, and clusters are
+# kept in a union-find forest that is only updated where bonds changed: new bonds join clusters, and only the clusters that lost
+# a bond are rebuilt from their remaining bonds.  The cost of a frame is linear in the number of particles.
+# A cluster keeps its identity while its particles are the same.  Changes are appended to a compact event log:
+#   formed: a cluster appears with new particles (particles or clusters joined, or part of a cluster was left after a split)
+#   merged: a cluster joined particles or another cluster and continues as part of a larger cluster
+#   split:  a cluster lost particles (it decayed)
+# Merged and split events record the lifetime of the cluster in frames.  The log is written while the simulation is baked, so
+# decay statistics are calculated from the log without reading the trajectories again.
+# This module does not import bpy so that it can be used outside of Blender.
+#------------------------------------------------------------------------------------------------------
+
+import sys
+import os
+import argparse
+import importlib
+import json
+import numpy as np
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+from common import neighbors
+importlib.reload(neighbors)
+from common import trajectory
+importlib.reload(trajectory)
+
+
+# Types of events, by their code in the log
+event_names = ["formed", "merged", "split"]
+
+# One record of the event log: the frame, the type of event, the cluster, the number of particles of the cluster and its lifetime
+# in frames (0 for formed events)
+event_dtype = np.dtype([("frame", "<i4"), ("event", "i1"), ("cluster", "<i4"), ("size", "<i4"), ("lifetime", "<i4")])
+
+
+#------------------------------------------------------------------------------------------------------
+# Creates a cluster tracker
+# count: the number of particles in every frame
+# distance: the bond distance.  Particles closer than this distance are in the same cluster.
+# first_frame (optional): the frame number of the first update
+# path (optional): a file that events are appended to as they happen.  Without a file, events are kept in memory.
+# RETURNS tracker - a dictionary that is passed to update and finish
+#------------------------------------------------------------------------------------------------------
+
+def create_tracker(count, distance, first_frame=0, path=None):
+    tracker = {
+        "count": int(count),
+        "distance": float(distance),
+        "frame": int(first_frame),
+        "grid": None,
+        "bonds": np.zeros(0, dtype=np.int64),
+        "parent": np.arange(count, dtype=np.int64),                     # Union-find forest.  Compressed after each frame, so it holds the root of each particle.
+        "sizes": np.ones(count, dtype=np.int64),                        # The number of particles of each root's cluster
+        "ids": np.full(count, -1, dtype=np.int64),                      # The cluster ID of each root (clusters of two or more particles)
+        "born": np.zeros(0, dtype=np.int64),                            # The frame each cluster ID was formed
+        "events": [],
+        "file": open(path, "wb") if path else None,
+        "path": path,
+    }
+    return tracker
+
+
+#------------------------------------------------------------------------------------------------------
+# Points every node of a union-find forest at its root (pointer jumping)
+#------------------------------------------------------------------------------------------------------
+
+def compress(parent):
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            return
+        parent[:] = grandparent
+
+
+#------------------------------------------------------------------------------------------------------
+# Joins the clusters of pairs of particles in a union-find forest.  All pairs are joined together: the larger root of each pair
+# is hooked to the smaller, until the pairs share their roots.  Hooking to smaller roots never makes a loop.
+# parent: the union-find forest
+# i, j: arrays of the particles of each pair
+#------------------------------------------------------------------------------------------------------
+
+def union(parent, i, j):
+    while len(i):
+        compress(parent)
+        ri, rj = parent[i], parent[j]
+        differ = ri != rj
+        i, j, ri, rj = i[differ], j[differ], ri[differ], rj[differ]
+        np.minimum.at(parent, np.maximum(ri, rj), np.minimum(ri, rj))
+    compress(parent)
+
+
+#------------------------------------------------------------------------------------------------------
+# Updates the clusters with the particle locations of the next frame and logs the changes
+# tracker: the tracker returned by create_tracker
+# positions: (N, 3) array of particle locations
+# RETURNS the events of this frame (an array of event_dtype)
+#------------------------------------------------------------------------------------------------------
+
+def update(tracker, positions):
+    n = tracker["count"]
+    frame = tracker["frame"]
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+
+    # The bonds of this frame, as keys i * n + j with i < j, and the bonds that changed since the previous frame
+    tracker["grid"] = grid = neighbors.build(positions, tracker["distance"], tracker["grid"])
+    t, s, _, _ = neighbors.pairs(grid, positions)
+    bonds = np.unique(t[t < s] * n + s[t < s])
+    added = np.setdiff1d(bonds, tracker["bonds"], assume_unique=True)
+    removed = np.setdiff1d(tracker["bonds"], bonds, assume_unique=True)
+    tracker["bonds"] = bonds
+
+    # Only the particles of clusters with a changed bond can change cluster
+    parent = tracker["parent"]
+    old_roots = parent.copy()
+    old_sizes = tracker["sizes"]
+    changed = np.concatenate([added // n, added % n, removed // n, removed % n])
+    touched = np.isin(old_roots, old_roots[changed])
+
+    # Clusters that lost a bond are rebuilt from their remaining bonds, then new bonds join clusters
+    if len(removed):
+        lost = np.isin(old_roots, old_roots[np.concatenate([removed // n, removed % n])])
+        parent[lost] = np.flatnonzero(lost)
+        inner = bonds[lost[bonds // n]]
+        union(parent, inner // n, inner % n)
+    union(parent, added // n, added % n)
+    sizes = tracker["sizes"] = np.bincount(parent, minlength=n)
+
+    # A cluster continues when all of its particles are in one new cluster of the same size.  Otherwise it ends (it merged when
+    # all of its particles are still together, or split), and the new clusters of two or more particles are formed.
+    members = np.flatnonzero(touched)
+    q, r = old_roots[members], parent[members]
+    pair, counts = np.unique(q * n + r, return_counts=True)
+    q, r = pair // n, pair % n
+    same = (counts == old_sizes[q]) & (counts == sizes[r])
+    together = np.zeros(n, dtype=bool)
+    together[q[counts == old_sizes[q]]] = True
+
+    old_ids = tracker["ids"]
+    ids = old_ids.copy()
+    ids[members] = -1
+    ids[r[same]] = old_ids[q[same]]
+    ended = np.unique(q[~same & (old_sizes[q] >= 2)])
+    ended = ended[~np.isin(ended, q[same])]
+    formed = np.unique(r[~same & (sizes[r] >= 2)])
+    formed = formed[~np.isin(formed, r[same])]
+    ids[formed] = len(tracker["born"]) + np.arange(len(formed))
+    tracker["born"] = np.concatenate([tracker["born"], np.full(len(formed), frame, dtype=np.int64)])
+    tracker["ids"] = ids
+
+    events = np.zeros(len(ended) + len(formed), dtype=event_dtype)
+    events["frame"] = frame
+    events["event"][:len(ended)] = np.where(together[ended], event_names.index("merged"), event_names.index("split"))
+    events["cluster"] = np.concatenate([old_ids[ended], ids[formed]])
+    events["size"] = np.concatenate([old_sizes[ended], sizes[formed]])
+    events["lifetime"][:len(ended)] = frame - tracker["born"][old_ids[ended]]
+    if tracker["file"] is not None:
+        tracker["file"].write(events.tobytes())
+    else:
+        tracker["events"].append(events)
+    tracker["frame"] += 1
+    return events
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the current clusters: the cluster ID of each particle, or -1 for particles that are not in a cluster
+#------------------------------------------------------------------------------------------------------
+
+def labels(tracker):
+    return tracker["ids"][tracker["parent"]]
+
+
+#------------------------------------------------------------------------------------------------------
+# Finishes tracking and closes the event file
+# RETURNS the event log (an array of event_dtype)
+#------------------------------------------------------------------------------------------------------
+
+def finish(tracker):
+    if tracker["file"] is not None:
+        tracker["file"].close()
+        tracker["file"] = None
+        return read_events(tracker["path"])
+    return np.concatenate(tracker["events"]) if tracker["events"] else np.zeros(0, dtype=event_dtype)
+
+
+#------------------------------------------------------------------------------------------------------
+# Reads an event log file
+#------------------------------------------------------------------------------------------------------
+
+def read_events(path):
+    return np.fromfile(path, dtype=event_dtype)
+
+
+#------------------------------------------------------------------------------------------------------
+# Tracks the clusters of a trajectory file, reading one frame at a time.  Used for trajectories that were baked without tracking.
+# reader: the reader of the trajectory file (see trajectory.open_reader)
+# distance: the bond distance
+# path (optional): the file to write the event log to
+# RETURNS the event log
+#------------------------------------------------------------------------------------------------------
+
+def track(reader, distance, path=None):
+    tracker = create_tracker(reader["count"], distance, reader["first_frame"], path)
+    for frame in range(reader["frames"]):
+        update(tracker, trajectory.read_frame(reader, frame))
+    return finish(tracker)
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns a summary of an event log: the number of each type of event, the number of particles of the largest cluster, and the
+# lifetimes of clusters that decayed (split) or merged, in frames
+#------------------------------------------------------------------------------------------------------
+
+def statistics(events):
+    summary = {name: int(np.count_nonzero(events["event"] == code)) for code, name in enumerate(event_names)}
+    summary["largest"] = int(events["size"].max()) if len(events) else 0
+    for name in ("merged", "split"):
+        lifetimes = events["lifetime"][events["event"] == event_names.index(name)]
+        summary[name + "_lifetime"] = {"mean": float(lifetimes.mean()), "median": float(np.median(lifetimes)), "max": int(lifetimes.max())} if len(lifetimes) else None
+    return summary
+
+
+#------------------------------------------------------------------------------------------------------
+# Command line entry point: tracks the clusters of a trajectory file and prints the decay statistics, or prints the statistics
+# of an event log that was written while baking
+#------------------------------------------------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cluster formation and decay statistics of a trajectory")
+    parser.add_argument("path", help="a trajectory file (.traj) or an event log (.events)")
+    parser.add_argument("--distance", type=float, default=0, help="the bond distance (required for trajectory files)")
+    parser.add_argument("--output", default=None, help="file to write the event log of a trajectory to")
+    args = parser.parse_args(argv)
+
+    if args.path.endswith(".events"):
+        events = read_events(args.path)
+    elif args.distance > 0:
+        events = track(trajectory.open_reader(args.path), args.distance, args.output)
+    else:
+        parser.error("--distance is required to track a trajectory file")
+    print(json.dumps(statistics(events), indent=2))
+
+
+if __name__ == "__main__":
+    main()
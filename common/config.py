@@ -7,7 +7,10 @@
 # Second section includes variables for this program that may only be set in this file, including some Blender settings. May be modified in this file.
 #------------------------------------------------------------------------------------------------------
 
-import bpy
+try:
+    import bpy
+except ImportError:                                     # Outside of Blender (e.g. common/calculations.py), only the variables are used
+    bpy = None
 
 ############################################ CONFIG VARIABLES CONTROLLED IN THE BLENDER UI #####################################################
 
@@ -129,6 +132,35 @@ ext_force_radius = 500                                  # Size of sphere applyin
 ext_force_startframe = 1                                # Starting frame where force is turned on.  Set to 1 if the beginning.
 ext_force_endframe = 20                                 # Ending frame where force is turned off.  Set to num_frames if the entire time, or number to end.
 
+# GRANULE SOLVER CONFIGURATION
+granule_solver = False                                  # If true, Phase 1 granules are stepped by the NumPy lattice solver (phase1/granules.py) instead of Blender's wave modifier
+granules_per_wavelength = 4                             # Resolution of the granule lattice solver.  Larger numbers are more accurate but slower, especially in 3D.
+
+# PARTICLE ENGINE CONFIGURATION
+particle_engine = False                                 # If true, Phase 2 wave centers, Phase 4 nucleons and electrons and Phase 5 explosion particles are moved by the NumPy particle engine (common/engine.py) instead of Blender's particle solver
+engine_substeps = 4                                     # Engine steps per frame.  More steps are more accurate but slower.
+engine_backend = "auto"                                 # Charge and force fields between particles: "direct" (every pair), "octree" (Barnes-Hut approximation) or "auto" (octree for large counts)
+octree_theta = 0.7                                      # Opening angle of the octree.  Smaller is more accurate and slower (0 is exact).
+engine_seed = 1                                         # Seed for emitting wave centers in the particle engine, so that runs are reproducible. Set to 0 to use the emitter's random seed.
+engine_workers = 0                                      # Processes calculating particle engine forces.  Set to 0 to use all CPU cores (small systems always use one).
+
+# BAKE CACHE CONFIGURATION
+bake_cache = False                                      # If true, particle trajectories are baked when a phase is run and stored on disk (common/cache.py). Running the same configuration again replays them.
+bake_cache_size = 1024 ** 3                             # Largest size of the bake cache in bytes.  The least recently used bakes are deleted first.
+
+# CLUSTER TRACKING CONFIGURATION
+track_clusters = False                                  # If true, bound clusters of Phase 2 wave centers are tracked while baking and their formation and decay are logged (common/clusters.py)
+cluster_distance = 0                                    # The bond distance of tracked clusters.  Set by the phase when clusters are tracked (0 for no tracking).
+
+# ORBITAL SOLVER CONFIGURATION
+orbital_solver = False                                  # If true, every atom's orbital distances are calculated by the orbital solver (common/orbitals.py). If false, atoms up to calcium use the data file (ions it does not have are not supported) and heavier atoms are solved.
+
+# PROFILER CONFIGURATION
+profile_build = False                                   # If true, scene builds from the UI are profiled (common/profiler.py) and a Chrome trace and summary table are written to the temp directory (qscope/profile.json)
+
+# COMPOSITE PARTICLE SOLVER CONFIGURATION
+composite_solver = False                                # If true, Phase 3 finds the stable configuration of electrons and positrons with the equilibrium solver (phase3/equilibrium.py) instead of simulating them settling
+
 # PARTICLE ACCELERATOR CONFIGURATION
 accelerator_startframe = 50                             # The frame number when the particle is released from the particle accelerator
 
@@ -148,10 +180,12 @@ project_text = "~EWT Project"                           # Hidden text in simulat
 
 ########################################################## BLENDER CONFIGS ################################################################
 
-bpy.context.scene.use_gravity = False                   # Turn off gravity
-bpy.context.scene.frame_end = num_frames                # Set the total number of frames for the simulation
-for a in bpy.context.screen.areas:
-    if a.type == 'VIEW_3D':
-        for s in a.spaces:
-            if s.type == 'VIEW_3D':
-                s.clip_end = 20000                      # Set the zooming factor
+if bpy is not None:
+    bpy.context.scene.use_gravity = False                   # Turn off gravity
+    bpy.context.scene.frame_end = num_frames                # Set the total number of frames for the simulation
+    if bpy.context.screen is not None:                      # There is no screen when running in background mode (see common/runner.py)
+        for a in bpy.context.screen.areas:
+            if a.type == 'VIEW_3D':
+                for s in a.spaces:
+                    if s.type == 'VIEW_3D':
+                        s.clip_end = 20000                  # Set the zooming factor
@@ -5,86 +5,43 @@
 # The configuration of atoms and orbitals uses multiequation solves to calculate positions of various
 # particles that affect each other.  This data file uses pre-calculated values found in arrays here.
 # The raw data may be downloaded from https://energywavetheory.com/equations/summary-of-calculations/
-# TODO: The calculations may be moved to Blender/Python if multiequation solvers can be applied, making this file unnecessary in the future.
+# Atoms and ions heavier than calcium are calculated by the orbital solver in common/orbitals.py.
 # TODO: Most calculations stop at 12 electrons because determining constructive wave interference approximation yields increasing errors - can be corrected with a simulator knowing distances
 #------------------------------------------------------------------------------------------------------
 
-import bpy
-
-#------------------------------------------------------------------------------------------------------
-# DETERMINE ATOM TYPE AND ARRAY
-# Select the correct table if it is an ion, and determine the ratio used for orbital distances (orbital_ratio) and amplitude factor for wave interference (amplitude_ratio)
-# TODO: This could be made more efficient, but this data file may be replaced with a multiequation solver anyway so that tables do not need to be use_max_distance
-#------------------------------------------------------------------------------------------------------
-
-def get_orbital_array(electrons, atom_name):
-    atom_name = atom_name
-    if electrons == 1:
-        orbital_ratio = ion_atom_1
-        amplitude_ratio = amp_atom_1
-    elif electrons == 2:
-        orbital_ratio = ion_atom_2
-        amplitude_ratio = amp_atom_2
-    elif electrons == 3:
-        orbital_ratio = ion_atom_3
-        amplitude_ratio = amp_atom_3
-    elif electrons == 4:
-        orbital_ratio = ion_atom_4
-        amplitude_ratio = amp_atom_4
-    elif electrons == 5:
-        orbital_ratio = ion_atom_5
-        amplitude_ratio = amp_atom_5
-    elif electrons == 6:
-        orbital_ratio = ion_atom_6
-        amplitude_ratio = amp_atom_6
-    elif electrons == 7:
-        orbital_ratio = ion_atom_7
-        amplitude_ratio = amp_atom_7
-    elif electrons == 8:
-        orbital_ratio = ion_atom_8
-        amplitude_ratio = amp_atom_8
-    elif electrons == 9:
-        orbital_ratio = ion_atom_9
-        amplitude_ratio = amp_atom_9
-    elif electrons == 10:
-        orbital_ratio = ion_atom_10
-        amplitude_ratio = amp_atom_10
-    elif electrons == 11:
-        orbital_ratio = ion_atom_11
-        amplitude_ratio = amp_atom_11
-    elif electrons == 12:
-        orbital_ratio = ion_atom_12
-        amplitude_ratio = amp_atom_12
-    else:
-        orbital_ratio = neutral_atom   # Default to neutral atom if ion table is not found.  This is incorrect data, but it will say atom not supported
-        amplitude_ratio = amp_neutral
-        atom_name = "Atom not supported"
-    return orbital_ratio, amplitude_ratio, atom_name
+import numpy as np
 
 
 #------------------------------------------------------------------------------------------------------
 # ATOM SYMBOLS
-# An array of atom symbols
-# TODO: Only supports up to calcium as data file supports s and p orbitals only.  Need to expand list.
+# An array of atom symbols.  The tables below support up to calcium (s and p orbitals only); heavier atoms are calculated by
+# the orbital solver (see common/orbitals.py).
 #------------------------------------------------------------------------------------------------------
 
-atoms = ["Atom", "H", "He", "Li", "Be", "B", "C", "N",	"O", "F", "Ne", "Na", "Mg", "Al", "Si", "P", "S", "Cl", "Ar", "K", "Ca" ]
+atoms = ["Atom", "H", "He", "Li", "Be", "B", "C", "N",	"O", "F", "Ne", "Na", "Mg", "Al", "Si", "P", "S", "Cl", "Ar", "K", "Ca",
+    "Sc", "Ti", "V", "Cr", "Mn", "Fe", "Co", "Ni", "Cu", "Zn", "Ga", "Ge", "As", "Se", "Br", "Kr",
+    "Rb", "Sr", "Y", "Zr", "Nb", "Mo", "Tc", "Ru", "Rh", "Pd", "Ag", "Cd", "In", "Sn", "Sb", "Te", "I", "Xe",
+    "Cs", "Ba", "La", "Ce", "Pr", "Nd", "Pm", "Sm", "Eu", "Gd", "Tb", "Dy", "Ho", "Er", "Tm", "Yb", "Lu",
+    "Hf", "Ta", "W", "Re", "Os", "Ir", "Pt", "Au", "Hg", "Tl", "Pb", "Bi", "Po", "At", "Rn",
+    "Fr", "Ra", "Ac", "Th", "Pa", "U", "Np", "Pu", "Am", "Cm", "Bk", "Cf", "Es", "Fm", "Md", "No", "Lr",
+    "Rf", "Db", "Sg", "Bh", "Hs", "Mt", "Ds", "Rg", "Cn", "Nh", "Fl", "Mc", "Lv", "Ts", "Og" ]
 
 
 #------------------------------------------------------------------------------------------------------
 # ORBITAL FILL SEQUENCE
-# Fill order of electrons in 1s, 2s, 2p, 3s, 3p and 4s shells.
-# TODO: Only supports the sequence to 20 electrons currently as only up to calcium supported.
+# Fill order of electrons in shells (the Madelung order), and the number of electrons in each shell: s, p, d, f.
+# The tables below have the first six shells (1s, 2s, 2p, 3s, 3p and 4s), up to 20 electrons.
 #------------------------------------------------------------------------------------------------------
 
-electron_sequence = [ 2, 2, 6, 2, 6, 2 ]
+orbital_names = [ "1s", "2s", "2p", "3s", "3p", "4s", "3d", "4p", "5s", "4d", "5p", "6s", "4f", "5d", "6p", "7s", "5f", "6d", "7p" ]
+electron_sequence = [ 2, 2, 6, 2, 6, 2, 10, 6, 2, 10, 6, 2, 14, 10, 6, 2, 14, 10, 6 ]
 
 
 #------------------------------------------------------------------------------------------------------
 # ORBITAL DISTANCES
 # Orbital distances relative to the Bohr radius for neutral and ion atoms.
 # Precalculated using Math-cad simultaneous equation solver.  From https://energywavetheory.com/atoms/calculations-atoms/
-# TODO: Currently supports up to calcium. May be expanded here as a table or replaced with direct equation solver in Python
+# Currently supports up to calcium.  Other atoms and ions are calculated by the orbital solver (see common/orbitals.py).
 #------------------------------------------------------------------------------------------------------
 
 # Neutral atom orbital distances
@@ -199,3 +156,57 @@ amp_atom_12 = [ [ "1s",0.000,0.000,0.000,0.000,0.000,0.000,0.000,0.000,0.000,0.0
                 [ "2s",0.000,0.000,0.000,0.000,0.000,0.000,0.000,0.000,0.000,0.000,0.000,2.931,3.931,4.931,5.931,6.931,7.931,8.931,9.931,10.93 ],
                 [ "2p",0.000,0.000,0.000,0.000,0.000,0.000,0.000,0.000,0.000,0.000,0.000,1.512,2.512,3.512,4.512,5.512,6.512,7.512,8.512,9.512 ],
                 [ "3s",0.000,0.000,0.000,0.000,0.000,0.000,0.000,0.000,0.000,0.000,0.000,1.381,2.381,3.381,4.381,5.381,6.381,7.381,8.381,9.381 ] ]
+
+
+#------------------------------------------------------------------------------------------------------
+# ORBITAL ARRAYS
+# The tables above as NumPy arrays indexed by [electrons, protons, orbital], so that looking up an atom or ion is a single index
+# and a query of every atom (e.g. the ionization energy of each neutral atom) is a single array expression.
+# orbital_ratio: orbital distances relative to the Bohr radius, 0 where there is no orbital
+# amplitude_ratio: amplitude factors of the orbitals
+# orbital_count: the number of orbitals of each atom or ion, 0 where the tables do not have it (ions with more than 12 electrons)
+#------------------------------------------------------------------------------------------------------
+
+def build_arrays():
+    tables = {electrons: (ion, amp) for electrons, (ion, amp) in enumerate([(ion_atom_1, amp_atom_1), (ion_atom_2, amp_atom_2),
+        (ion_atom_3, amp_atom_3), (ion_atom_4, amp_atom_4), (ion_atom_5, amp_atom_5), (ion_atom_6, amp_atom_6), (ion_atom_7, amp_atom_7),
+        (ion_atom_8, amp_atom_8), (ion_atom_9, amp_atom_9), (ion_atom_10, amp_atom_10), (ion_atom_11, amp_atom_11),
+        (ion_atom_12, amp_atom_12)], start=1)}
+    protons = len(neutral_atom[0])
+    ratio = np.zeros((protons, protons, len(neutral_atom)))
+    amplitude = np.zeros((protons, protons, len(neutral_atom)))
+    count = np.zeros((protons, protons), dtype=np.int8)
+
+    # Ion tables have a row per orbital and a column per number of protons, from 1 (the first column is the orbital name)
+    for electrons, (ion, amp) in tables.items():
+        z = np.arange(electrons + 1, protons)
+        ratio[electrons, z, :len(ion)] = np.array([row[1:] for row in ion]).T[z - 1]
+        amplitude[electrons, z, :len(amp)] = np.array([row[1:] for row in amp]).T[z - 1]
+        count[electrons, z] = len(ion)
+    z = np.arange(1, protons)
+    ratio[z, z] = np.array([row[1:] for row in neutral_atom]).T
+    amplitude[z, z] = np.array([row[1:] for row in amp_neutral]).T
+    count[z, z] = len(neutral_atom)
+    return ratio, amplitude, count
+
+orbital_ratio, amplitude_ratio, orbital_count = build_arrays()
+
+
+#------------------------------------------------------------------------------------------------------
+# Saves the orbital arrays to a compressed binary file (.npz), a compact form for tools that do not import this module
+# path: the file to write
+#------------------------------------------------------------------------------------------------------
+
+def save_arrays(path):
+    np.savez_compressed(path, orbital_ratio=orbital_ratio, amplitude_ratio=amplitude_ratio, orbital_count=orbital_count,
+        atoms=np.array(atoms), orbital_names=np.array(orbital_names[:orbital_ratio.shape[2]]))
+
+
+#------------------------------------------------------------------------------------------------------
+# Loads orbital arrays saved by save_arrays
+# RETURNS a dictionary of the arrays by name
+#------------------------------------------------------------------------------------------------------
+
+def load_arrays(path):
+    with np.load(path) as f:
+        return {name: f[name] for name in f.files}
@@ -0,0 +1,430 @@
+# Engine
+
+#------------------------------------------------------------------------------------------------------
+# PARTICLE ENGINE
+# Steps particles under the same force laws as Blender's effectors, with the state of all particles held in NumPy arrays.
+# Particles are added in groups (one group per emitter).  Each group may carry force fields that act on other particles
+# (like a particle system's force_field_1 and force_field_2), and the system also has static effectors at fixed locations
+# (like force field objects, including fields instanced on the vertices of a mesh).
+#
+# Force laws, for a particle at distance r from a source of strength s (positive strength pushes particles away):
+#   CHARGE:   s * q / r^falloff_power, where q is the charge of the particle (the strength of its own CHARGE field)
+#   FORCE:    s / r^falloff_power
+#   HARMONIC: -s * r, a spring pulling particles to the source (harmonic damping slows particles)
+#   LENNARDJ: Lennard-Jones force with the particle size as the distance of zero force, repulsive closer and attractive further
+#   VORTEX:   s / r^falloff_power around the effector's axis (static effectors only)
+#   WIND:     s / r^falloff_power along the effector's axis (static effectors only)
+# A field's flow slows the particles it acts on (a drag of flow * velocity), which is how Blender's flow settles particles.
+#
+# Charge and force fields of many particles can use a Barnes-Hut octree (common/octree.py) instead of evaluating every pair,
+# and fields with a maximum distance (e.g. the Lennard-Jones strong and nuclear forces) only evaluate the pairs in range using
+# a cell list (common/neighbors.py), so their cost grows linearly with the number of particles.
+#
+# Forces are calculated for a range of particles at a time, so that the particles can be split between processes that share
+# the particle arrays (common/parallel.py).
+#
+# The engine is deterministic: particles are emitted from a seeded random generator, and the same seed and settings give the
+# same trajectories on any machine.  This module does not import bpy so that it can be used outside of Blender.
+#------------------------------------------------------------------------------------------------------
+
+import importlib
+import numpy as np
+
+from common import octree
+importlib.reload(octree)
+from common import neighbors
+importlib.reload(neighbors)
+
+
+# Field types that act between particles and field types that act from static effectors
+particle_field_types = ["CHARGE", "FORCE", "LENNARDJ", "HARMONIC"]
+effector_field_types = ["CHARGE", "FORCE", "HARMONIC", "VORTEX", "WIND"]
+
+# Largest number of pair distances calculated at once.  Limits memory used by the all-pairs force evaluation.
+pair_chunk = 2 ** 21
+
+# Number of sources at which the 'auto' backend uses the octree instead of evaluating every pair
+octree_minimum = 5000
+
+# Number of sources at which fields with a maximum distance use the cell list instead of evaluating every pair
+cell_list_minimum = 64
+
+
+#------------------------------------------------------------------------------------------------------
+# Creates an empty particle system
+# timestep (optional): the time of one Blender frame in simulation units (Blender's particle timestep default is 0.04)
+# substeps (optional): the number of integration steps per frame.  More substeps are more accurate but slower.
+# softening (optional): the smallest distance used in force laws, to avoid infinite forces when particles overlap
+# backend (optional): how charge and force fields are evaluated: 'direct' (every pair), 'octree' (Barnes-Hut) or 'auto' (octree for many sources)
+# theta (optional): the opening angle of the octree.  Smaller is more accurate and slower.
+# RETURNS system - a dictionary of arrays and properties that is passed to the other functions in this module
+#------------------------------------------------------------------------------------------------------
+
+def create_system(timestep=0.04, substeps=1, softening=0.01, backend="direct", theta=0.5):
+    system = {
+        "positions": np.zeros((0, 3)),
+        "velocities": np.zeros((0, 3)),
+        "masses": np.zeros(0),
+        "charges": np.zeros(0),
+        "sizes": np.zeros(0),
+        "groups": [],
+        "effectors": [],
+        "timestep": timestep,
+        "substeps": substeps,
+        "softening": softening,
+        "backend": backend,
+        "theta": theta,
+        "neighbors": {},
+        "frame": 1,
+    }
+    return system
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns a force field, in the format used by add_particles and add_effector
+# type: the type of field ('CHARGE', 'FORCE', 'HARMONIC' or 'LENNARDJ')
+# strength: the strength of the field
+# falloff_power (optional): the power of distance the field falls off with (CHARGE and FORCE)
+# flow (optional): the drag the field applies to the particles it acts on
+# max_distance (optional): the field has no effect beyond this distance (0 for no limit)
+# damping (optional): the harmonic damping of a HARMONIC field
+# scale (optional): an array of strength multipliers by frame number, for fields that are animated or turned on and off
+#------------------------------------------------------------------------------------------------------
+
+def field(type, strength, falloff_power=0, flow=0, max_distance=0, damping=0, scale=None):
+    return {
+        "type": type,
+        "strength": strength,
+        "falloff_power": falloff_power,
+        "flow": flow,
+        "max_distance": max_distance,
+        "damping": damping,
+        "scale": None if scale is None else np.asarray(scale, dtype=np.float64),
+    }
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns random locations on the surface of a sphere, like an emitter emitting from the faces of a UV sphere
+# count: the number of locations
+# radius: the radius of the sphere
+# center (optional): the center of the sphere in (x,y,z) coordinates
+# seed (optional): the seed of the random generator.  The same seed always gives the same locations.
+#------------------------------------------------------------------------------------------------------
+
+def emit_sphere(count, radius, center=(0, 0, 0), seed=0):
+    rng = np.random.default_rng(seed)
+    directions = rng.normal(size=(count, 3))
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    return directions * radius + np.asarray(center, dtype=np.float64)
+
+
+#------------------------------------------------------------------------------------------------------
+# Adds a group of particles to the system, such as the particles of one emitter
+# system: the system created by create_system
+# name: the name of the group (e.g. the emitter name)
+# positions: (N, 3) array of starting locations
+# velocities (optional): (N, 3) array of starting velocities. Particles start at rest by default.
+# mass (optional): the mass of each particle
+# size (optional): the size of each particle, used as the zero-force distance of LENNARDJ fields
+# fields (optional): a list of fields (see field) that each particle of the group applies to other particles
+# self_effect (optional): if True, the group's fields also act on particles of the same group
+# weights (optional): a dictionary of multipliers by field type for the forces acting on this group, like Blender's effector weights
+# collections (optional): the names of the collections of the group's emitter
+# effector_collection (optional): if set, only effectors and particles in this collection act on the group (Blender's effector collection)
+# RETURNS the group dictionary.  The group's particles are positions[group["start"]:group["end"]].
+#------------------------------------------------------------------------------------------------------
+
+def add_particles(system, name, positions, velocities=None, mass=1.0, size=1.0, fields=(), self_effect=True, weights=None, collections=frozenset(), effector_collection=None):
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    velocities = np.zeros_like(positions) if velocities is None else np.asarray(velocities, dtype=np.float64).reshape(-1, 3)
+    count = len(positions)
+    charge = sum(f["strength"] for f in fields if f["type"] == "CHARGE")   # The charge of a particle is the strength of its own charge field
+
+    group = {
+        "name": name,
+        "start": len(system["positions"]),
+        "end": len(system["positions"]) + count,
+        "fields": [f for f in fields if f["type"] in particle_field_types],
+        "self_effect": self_effect,
+        "weights": dict(weights or {}),
+        "collections": frozenset(collections),
+        "effector_collection": effector_collection,
+    }
+    system["positions"] = np.concatenate([system["positions"], positions])
+    system["velocities"] = np.concatenate([system["velocities"], velocities])
+    system["masses"] = np.concatenate([system["masses"], np.full(count, mass, dtype=np.float64)])
+    system["charges"] = np.concatenate([system["charges"], np.full(count, charge, dtype=np.float64)])
+    system["sizes"] = np.concatenate([system["sizes"], np.full(count, size, dtype=np.float64)])
+    system["groups"].append(group)
+    return group
+
+
+#------------------------------------------------------------------------------------------------------
+# Adds a static effector to the system.  One effector may have many locations, e.g. a field instanced on every vertex of a
+# mesh or a grid of nodes with the same settings, and each location may have its own strength.
+# system: the system created by create_system
+# effector: a field (see field) applying to every location
+# locations: (K, 3) array of the locations of the field
+# strengths (optional): (K,) array of strength multipliers of each location (e.g. -1 for negative nodes)
+# collections (optional): the names of the collections of the effector
+# axis (optional): the direction of the effector's z axis, which VORTEX fields spin around and WIND fields blow along
+#------------------------------------------------------------------------------------------------------
+
+def add_effector(system, effector, locations, strengths=None, collections=frozenset(), axis=(0, 0, 1)):
+    locations = np.asarray(locations, dtype=np.float64).reshape(-1, 3)
+    effector = dict(effector)
+    effector["locations"] = locations
+    effector["axis"] = np.asarray(axis, dtype=np.float64) / np.linalg.norm(axis)
+    effector["strengths"] = effector["strength"] * (np.ones(len(locations)) if strengths is None else np.asarray(strengths, dtype=np.float64))
+    effector["collections"] = frozenset(collections)
+    system["effectors"].append(effector)
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the strength multiplier of a field at a frame.  Frames past the end of an animated field keep its last value.
+#------------------------------------------------------------------------------------------------------
+
+def field_scale(f, frame):
+    if f["scale"] is None:
+        return 1.0
+    return f["scale"][min(max(int(frame), 0), len(f["scale"]) - 1)]
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the force magnitude along the direction from a source to a particle (positive pushes away) for a field type
+# r: array of distances
+# strength: the strength of the sources (scalar or array broadcast with r)
+# f: the field
+# sizes: the particle sizes (used by LENNARDJ), broadcast with r
+#------------------------------------------------------------------------------------------------------
+
+def radial_force(r, strength, f, sizes):
+    if f["type"] == "HARMONIC":
+        return -strength * r
+    if f["type"] == "LENNARDJ":
+        sr6 = (sizes / r) ** 6
+        return strength * 24 / r * (2 * sr6 * sr6 - sr6)
+    if f["falloff_power"] == 2:
+        return strength / (r * r)                                         # Inverse square is the most common falloff and faster than a power
+    if f["falloff_power"]:
+        return strength / r ** f["falloff_power"]
+    return strength * np.ones_like(r)
+
+
+#------------------------------------------------------------------------------------------------------
+# Calculates the forces of sources on targets by evaluating every pair, in chunks of targets to limit memory
+# targets: (T, 3) array of particle locations
+# sources: (S, 3) array of source locations
+# strengths: (S,) array of source strengths
+# f: the field of the sources
+# target_sizes: (T,) array of target particle sizes
+# softening: the smallest distance used in the force law
+# RETURNS forces (T, 3) array and a (T,) boolean array of targets within range of at least one source
+#------------------------------------------------------------------------------------------------------
+
+def direct_forces(targets, sources, strengths, f, target_sizes, softening):
+    forces = np.zeros_like(targets)
+    in_range = np.zeros(len(targets), dtype=bool)
+    chunk = max(1, pair_chunk // max(1, len(sources)))
+    for start in range(0, len(targets), chunk):
+        t = targets[start:start + chunk]
+        d = [t[:, k, None] - sources[None, :, k] for k in range(3)]        # Separate x, y and z differences are faster than (T, S, 3) arrays
+        r2 = d[0] * d[0] + d[1] * d[1] + d[2] * d[2]
+        active = r2 > 0                                                   # A particle does not act on itself
+        if f["max_distance"]:
+            active &= r2 <= f["max_distance"] ** 2
+        r = np.sqrt(np.maximum(r2, softening ** 2))
+        magnitude = radial_force(r, strengths[None, :], f, target_sizes[start:start + chunk, None])
+        magnitude /= r
+        magnitude *= active
+        for k in range(3):
+            forces[start:start + chunk, k] = np.einsum("ts,ts->t", magnitude, d[k])
+        in_range[start:start + chunk] = active.any(axis=1)
+    return forces, in_range
+
+
+#------------------------------------------------------------------------------------------------------
+# Calculates the forces of VORTEX and WIND effectors, which act around or along the effector's axis instead of away from it
+# axis: the unit vector of the effectors' z axis
+# Other arguments and return values are the same as direct_forces.  Effectors have few locations, so every pair is evaluated.
+#------------------------------------------------------------------------------------------------------
+
+def axial_forces(targets, sources, strengths, f, axis, softening):
+    forces = np.zeros_like(targets)
+    in_range = np.zeros(len(targets), dtype=bool)
+    for source, strength in zip(sources, strengths):
+        d = targets - source
+        r = np.sqrt(np.maximum(np.einsum("ij,ij->i", d, d), softening ** 2))
+        active = r <= f["max_distance"] if f["max_distance"] else np.ones(len(targets), dtype=bool)
+        magnitude = strength / r ** f["falloff_power"] * active
+        direction = np.cross(axis, d) / r[:, None] if f["type"] == "VORTEX" else axis[None, :]
+        forces += magnitude[:, None] * direction
+        in_range |= active
+    return forces, in_range
+
+
+#------------------------------------------------------------------------------------------------------
+# Calculates the forces of sources on targets for a field with a maximum distance, evaluating only the pairs in range
+# key: identifies the sources, so that their cell list is updated from the previous step
+# Other arguments and return values are the same as direct_forces
+#------------------------------------------------------------------------------------------------------
+
+def neighbor_forces(system, key, targets, sources, strengths, f, target_sizes):
+    grid = neighbors.build(sources, f["max_distance"], system["neighbors"].get(key))
+    system["neighbors"][key] = grid
+    t, j, d, r2 = neighbors.pairs(grid, targets)
+    active = r2 > 0                                                   # A particle does not act on itself
+    r = np.sqrt(np.maximum(r2, system["softening"] ** 2))
+    magnitude = radial_force(r, strengths[j], f, target_sizes[t]) / r * active
+    forces = np.stack([np.bincount(t, weights=magnitude * d[:, k], minlength=len(targets)) for k in range(3)], axis=1)
+    return forces, np.bincount(t, weights=active, minlength=len(targets)) > 0
+
+
+#------------------------------------------------------------------------------------------------------
+# Calculates the forces from one field of a set of sources.  This is the function to replace for other force backends.
+# key (optional): identifies the sources between steps (e.g. the group and field) for backends that keep state between steps
+#------------------------------------------------------------------------------------------------------
+
+def field_forces(system, targets, sources, strengths, f, target_sizes, key=None):
+    if f["type"] in ("VORTEX", "WIND"):
+        return axial_forces(targets, sources, strengths, f, f["axis"], system["softening"])
+
+    # Harmonic forces are linear, so without a distance limit the sum over all sources is one spring to their weighted center
+    if f["type"] == "HARMONIC" and not f["max_distance"]:
+        total = strengths.sum()
+        center = strengths @ sources
+        return center[None, :] - total * targets, np.full(len(targets), total != 0)
+
+    # Short-range fields of many sources only evaluate pairs in range
+    if f["max_distance"] and len(sources) >= cell_list_minimum:
+        return neighbor_forces(system, key, targets, sources, strengths, f, target_sizes)
+
+    # Inverse power fields of many sources use the octree
+    if f["type"] in ("CHARGE", "FORCE") and (system["backend"] == "octree" or (system["backend"] == "auto" and len(sources) >= octree_minimum)):
+        trees = octree.build(sources, strengths)
+        return octree.field(trees, targets, system["theta"], f["falloff_power"], system["softening"], f["max_distance"])
+    return direct_forces(targets, sources, strengths, f, target_sizes, system["softening"])
+
+
+#------------------------------------------------------------------------------------------------------
+# Calculates the force and drag on particles at a frame.  Every particle is a source; only particles start to end are targets.
+# system: the system created by create_system
+# frame (optional): the frame number used for animated fields.  By default the current frame of the system.
+# start (optional): the first particle to calculate
+# end (optional): the particle after the last to calculate.  By default the last particle of the system.
+# RETURNS forces (end - start, 3) array and drag (end - start,) array of drag coefficients
+#------------------------------------------------------------------------------------------------------
+
+def forces(system, frame=None, start=0, end=None):
+    frame = system["frame"] if frame is None else frame
+    x = system["positions"]
+    end = len(x) if end is None else end
+    targets = x[start:end]
+    sizes = system["sizes"][start:end]
+    total = np.zeros_like(targets)
+    drag = np.zeros(len(targets))
+
+    # The multiplier of a field type from a source for each particle: its effector weights, or 0 if the source is not in the particle's effector collection
+    def weights(field_type, collections):
+        w = np.ones(len(x))
+        for group in system["groups"]:
+            allowed = group["effector_collection"] is None or group["effector_collection"] in collections
+            w[group["start"]:group["end"]] = group["weights"].get(field_type, 1.0) * group["weights"].get("all", 1.0) if allowed else 0
+        return w
+
+    def apply(force, in_range, f, scale, w):
+        w = w[start:end]
+        if f["type"] == "CHARGE":
+            force *= system["charges"][start:end, None]
+        total[:] += force * (scale * w)[:, None]
+        drag[:] += np.where(in_range, (f["flow"] + (f["damping"] if f["type"] == "HARMONIC" else 0)) * (w != 0), 0)
+
+    # Static effectors
+    for index, f in enumerate(system["effectors"]):
+        scale = field_scale(f, frame)
+        if scale == 0 or not f["strengths"].any():
+            continue
+        force, in_range = field_forces(system, targets, f["locations"], f["strengths"], f, sizes, key=("effector", index))
+        apply(force, in_range, f, scale, weights(f["type"], f["collections"]))
+
+    # Fields carried by particles.  Particles of a group without self effect are not affected by their own group.
+    for group in system["groups"]:
+        sources = x[group["start"]:group["end"]]
+        for index, f in enumerate(group["fields"]):
+            scale = field_scale(f, frame)
+            if scale == 0 or not f["strength"] or not len(sources):
+                continue
+            w = weights(f["type"], group["collections"])
+            if not group["self_effect"]:
+                w[group["start"]:group["end"]] = 0
+            force, in_range = field_forces(system, targets, sources, np.full(len(sources), float(f["strength"])), f, sizes, key=(group["name"], index))
+            apply(force, in_range, f, scale, w)
+    return total, drag
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the number of substeps needed for harmonic forces to be stable at the current frame.  Springs are stable with explicit
+# steps when the step is shorter than 2 / sqrt(stiffness / mass); a step of half that is used for accuracy.
+#------------------------------------------------------------------------------------------------------
+
+def stable_substeps(system):
+    if not len(system["masses"]):
+        return 1
+    stiffness = 0.0
+    for f in system["effectors"]:
+        if f["type"] == "HARMONIC":
+            stiffness += abs(f["strengths"]).sum() * abs(field_scale(f, system["frame"]))
+    for group in system["groups"]:
+        for f in group["fields"]:
+            if f["type"] == "HARMONIC":
+                stiffness += abs(f["strength"] * field_scale(f, system["frame"])) * (group["end"] - group["start"])
+    return max(1, int(np.ceil(system["timestep"] * np.sqrt(stiffness / system["masses"].min()))))
+
+
+#------------------------------------------------------------------------------------------------------
+# Steps the system forward by one Blender frame.  Each substep is a semi-implicit Euler step with implicit drag, which is
+# stable however large the drag (flow) is.  More substeps than the system's are used while stiff harmonic forces are on.
+# system: the system created by create_system
+# evaluate (optional): the function that returns the forces and drag of every particle of the system.  By default forces.
+#------------------------------------------------------------------------------------------------------
+
+def step(system, evaluate=None):
+    substeps = max(system["substeps"], stable_substeps(system))
+    dt = system["timestep"] / substeps
+    for _ in range(substeps):
+        force, drag = (evaluate or forces)(system)
+        v = system["velocities"]
+        v += force / system["masses"][:, None] * dt
+        v /= (1 + drag * dt)[:, None]
+        system["positions"] += v * dt
+    system["frame"] += 1
+
+
+#------------------------------------------------------------------------------------------------------
+# Runs the system for a number of frames, yielding the system before the first step and after each frame, so that frames
+# can be written out as they are calculated (e.g. to a trajectory file) without keeping them in memory
+# system: the system created by create_system
+# frames: the number of frames to step
+# evaluate (optional): the function that returns the forces and drag of every particle (see step)
+#------------------------------------------------------------------------------------------------------
+
+def steps(system, frames, evaluate=None):
+    yield system
+    for _ in range(frames):
+        step(system, evaluate)
+        yield system
+
+
+#------------------------------------------------------------------------------------------------------
+# Runs the system for a number of frames and returns the trajectory of every particle
+# system: the system created by create_system
+# frames: the number of frames to step
+# evaluate (optional): the function that returns the forces and drag of every particle (see step)
+# RETURNS trajectory (frames + 1, N, 3) float32 array, starting with the positions before the first step
+#------------------------------------------------------------------------------------------------------
+
+def run(system, frames, evaluate=None):
+    trajectory = np.empty((frames + 1, len(system["positions"]), 3), dtype=np.float32)
+    for i, state in enumerate(steps(system, frames, evaluate)):
+        trajectory[i] = state["positions"]
+    return trajectory
@@ -0,0 +1,109 @@
+# Force Worker
+
+#------------------------------------------------------------------------------------------------------
+# PARALLEL FORCE WORKER
+# The worker processes of common/parallel.py run this module, started by the main process as:
+#
+#   python -m common.force_worker
+#
+# A worker reads messages from its standard input and answers on its standard output.  The first message is the system (without
+# its particle arrays) and the names of the shared memory blocks of the particle arrays.  Every later message is a task, (frame,
+# start, end), and the worker writes the forces and drag of that range of particles to shared memory and answers None, or the
+# error if the forces failed.  The worker stops when it is sent None or its input is closed.
+# Workers are started from this module instead of by multiprocessing, so the main script of the main process (e.g.
+# common/runner.py inside Blender, which imports bpy) is never run in them and the main process's __main__ module is left alone.
+# This module does not import bpy so that it can be used outside of Blender.
+#------------------------------------------------------------------------------------------------------
+
+import sys
+import os
+import importlib
+import pickle
+import traceback
+from multiprocessing import shared_memory, resource_tracker
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+from common import engine
+importlib.reload(engine)
+from common import parallel
+importlib.reload(parallel)
+
+
+#------------------------------------------------------------------------------------------------------
+# Writes a message to a pipe
+#------------------------------------------------------------------------------------------------------
+
+def send(pipe, message):
+    pickle.dump(message, pipe, protocol=pickle.HIGHEST_PROTOCOL)
+    pipe.flush()
+
+
+#------------------------------------------------------------------------------------------------------
+# Reads a message from a pipe.  Returns None if the pipe was closed.
+#------------------------------------------------------------------------------------------------------
+
+def receive(pipe):
+    try:
+        return pickle.load(pipe)
+    except EOFError:
+        return None
+
+
+#------------------------------------------------------------------------------------------------------
+# Opens a shared memory block created by the main process.  The main process frees the block, so it is not registered with this
+# process's resource tracker, which would otherwise free it when the worker stops.
+#------------------------------------------------------------------------------------------------------
+
+def attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)        # Python 3.13 and later
+    except TypeError:
+        block = shared_memory.SharedMemory(name=name)
+        if os.name == "posix":
+            resource_tracker.unregister(block._name, "shared_memory")
+        return block
+
+
+#------------------------------------------------------------------------------------------------------
+# Runs a worker until it is stopped
+# source (optional): the pipe messages are read from (standard input by default)
+# sink (optional): the pipe answers are written to (standard output by default)
+#------------------------------------------------------------------------------------------------------
+
+def main(source=None, sink=None):
+    source = source or sys.stdin.buffer
+    sink = sink or sys.stdout.buffer
+    sys.stdout = sys.stderr                                             # Printed text would corrupt the answers
+
+    start = receive(source)
+    if start is None:
+        return 0
+    system, names = start
+    memory = {name: attach(names[name]) for name in parallel.shared_arrays}
+    arrays = parallel.shared_views(memory, len(system["masses"]))
+    system["positions"] = arrays["positions"]
+    system["velocities"] = arrays["velocities"]
+    try:
+        while True:
+            task = receive(source)
+            if task is None:
+                break
+            frame, first, last = task
+            try:
+                force, drag = engine.forces(system, frame, first, last)
+                arrays["forces"][first:last] = force
+                arrays["drag"][first:last] = drag
+            except Exception:
+                send(sink, traceback.format_exc())
+                continue
+            send(sink, None)
+    finally:
+        system["positions"] = system["velocities"] = None
+        arrays.clear()                                                  # Shared memory cannot be closed while arrays use it
+        for block in memory.values():
+            block.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
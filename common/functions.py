@@ -9,6 +9,7 @@ import bpy
 import sys
 import os
 import importlib
+import numpy as np
 
 # Import Config Variables & Data
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
@@ -16,33 +17,84 @@ from common import config
 importlib.reload(config)
 from common import data
 importlib.reload(data)
+from common import meshes
+importlib.reload(meshes)
 
 
 ############################################ COMMON FUNCTIONS #####################################################
 
 #------------------------------------------------------------------------------------------------------
 # Spins an object creating a 1/2 spin by rotating a tetrahedron twice as fast as one axis relative to another
+# The keyframes for every rotation are written directly into the object's F-curves in bulk, without changing frames.
 # name: object name that is passed into this function to spin
 # frequency: the number of keyframes until a full rotation is completed
 # TODO: This spin is animated using Blender keyframes and should use physics when standing waves form.
 #------------------------------------------------------------------------------------------------------
 
 def spin_object(name, frequency, spin_up=True):
-    step_num = 0
-    frame_num = 0
     if config.spin:                                                # Spin only if the config is set to true
-        while frame_num <= config.num_frames:
-            if spin_up:
-                rotation = -(config.pi * step_num)
-            else:
-                rotation = (config.pi * step_num)
-            bpy.context.scene.frame_set(frame_num)
-            o = bpy.data.objects[name]                             # Spin the object passed by reference name
-            o.rotation_euler[0] = rotation
-            o.rotation_euler[1] = rotation * 2    # Spins twice as fast on one axis for 1/2 spin rotation
-            bpy.ops.anim.keyframe_insert_menu(type='Rotation')
-            step_num += 1
-            frame_num += config.spin_frequency
+        o = bpy.data.objects[name]                                 # Spin the object passed by reference name
+        frames = np.arange(0, config.num_frames + 1, frequency, dtype=np.float32)
+        direction = -1 if spin_up else 1
+        rotation = direction * config.pi * np.arange(len(frames), dtype=np.float32)
+        values = (rotation, rotation * 2, np.full(len(frames), o.rotation_euler[2], dtype=np.float32))   # Spins twice as fast on one axis for 1/2 spin rotation
+
+        # The first keyframe creates the action and rotation F-curves.  The remaining keyframes are added to each F-curve at once.
+        o.rotation_euler[0] = rotation[0]
+        o.rotation_euler[1] = values[1][0]
+        o.keyframe_insert(data_path="rotation_euler", frame=float(frames[0]))
+        for index, value in enumerate(values):
+            fcurve = o.animation_data.action.fcurves.find("rotation_euler", index=index)
+            start = len(fcurve.keyframe_points)
+            fcurve.keyframe_points.add(len(frames) - 1)
+            co = np.empty(2 * len(fcurve.keyframe_points), dtype=np.float32)
+            fcurve.keyframe_points.foreach_get("co", co)
+            co[2 * start::2] = frames[1:]
+            co[2 * start + 1::2] = value[1:]
+            fcurve.keyframe_points.foreach_set("co", co)
+            fcurve.update()
+        o.rotation_euler[0] = rotation[-1]                         # Leave the object at its last rotation, as if the frames had been stepped
+        o.rotation_euler[1] = values[1][-1]
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns a shared material for a color, creating it the first time the color is used.
+# Objects with the same color and transparency share one material, so materials are not duplicated for every particle.
+# Materials are named by their color so that they are also found again after this module is reloaded (e.g. in the next phase).
+# color: the desired color in (R,G,B,A) values
+# transparent (optional): when set, the material is transparent in a Blender view to see inside particles.
+#------------------------------------------------------------------------------------------------------
+
+materials = {}
+
+def get_material(color, transparent=False):
+    key = (tuple(round(c, 4) for c in color), transparent)
+    material = materials.get(key)
+    try:
+        if material is not None and material.name:             # The material may have been deleted by a reset
+            return material
+    except ReferenceError:
+        pass
+
+    name = "Material " + str(key[0]) + (" Transparent" if transparent else "")
+    material = bpy.data.materials.get(name)
+    if material is None:
+        material = bpy.data.materials.new(name)
+        material.diffuse_color = color
+        if transparent:
+            material.blend_method = 'HASHED'
+            material.use_nodes = True
+            material.use_backface_culling = True
+            nodes = material.node_tree.nodes
+            links = material.node_tree.links
+            for n in nodes:
+                nodes.remove(n)
+            output = nodes.new( type = 'ShaderNodeOutputMaterial' )
+            diffuse = nodes.new( type = 'ShaderNodeBsdfTransparent' )
+            links.new( diffuse.outputs['BSDF'], output.inputs['Surface'] )
+            diffuse.inputs[0].default_value = color
+    materials[key] = material
+    return material
 
 
 #------------------------------------------------------------------------------------------------------
@@ -54,21 +106,7 @@ def spin_object(name, frequency, spin_up=True):
 
 def add_color(name, color, transparent=False):
     o = bpy.data.objects[name]
-    shell_material = bpy.data.materials.new(name + "Material")
-    o.active_material = shell_material
-    shell_material.diffuse_color = color
-    if transparent:
-        shell_material.blend_method = 'HASHED'
-        shell_material.use_nodes = True
-        shell_material.use_backface_culling = True
-        nodes = shell_material.node_tree.nodes
-        links = shell_material.node_tree.links
-        for n in nodes:
-            nodes.remove(n)
-        output = nodes.new( type = 'ShaderNodeOutputMaterial' )
-        diffuse = nodes.new( type = 'ShaderNodeBsdfTransparent' )
-        link = links.new( diffuse.outputs['BSDF'], output.inputs['Surface'] )
-        bpy.data.materials[shell_material.name].node_tree.nodes["Transparent BSDF"].inputs[0].default_value = color
+    o.active_material = get_material(color, transparent)
 
 
 #------------------------------------------------------------------------------------------------------
@@ -107,10 +145,7 @@ def add_external_force(name, radius, location, type='HARMONIC', strength=1, star
     a.keyframe_insert(data_path='field.strength', frame=startframe)
     a.field.strength = 0
     a.keyframe_insert(data_path='field.strength', frame=endframe)
-    old_type = bpy.context.area.type
-    bpy.context.area.type = 'GRAPH_EDITOR'
-    bpy.ops.graph.interpolation_type(type='CONSTANT')
-    bpy.context.area.type = old_type
+    set_constant_interpolation(a)
 
 
 #------------------------------------------------------------------------------------------------------
@@ -142,10 +177,7 @@ def add_explosive_force(name, location=(0,0,0), type='FORCE', attractive_strengt
     a.keyframe_insert(data_path='field.strength', frame=startframe)
     a.field.strength = repulsive_strength
     a.keyframe_insert(data_path='field.strength', frame=endframe)
-    old_type = bpy.context.area.type
-    bpy.context.area.type = 'GRAPH_EDITOR'
-    bpy.ops.graph.interpolation_type(type='CONSTANT')
-    bpy.context.area.type = old_type
+    set_constant_interpolation(a)
 
 
 #------------------------------------------------------------------------------------------------------
@@ -185,37 +217,21 @@ def add_electron(name, color, scale_factor=1, core_only=False, antimatter=False)
     else:
         config.num_waves = config.neutrinos
 
-    # Add the shell and then the core
-    bpy.ops.mesh.primitive_uv_sphere_add(radius=(config.wavelength * config.num_waves), enter_editmode=False, location=(config.grid_spacing,config.grid_spacing,config.grid_spacing))
-    bpy.context.active_object.name = name
-    bpy.ops.object.shade_smooth()
-
-    x = 0   # Create the electron particle with a tetrahedron core
-    y = 0
-    z = 0
-    nodeNum = 1
-    while x < config.grid_size:
-        while y < config.grid_size:
-            while z < config.grid_size:
-                if ((x+y+z) % 2) == 0:
-                    if not (nodeNum == 2 or nodeNum == 4 or nodeNum == 10 or nodeNum == 14):  # Exclude certain points to make it a tetrahedron
-                        bpy.ops.mesh.primitive_uv_sphere_add(radius=config.grid_spacing/4, enter_editmode=False, location=(x*config.grid_spacing, y*config.grid_spacing, z*config.grid_spacing))
-                        bpy.ops.object.shade_smooth()
-                        bpy.context.active_object.name = name
-                nodeNum += 0.5
-                z += 1
-            z = 0
-            y += 1
-        y = 0
-        x += 1
-        bpy.ops.object.select_pattern(pattern=name + "*")
-        bpy.ops.object.join()
-        bpy.context.active_object.name = name  # Make sure name of resulting object is correct
-        bpy.ops.object.origin_set(type='ORIGIN_GEOMETRY', center='MEDIAN')
-        o = bpy.data.objects[name]
-        if antimatter:
-            o.rotation_euler = (config.pi/2, 0, 0)
-        add_color(name=name, color=color, transparent=True)
+    # The shell and the tetrahedron core are calculated as vertex buffers and built as a single mesh
+    parts = [meshes.uv_sphere(radius=(config.wavelength * config.num_waves), location=(config.grid_spacing,config.grid_spacing,config.grid_spacing))]
+    for index, (x, y, z) in enumerate(np.ndindex(config.grid_size, config.grid_size, config.grid_size)):
+        nodeNum = 1 + index * 0.5
+        if ((x+y+z) % 2) == 0:
+            if not (nodeNum == 2 or nodeNum == 4 or nodeNum == 10 or nodeNum == 14):  # Exclude certain points to make it a tetrahedron
+                parts.append(meshes.uv_sphere(radius=config.grid_spacing/4, location=(x*config.grid_spacing, y*config.grid_spacing, z*config.grid_spacing)))
+    vertices, faces = meshes.merge(parts)
+
+    # Origin at the median of the geometry, the same as origin_set(type='ORIGIN_GEOMETRY', center='MEDIAN')
+    center = vertices.mean(axis=0)
+    o = meshes.new_mesh_object(name, vertices - center, faces, location=tuple(center))
+    if antimatter:
+        o.rotation_euler = (config.pi/2, 0, 0)
+    add_color(name=name, color=color, transparent=True)
 
 
 #------------------------------------------------------------------------------------------------------
@@ -309,6 +325,44 @@ def add_emitter(name, color, radius, count, scale_factor=1, self_effect=True, ob
     return pset
 
 
+#------------------------------------------------------------------------------------------------------
+# Adds a cloud of electrons at fixed positions, such as positions drawn by the electron cloud sampler (common/cloud.py).
+# The positions are the vertices of one point mesh, and a particle system without physics places an electron at each vertex,
+# so the cloud is drawn in one step and no electron is simulated.
+# name: the desired name of the cloud
+# color: the desired color of the electrons
+# positions: (N, 3) array of electron positions
+# core_only (optional): if true, only show the core of the electrons
+# RETURNS pset - particles settings that can be adjusted and customized outside the function
+#------------------------------------------------------------------------------------------------------
+
+def add_electron_cloud(name, color, positions, core_only=False):
+    if bpy.data.objects.get("Electron") is None:
+        add_electron(name="Electron", color=color, core_only=core_only)
+    bpy.data.objects['Electron'].location = (1000,1000,1000)         # move out of view and hide
+    bpy.data.objects['Electron'].hide_set(True)
+
+    o = meshes.new_mesh_object(name, positions, [])
+    o.show_instancer_for_viewport = False
+    o.show_instancer_for_render = False
+    m = o.modifiers.new(name, type='PARTICLE_SYSTEM')
+    pset = m.particle_system.settings
+    pset.count = len(positions)
+    pset.frame_start = 1
+    pset.frame_end = 1
+    pset.lifetime = config.num_frames
+    pset.emit_from = 'VERT'
+    pset.use_emit_random = False                                        # One electron at each vertex, in order
+    pset.physics_type = 'NO'                                            # Electrons stay where they were drawn
+    pset.normal_factor = 0
+    pset.render_type = 'OBJECT'
+    pset.instance_object = bpy.data.objects['Electron']
+    pset.particle_size = 1
+    pset.display_size = 1
+    add_color(name=name, color=color)
+    return pset
+
+
 #------------------------------------------------------------------------------------------------------
 # Adds a proton or antiproton to the simulation
 # name: the desired name of the proton
@@ -387,7 +441,6 @@ def add_nucleon(name, vertex_color, center_color, scale_factor=1, spin_up=True,
         while f <= 4:
             # TODO: Repelling force uses Blender's wind force as the closest thing to an axial magnetic force.  This needs to be changed within Blender to be more accurate.
             bpy.ops.object.effector_add(type='WIND', enter_editmode=False, location=(0, 0, 0))
-            bpy.ops.transform.resize(value=(1, 1, 1), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
             bpy.context.active_object.name = name + " - Repelling Force " + str(f)
             o = bpy.data.objects[name + " - Repelling Force " + str(f)]
             o.field.strength = config.orbital_force
@@ -440,12 +493,9 @@ def add_atom(name, color, atom_type, scale_factor=1):
     # Lookup in the data table how many protons and electrons for the atom based on its symbol (the count of electrons and protons are equal for neutral atoms)
     count = data.atoms.index(atom_type)     # The data.atoms array is designed so that the index position of the atom symbol is the electron (and proton) count
 
-    # Electron distance. Loop through the neutral atom array for the element and assign x to the largest number, as long as it is not zero (no orbital)
-    i = 1
-    while i <= len(data.neutral_atom):
-        if data.neutral_atom[i-1][count] != 0:
-            x = data.neutral_atom[i-1][count]   # If not 0, assign x to the next orbital as the outermost shell
-        i += 1
+    # Electron distance. The outermost orbital of the neutral atom (the last orbital with a distance) is the valence shell
+    orbital_ratio = data.orbital_ratio[count, count]
+    x = orbital_ratio[np.flatnonzero(orbital_ratio)[-1]]
 
     # The distance to the valence shell is a ratio of the Bohr radius (hydrogen radius and the ratio from above)
     valence_distance = x * config.hydrogen_radius
@@ -504,6 +554,51 @@ def add_vortex(name, location=(0,0,0), strength=config.spin_strength, frequency=
     spin_object(name = name, frequency = frequency)
 
 
+#------------------------------------------------------------------------------------------------------
+# Adds a grid of standing wave nodes as charge forces that alternate between positive and negative nodes.
+# All node positions and charge signs are calculated as arrays, then the nodes are created directly in bpy.data without operators.
+# name: the desired name of the axis at the center of the grid. Nodes are named "Node - Positive (n)" or "Node - Negative (n)".
+# collection: the collection that the nodes and axis are linked to
+# size: the number of nodes in each row of the grid
+# spacing: the distance between nodes
+# strength: the charge strength of each node (positive nodes use +strength and negative nodes -strength)
+# flow (optional): the flow of each node's force field
+# RETURNS the axis object that is the parent of all nodes, centered at the origin
+#------------------------------------------------------------------------------------------------------
+
+def add_node_grid(name, collection, size, spacing, strength, flow=0):
+
+    # Node positions centered on the origin and their sign: positive when the sum of the grid indices is even
+    index = np.indices((size, size, size)).reshape(3, -1).T
+    positions = (index - (size - 1) / 2) * spacing
+    positive = (index.sum(axis=1) % 2) == 0
+
+    # The axis is the parent of the grid so that the grid can be spun
+    axis = bpy.data.objects.new(name, None)
+    axis.empty_display_type = 'PLAIN_AXES'
+    collection.objects.link(axis)
+
+    for node_num, (location, is_positive) in enumerate(zip(positions.tolist(), positive.tolist())):
+        if is_positive:
+            o = bpy.data.objects.new("Node - Positive (" + str(node_num) + ")", None)
+            o.field.type = 'CHARGE'
+            o.field.strength = strength
+        else:
+            o = bpy.data.objects.new("Node - Negative (" + str(node_num) + ")", None)
+            o.field.type = 'CHARGE'
+            o.field.strength = -strength
+        o.field.flow = flow
+        o.field.falloff_power = 2
+        o.empty_display_type = 'SINGLE_ARROW'
+        o.location = location
+        o.parent = axis
+        collection.objects.link(o)
+
+    # Leave the axis active, like objects added with operators, so that it can be keyframed (e.g. spin_object)
+    bpy.context.view_layer.objects.active = axis
+    return axis
+
+
 #------------------------------------------------------------------------------------------------------
 # Adds a text field given text and a location. A simple enhancement of the Blender text_add function
 # name: the desired name of the text box
@@ -534,6 +629,20 @@ def hide_at_keyframe(name, init_hide=False, start_frame=1, end_frame=1):
     ob.keyframe_insert(data_path="hide_viewport", frame=end_frame)
 
 
+#------------------------------------------------------------------------------------------------------
+# Sets all keyframes of an object (or other data such as particle settings) to constant interpolation, so that animated values switch on and off instead of changing gradually.
+# Keyframes are changed directly in the F-curves, so no Graph Editor or screen context is needed (e.g. when running in background mode).
+# id_data: the object or data with keyframes, such as bpy.data.objects[name] or bpy.data.particles[name]
+#------------------------------------------------------------------------------------------------------
+
+def set_constant_interpolation(id_data):
+    if id_data.animation_data is None or id_data.animation_data.action is None:
+        return
+    for fcurve in id_data.animation_data.action.fcurves:
+        for keyframe in fcurve.keyframe_points:
+            keyframe.interpolation = 'CONSTANT'
+
+
 #------------------------------------------------------------------------------------------------------
 # Links the most recent (active) object to a collection.
 # collection: the name of the collection to link to
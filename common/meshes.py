@@ -0,0 +1,150 @@
+# Meshes
+
+#------------------------------------------------------------------------------------------------------
+# MESH BUILDERS
+# Builds Blender meshes directly from NumPy vertex and face buffers instead of bpy.ops primitives and edit mode operators.
+# Vertex and face arrays are calculated in bulk and written with foreach_set, so building a mesh has no operator overhead
+# and its cost only depends on the number of vertices requested.
+#------------------------------------------------------------------------------------------------------
+
+import bpy
+import numpy as np
+
+
+#------------------------------------------------------------------------------------------------------
+# Calculates the vertices and quad faces of a box surface, subdivided with a number of cuts along each axis
+# size: the length of the box in (x,y,z) directions
+# cuts: the number of cuts along each axis in (x,y,z) directions, matching the number_cuts of Blender's subdivide
+# RETURNS vertices (N, 3) float32 array and faces (F, 4) int32 array, centered at the origin
+#------------------------------------------------------------------------------------------------------
+
+def box_grid(size, cuts):
+    n = [int(c) + 1 for c in cuts]                                    # Number of segments along each axis
+    axes = [np.linspace(-s / 2, s / 2, k + 1, dtype=np.float32) for s, k in zip(size, n)]
+
+    # Only the points on the surface of the box are vertices, in the order of the lattice (i, j, k), so only the six sides are
+    # ever allocated.  A slice of constant i is a full side (i = 0 or n) or a ring of points around the box.
+    side = (n[1] + 1) * (n[2] + 1)
+    ring = 2 * (n[2] + 1) + 2 * (n[1] - 1)
+    count = 2 * side + (n[0] - 1) * ring
+
+    def surface_index(i, j, k):
+        full = (i == 0) | (i == n[0])
+        start = np.where(i == 0, 0, side + (i - 1) * ring)
+        in_ring = np.where(j == 0, k, np.where(j == n[1], n[2] + 1 + 2 * (n[1] - 1) + k, n[2] + 1 + 2 * (j - 1) + (k != 0)))
+        return (start + np.where(full, j * (n[2] + 1) + k, in_ring)).astype(np.int32)
+
+    # Quads on each of the six sides, wound so that normals point outwards.  Each side writes its own vertices; edges are shared.
+    vertices = np.empty((count, 3), dtype=np.float32)
+    faces = []
+    for axis in range(3):
+        u, v = [a for a in range(3) if a != axis]
+        for position, flip in ((0, True), (n[axis], False)):
+            plane = np.meshgrid(np.arange(n[u] + 1), np.arange(n[v] + 1), indexing="ij")
+            lattice = [None] * 3
+            lattice[axis], lattice[u], lattice[v] = np.full(plane[0].shape, position), plane[0], plane[1]
+            index = surface_index(*lattice)                           # 2D array of vertex indices for this side, ordered (u, v)
+            vertices[index] = np.stack([axes[a][lattice[a]] for a in range(3)], axis=-1)
+            quads = np.stack([index[:-1, :-1], index[1:, :-1], index[1:, 1:], index[:-1, 1:]], axis=-1).reshape(-1, 4)
+            if (axis == 1) != flip:                                   # The (u, v) order of the y axis sides is reversed relative to x and z
+                quads = quads[:, ::-1]
+            faces.append(quads)
+    return vertices, np.concatenate(faces).astype(np.int32)
+
+
+#------------------------------------------------------------------------------------------------------
+# Calculates the vertices and quad faces of a flat square plane in the x-y direction, subdivided with a number of cuts
+# size: the length of each side of the plane
+# cuts: the number of cuts along each side, matching the number_cuts of Blender's subdivide
+# RETURNS vertices (N, 3) float32 array and faces (F, 4) int32 array, centered at the origin
+#------------------------------------------------------------------------------------------------------
+
+def grid_plane(size, cuts):
+    n = int(cuts) + 1
+    axis = np.linspace(-size / 2, size / 2, n + 1, dtype=np.float32)
+    x, y = np.meshgrid(axis, axis, indexing="ij")
+    vertices = np.stack([x.ravel(), y.ravel(), np.zeros(x.size, dtype=np.float32)], axis=1)
+    index = np.arange(x.size, dtype=np.int32).reshape(x.shape)
+    faces = np.stack([index[:-1, :-1], index[1:, :-1], index[1:, 1:], index[:-1, 1:]], axis=-1).reshape(-1, 4)
+    return vertices, faces
+
+
+#------------------------------------------------------------------------------------------------------
+# Calculates the vertices and faces of a UV sphere with the same layout as Blender's primitive_uv_sphere_add
+# radius: the radius of the sphere
+# segments (optional): the number of vertical segments (Blender default 32)
+# ring_count (optional): the number of horizontal rings (Blender default 16)
+# location (optional): the center of the sphere in (x,y,z) coordinates
+# RETURNS vertices (N, 3) float32 array and a list of face arrays: triangles at the poles (F, 3) and quads (F, 4)
+#------------------------------------------------------------------------------------------------------
+
+def uv_sphere(radius, segments=32, ring_count=16, location=(0, 0, 0)):
+    theta = np.linspace(0, np.pi, ring_count + 1)[1:-1]                # Angle from the top pole of each ring
+    phi = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    ring = np.stack([np.outer(np.sin(theta), np.cos(phi)), np.outer(np.sin(theta), np.sin(phi)), np.repeat(np.cos(theta), segments).reshape(-1, segments)], axis=-1)
+    vertices = np.concatenate([[[0, 0, 1]], ring.reshape(-1, 3), [[0, 0, -1]]]) * radius + np.asarray(location)
+
+    # Vertex 0 is the top pole, rings follow, and the last vertex is the bottom pole
+    index = 1 + np.arange((ring_count - 1) * segments, dtype=np.int32).reshape(ring_count - 1, segments)
+    following = np.roll(index, -1, axis=1)
+    bottom = (ring_count - 1) * segments + 1
+    top_triangles = np.stack([np.zeros(segments, dtype=np.int32), index[0], following[0]], axis=1)
+    bottom_triangles = np.stack([np.full(segments, bottom, dtype=np.int32), following[-1], index[-1]], axis=1)
+    quads = np.stack([index[:-1], index[1:], following[1:], following[:-1]], axis=-1).reshape(-1, 4)
+    return vertices.astype(np.float32), [np.concatenate([top_triangles, bottom_triangles]), quads]
+
+
+#------------------------------------------------------------------------------------------------------
+# Combines several meshes into one set of buffers, like joining objects
+# parts: a list of (vertices, faces) pairs, where faces is an array or a list of arrays
+# RETURNS vertices (N, 3) float32 array and a list of face arrays
+#------------------------------------------------------------------------------------------------------
+
+def merge(parts):
+    vertices = []
+    faces = []
+    offset = 0
+    for v, f in parts:
+        for face_array in (f if isinstance(f, list) else [f]):
+            faces.append(np.asarray(face_array, dtype=np.int32) + offset)
+        vertices.append(np.asarray(v, dtype=np.float32))
+        offset += len(v)
+    return np.concatenate(vertices), faces
+
+
+#------------------------------------------------------------------------------------------------------
+# Creates a mesh object from vertex and face buffers.  Like Blender's primitives, the object is linked to the scene collection and made active.
+# name: the desired name of the object (also used for the mesh)
+# vertices: (N, 3) array of vertex coordinates
+# faces: (F, K) array of vertex indices where every face has K vertices (e.g. 4 for quads), or a list of such arrays. May be empty for a point mesh.
+# location (optional): the location of the object in (x,y,z) coordinates
+# smooth (optional): if True, faces are shaded smooth (same as shade_smooth)
+# RETURNS the new object
+#------------------------------------------------------------------------------------------------------
+
+def new_mesh_object(name, vertices, faces, location=(0, 0, 0), smooth=True):
+    vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 3)
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set("co", vertices.ravel())
+
+    face_arrays = [np.asarray(f, dtype=np.int32) for f in (faces if isinstance(faces, list) else [faces]) if len(f)]
+    if face_arrays:
+        loops = np.concatenate([f.ravel() for f in face_arrays])
+        totals = np.concatenate([np.full(len(f), f.shape[1], dtype=np.int32) for f in face_arrays])
+        mesh.loops.add(len(loops))
+        mesh.loops.foreach_set("vertex_index", loops)
+        mesh.polygons.add(len(totals))
+        mesh.polygons.foreach_set("loop_start", (np.cumsum(totals) - totals).astype(np.int32))
+        if bpy.app.version < (4, 0, 0):                               # Loop totals are calculated by Blender from 4.0
+            mesh.polygons.foreach_set("loop_total", totals)
+        mesh.polygons.foreach_set("use_smooth", np.full(len(totals), smooth, dtype=bool))
+    mesh.update(calc_edges=True)
+    mesh.validate()
+
+    o = bpy.data.objects.new(name, mesh)
+    o.location = location
+    bpy.context.scene.collection.objects.link(o)
+    o.select_set(True)
+    bpy.context.view_layer.objects.active = o
+    return o
@@ -0,0 +1,102 @@
+# Neighbors
+
+#------------------------------------------------------------------------------------------------------
+# CELL LIST NEIGHBOR SEARCH
+# Finds the pairs of particles closer than a cutoff distance, for short-range forces such as the Lennard-Jones strong and nuclear
+# forces or any field with a maximum distance.  Sources are sorted into cubic cells the size of the cutoff, so the neighbors of a
+# particle can only be in its own cell or the 26 cells around it.  The cost is linear in the number of particles instead of
+# quadratic.  The cell list is updated each step from the previous one: particles move little between steps, so their previous
+# order is almost sorted and re-sorting it is fast.
+# This module does not import bpy so that it can be used outside of Blender.
+#------------------------------------------------------------------------------------------------------
+
+import numpy as np
+
+
+# Offsets of a cell and its 26 neighbors
+cell_offsets = np.array([(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)], dtype=np.int64)
+
+# Largest number of targets searched at once.  Limits the memory used by candidate pairs.
+target_chunk = 65536
+
+
+#------------------------------------------------------------------------------------------------------
+# Builds or updates the cell list of sources
+# positions: (N, 3) array of source locations
+# cutoff: the largest distance of a pair
+# previous (optional): the cell list of the previous step, to update instead of building from the start
+# RETURNS grid - a dictionary of cell arrays that is passed to pairs
+#------------------------------------------------------------------------------------------------------
+
+def build(positions, cutoff, previous=None):
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+
+    # The grid origin is on a multiple of the cutoff with an empty border of one cell, so it only changes when particles move a whole cell
+    low = (np.floor(positions.min(axis=0) / cutoff) - 1) * cutoff if len(positions) else np.zeros(3)
+    coords = np.floor((positions - low) / cutoff).astype(np.int64)
+    dims = (coords.max(axis=0) + 2) if len(positions) else np.ones(3, dtype=np.int64)
+    keys = (coords[:, 0] * dims[1] + coords[:, 1]) * dims[2] + coords[:, 2]
+
+    # Re-sort the previous order when the grid is the same; a stable sort of an almost sorted array is close to linear time
+    if previous is not None and previous["cutoff"] == cutoff and len(previous["order"]) == len(positions) \
+            and np.array_equal(previous["low"], low) and np.array_equal(previous["dims"], dims):
+        order = previous["order"]
+        order = order[np.argsort(keys[order], kind="stable")]
+    else:
+        order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    # The cells that have sources, with the range of each cell's sources in the sorted order
+    new_cell = np.ones(len(sorted_keys), dtype=bool)
+    new_cell[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    cell_start = np.flatnonzero(new_cell)
+    grid = {
+        "cutoff": cutoff,
+        "low": low,
+        "dims": dims,
+        "order": order,
+        "positions": positions,
+        "cell_keys": sorted_keys[cell_start],
+        "cell_start": cell_start,
+        "cell_count": np.diff(np.append(cell_start, len(sorted_keys))),
+    }
+    return grid
+
+
+#------------------------------------------------------------------------------------------------------
+# Finds every pair of a target and a source within the cutoff distance
+# grid: the cell list returned by build
+# targets: (T, 3) array of locations.  A target at the same location as a source is paired with it (distance 0).
+# RETURNS target indices, source indices, (P, 3) array of offsets from source to target and (P,) array of squared distances
+#------------------------------------------------------------------------------------------------------
+
+def pairs(grid, targets):
+    targets = np.asarray(targets, dtype=np.float64).reshape(-1, 3)
+    cutoff = grid["cutoff"]
+    dims = grid["dims"]
+    results = []
+    for chunk in range(0, len(targets), target_chunk):
+        x = targets[chunk:chunk + target_chunk]
+
+        # The cells around each target that have sources
+        coords = np.floor((x - grid["low"]) / cutoff).astype(np.int64)[:, None, :] + cell_offsets[None, :, :]
+        inside = np.all((coords >= 0) & (coords < dims), axis=2)
+        keys = (coords[..., 0] * dims[1] + coords[..., 1]) * dims[2] + coords[..., 2]
+        index = np.minimum(np.searchsorted(grid["cell_keys"], keys), len(grid["cell_keys"]) - 1)
+        found = inside & (grid["cell_keys"][index] == keys) if len(grid["cell_keys"]) else np.zeros_like(inside)
+        target, neighbor = np.nonzero(found)
+        cell = index[target, neighbor]
+
+        # Every source of those cells is a candidate.  Only candidates within the cutoff are kept.
+        counts = grid["cell_count"][cell]
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        target = np.repeat(target, counts)
+        source = grid["order"][np.repeat(grid["cell_start"][cell], counts) + offsets]
+        d = x[target] - grid["positions"][source]
+        r2 = np.einsum("ij,ij->i", d, d)
+        keep = r2 <= cutoff * cutoff
+        results.append((target[keep] + chunk, source[keep], d[keep], r2[keep]))
+
+    if not results:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros((0, 3)), np.zeros(0)
+    return tuple(np.concatenate(parts) for parts in zip(*results))
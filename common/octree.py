@@ -0,0 +1,227 @@
+# Octree
+
+#------------------------------------------------------------------------------------------------------
+# BARNES-HUT OCTREE
+# Approximates inverse power forces (charge and force fields) from many sources in O(N log N) instead of evaluating every pair.
+# Sources are sorted along a Morton (Z-order) curve so that every node of the octree is a contiguous range of sources, and the
+# tree is built one level at a time with array operations.  A node that is far enough away from a particle, measured by the
+# opening angle theta (node size / distance), acts as a single source at its center of charge.  Nearby nodes are opened and
+# the sources of nearby leaves are summed exactly.  Smaller theta is more accurate and slower; theta = 0 is exact.
+# This module does not import bpy so that it can be used outside of Blender.
+#------------------------------------------------------------------------------------------------------
+
+import numpy as np
+
+
+# Morton codes use 21 bits per axis, so the deepest level of the tree is 21
+max_depth = 21
+
+# Largest number of particles traversed at once.  Limits the memory used by the node lists of the traversal.
+target_chunk = 4096
+
+
+#------------------------------------------------------------------------------------------------------
+# Spreads the lower 21 bits of integers so that there are two zero bits between each bit, for interleaving x, y and z
+#------------------------------------------------------------------------------------------------------
+
+def _spread_bits(v):
+    v = v.astype(np.uint64) & np.uint64(0x1FFFFF)
+    v = (v | (v << np.uint64(32))) & np.uint64(0x1F00000000FFFF)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x1F0000FF0000FF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x100F00F00F00F00F)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x10C30C30C30C30C3)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x1249249249249249)
+    return v
+
+
+#------------------------------------------------------------------------------------------------------
+# Builds octrees of sources.  Positive and negative sources have separate trees, because the center of a node with both
+# would not represent either (e.g. a neutral node), while the center of charge of sources of one sign is always inside the node.
+# positions: (N, 3) array of source locations
+# strengths: (N,) array of source strengths (e.g. charges; may be positive and negative)
+# leaf_size (optional): nodes with this many sources or fewer are not divided
+# RETURNS a list of trees (dictionaries of node arrays) that is passed to field
+#------------------------------------------------------------------------------------------------------
+
+def build(positions, strengths, leaf_size=16):
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    strengths = np.asarray(strengths, dtype=np.float64)
+    return [build_tree(positions[sign], strengths[sign], leaf_size) for sign in (strengths > 0, strengths < 0) if sign.any()]
+
+
+#------------------------------------------------------------------------------------------------------
+# Builds one octree of sources.  See build.
+#------------------------------------------------------------------------------------------------------
+
+def build_tree(positions, strengths, leaf_size=16):
+    low = positions.min(axis=0)
+    size = max(float((positions.max(axis=0) - low).max()), 1e-9) * (1 + 1e-6)    # Side of the root cube, slightly larger so that all cells are inside
+    cells = np.minimum(((positions - low) / size * 2 ** max_depth).astype(np.int64), 2 ** max_depth - 1)
+    codes = _spread_bits(cells[:, 0]) << np.uint64(2) | _spread_bits(cells[:, 1]) << np.uint64(1) | _spread_bits(cells[:, 2])
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    cells = cells[order]
+    positions = positions[order]
+    strengths = strengths[order]
+
+    # Prefix sums give the totals of any node (a contiguous range of sorted sources) with two lookups
+    weights = np.abs(strengths)
+    cumulative_strength = np.concatenate([[0], np.cumsum(strengths)])
+    cumulative_weight = np.concatenate([[0], np.cumsum(weights)])
+    cumulative_moment = np.concatenate([np.zeros((1, 3)), np.cumsum(positions * weights[:, None], axis=0)])
+
+    # Nodes are added level by level.  Children of a node are contiguous in the node arrays.
+    starts = [np.array([0])]
+    ends = [np.array([len(positions)])]
+    levels = [np.array([0])]
+    first_child = []
+    child_count = []
+    level_start = 0
+    level_starts, level_ends = starts[0], ends[0]
+    for level in range(max_depth + 1):
+        split = (level_ends - level_starts > leaf_size) & (level < max_depth)
+        children_first = np.full(len(level_starts), -1)
+        children_count = np.zeros(len(level_starts), dtype=np.int64)
+        if split.any():
+
+            # Sources of the nodes being split, and where the child key (the Morton code prefix of the next level) changes
+            counts = level_ends[split] - level_starts[split]
+            index = np.repeat(level_starts[split], counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            keys = codes[index] >> np.uint64(3 * (max_depth - level - 1))
+            new_run = np.ones(len(index), dtype=bool)
+            new_run[1:] = (keys[1:] != keys[:-1]) | (index[1:] != index[:-1] + 1)
+            child_starts = index[new_run]
+            child_ends = index[np.flatnonzero(np.append(new_run[1:], True))] + 1
+
+            # Each child's parent is the split node whose range contains the child's first source
+            parents = np.flatnonzero(split)[np.searchsorted(level_starts[split], child_starts, side="right") - 1]
+            next_start = level_start + len(level_starts)
+            children_count[:] = np.bincount(parents, minlength=len(level_starts))
+            children_first[split] = next_start + np.searchsorted(parents, np.flatnonzero(split))
+            starts.append(child_starts)
+            ends.append(child_ends)
+            levels.append(np.full(len(child_starts), level + 1))
+            level_start = next_start
+            level_starts, level_ends = child_starts, child_ends
+        first_child.append(children_first)
+        child_count.append(children_count)
+        if not split.any():
+            break
+
+    start = np.concatenate(starts)
+    end = np.concatenate(ends)
+    level = np.concatenate(levels)
+    strength = cumulative_strength[end] - cumulative_strength[start]
+    weight = cumulative_weight[end] - cumulative_weight[start]
+    half_size = size / 2 ** (level + 1)
+    cube_center = low + (cells[start] >> (max_depth - level)[:, None]) * (2 * half_size)[:, None] + half_size[:, None]
+    center = np.where(weight[:, None] > 0, (cumulative_moment[end] - cumulative_moment[start]) / np.maximum(weight, 1e-300)[:, None], cube_center)
+
+    tree = {
+        "order": order,
+        "positions": positions,
+        "strengths": strengths,
+        "start": start,
+        "end": end,
+        "strength": strength,
+        "center": center,
+        "cube_center": cube_center,
+        "half_size": half_size,
+        "first_child": np.concatenate(first_child),
+        "child_count": np.concatenate(child_count),
+    }
+    return tree
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns pairs (target, item) for each target repeated by its count, with items first[target] to first[target] + count - 1
+#------------------------------------------------------------------------------------------------------
+
+def _expand(targets, first, counts):
+    total = counts.sum()
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(targets, counts), np.repeat(first, counts) + offsets
+
+
+#------------------------------------------------------------------------------------------------------
+# Calculates the field of the sources of a tree at target locations: the sum of strength * d / r^(falloff_power + 1),
+# where d is the vector from a source to the target.  Multiply by a particle's charge for the charge force.
+# Nearby targets are grouped (the leaves of an octree of the targets) and traverse the source trees together, so the tree
+# is walked once per group instead of once per target.  A node is accepted for a group when it is smaller than theta times
+# the distance from the group's bounding box to the node's center of charge, which bounds the error for every target in the group.
+# trees: the trees returned by build
+# targets: (T, 3) array of locations.  A target at the same location as a source is not affected by that source.
+# theta (optional): the opening angle.  Nodes smaller than theta * distance act as a single source.
+# falloff_power (optional): the power of distance the field falls off with (2 for inverse square)
+# softening (optional): the smallest distance used
+# max_distance (optional): sources further than this have no effect (0 for no limit)
+# group_size (optional): the largest number of targets that traverse the trees together
+# RETURNS field (T, 3) array and a (T,) boolean array of targets within range of at least one source
+#------------------------------------------------------------------------------------------------------
+
+def field(trees, targets, theta=0.5, falloff_power=2, softening=0.01, max_distance=0, group_size=32):
+    targets = np.asarray(targets, dtype=np.float64).reshape(-1, 3)
+    result = np.zeros_like(targets)
+    in_range = np.zeros(len(targets), dtype=bool)
+    if not len(targets) or not trees:
+        return result, in_range
+
+    # Groups of targets in Morton order, and the bounding box of each group
+    grouping = build_tree(targets, np.ones(len(targets)), group_size)
+    x = grouping["positions"]
+    leaves = np.flatnonzero(grouping["child_count"] == 0)
+    leaves = leaves[np.argsort(grouping["start"][leaves])]
+    group_start = grouping["start"][leaves]
+    group_count = grouping["end"][leaves] - group_start
+    low = np.minimum.reduceat(x, group_start, axis=0)
+    high = np.maximum.reduceat(x, group_start, axis=0)
+    box_center = (low + high) / 2
+    box_half = (high - low) / 2
+    sorted_result = np.zeros_like(x)
+    sorted_range = np.zeros(len(x), dtype=bool)
+
+    # Adds the field of sources of strength s at offsets d from targets t (indices of sorted targets)
+    def add(t, d, s):
+        r2 = np.einsum("ij,ij->i", d, d)
+        active = (r2 > 0) & (s != 0)
+        if max_distance:
+            active &= r2 <= max_distance ** 2
+        r = np.sqrt(np.maximum(r2, softening ** 2))
+        magnitude = np.where(active, s / r ** (falloff_power + 1), 0)
+        for k in range(3):
+            sorted_result[:, k] += np.bincount(t, weights=magnitude * d[:, k], minlength=len(x))
+        sorted_range[:] |= np.bincount(t, weights=active, minlength=len(x)) > 0
+
+    groups_per_chunk = max(1, target_chunk // group_size)
+    for tree, chunk in [(tree, chunk) for tree in trees for chunk in range(0, len(leaves), groups_per_chunk)]:
+        g = np.arange(chunk, min(chunk + groups_per_chunk, len(leaves)))
+        n = np.zeros(len(g), dtype=np.int64)                       # Every group starts at the root
+        while len(g):
+            half = tree["half_size"][n]
+            separation = np.abs(box_center[g] - tree["cube_center"][n]) - box_half[g]
+            gap2 = np.sum(np.maximum(separation - half[:, None], 0) ** 2, axis=1)
+            if max_distance:                                       # Nodes entirely out of range of the group are dropped
+                keep = gap2 <= max_distance ** 2
+                g, n, half, separation, gap2 = g[keep], n[keep], half[keep], separation[keep], gap2[keep]
+            nearest2 = np.sum(np.maximum(np.abs(box_center[g] - tree["center"][n]) - box_half[g], 0) ** 2, axis=1)
+
+            # Accept nodes that are far enough away and do not overlap the group; with a distance limit the whole node must be in range
+            accept = (gap2 > 0) & (4 * half * half < theta * theta * nearest2)
+            if max_distance:
+                accept &= np.sum((separation + 2 * box_half[g] + half[:, None]) ** 2, axis=1) <= max_distance ** 2
+            leaf = ~accept & (tree["child_count"][n] == 0)
+            opened = ~accept & ~leaf
+
+            if accept.any():
+                pair, t = _expand(np.flatnonzero(accept), group_start[g[accept]], group_count[g[accept]])
+                add(t, x[t] - tree["center"][n[pair]], tree["strength"][n[pair]])
+            if leaf.any():
+                pair, t = _expand(np.flatnonzero(leaf), group_start[g[leaf]], group_count[g[leaf]])
+                node = n[pair]
+                target, source = _expand(t, tree["start"][node], tree["end"][node] - tree["start"][node])
+                add(target, x[target] - tree["positions"][source], tree["strengths"][source])
+            g, n = _expand(g[opened], tree["first_child"][n[opened]], tree["child_count"][n[opened]])
+
+    result[grouping["order"]] = sorted_result
+    in_range[grouping["order"]] = sorted_range
+    return result, in_range
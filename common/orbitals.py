@@ -0,0 +1,225 @@
+# Orbitals
+
+#------------------------------------------------------------------------------------------------------
+# ORBITAL SOLVER
+# Calculates the orbital distances and amplitude factors of any atom or ion by solving the force balance of every orbital
+# simultaneously, for atoms and ions heavier than the data file (common/data.py), which stops at calcium.
+# Each orbital (shell) of the fill sequence has m electrons spread evenly over a sphere of radius r, in Bohr radii.  The electric
+# force pulling an electron to the nucleus balances the orbital force pushing it out (https://energywavetheory.com/equations/):
+#
+#   Zeff / r^2 = n^2 / r^3        Zeff = Z - E(m) / m - sum of the other orbitals' electrons within r
+#
+# where n is the orbital's shell number and E(m) is the repulsion of the m electrons on the sphere (the Thomson problem), so a
+# single electron is at r = 1 / Z and two electrons are at r = 1 / (Z - 0.25), the same as the data file.  Electrons are standing
+# waves, not points, so the part of another orbital within r is a smooth fraction of its electrons (the charge of a 1s-like cloud
+# around that orbital's distance).  The equations of all orbitals are solved together with Newton's method.
+# The amplitude factor of an orbital is its Zeff, so that the orbital energy (1/2) k e^2 Zeff / r matches Phase 4.
+# Results are cached in memory and on disk, so an atom is only solved once.
+# This module does not import bpy so that it can be used outside of Blender.
+#------------------------------------------------------------------------------------------------------
+
+import sys
+import os
+import importlib
+import numpy as np
+
+from common import data
+importlib.reload(data)
+from common import cache
+importlib.reload(cache)
+
+
+# Repulsion energy of m electrons spread evenly over a sphere of radius 1 (the minimum of the Thomson problem), for the
+# number of electrons in an s, p, d or f orbital
+repulsion_energy = np.array([0.0, 0.0, 0.5, 1.732051, 3.674234, 6.474691, 9.985281, 14.452977, 19.675288, 25.759987, 32.716950,
+    40.596451, 49.165253, 58.853231, 69.306363])
+
+# Shell number of each orbital in the fill sequence
+shell_numbers = np.array([int(name[0]) for name in data.orbital_names])
+
+# Newton's method stops when every distance changes by less than this fraction, or after max_iterations
+tolerance = 1e-12
+max_iterations = 100
+
+# Directory of solved atoms on disk
+cache_directory = os.path.join(cache.default_directory, "orbitals")
+
+# Solved atoms by (protons, electrons)
+solved = {}
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the number of electrons in each orbital of the fill sequence
+# electrons: the number of electrons of the atom or ion
+#------------------------------------------------------------------------------------------------------
+
+def occupancy(electrons):
+    capacity = np.array(data.electron_sequence)
+    if not 0 <= electrons <= capacity.sum():
+        raise ValueError("the fill sequence supports up to " + str(capacity.sum()) + " electrons: " + str(electrons))
+    filled = np.clip(electrons - (np.cumsum(capacity) - capacity), 0, capacity)
+    return filled[filled > 0]
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the fraction of a 1s-like cloud at distance b that is within distance a, and its derivative by x = 2a / b
+#------------------------------------------------------------------------------------------------------
+
+def enclosed(a, b):
+    x = 2 * a / b
+    decay = np.exp(-x)
+    return 1 - decay * (1 + x + x * x / 2), decay * x * x / 2
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the force balance residuals r Zeff - n^2 of the orbitals of atoms (zero at the solution), their Zeff and the slope of the
+# enclosed fractions.  Empty orbitals have no residual.
+# r: (B, S) array of orbital distances
+# orbits: a dictionary of the (B, S) arrays protons, electrons (m), shells (n), self_repulsion (E(m) / m) and empty
+#------------------------------------------------------------------------------------------------------
+
+def residuals(r, orbits):
+    fraction, slope = enclosed(r[:, :, None], r[:, None, :])
+    diagonal = np.eye(r.shape[1], dtype=bool)
+    fraction[:, diagonal] = 0
+    slope[:, diagonal] = 0
+    zeff = orbits["protons"] - orbits["self_repulsion"] - np.einsum("bst,bt->bs", fraction, orbits["electrons"])
+    residual = np.where(orbits["empty"], 0, r * zeff - orbits["shells"] ** 2)
+    return residual, zeff, slope
+
+
+#------------------------------------------------------------------------------------------------------
+# Solves the orbital distances of atoms together.  Atoms with fewer orbitals are padded with empty orbitals.
+# protons: (B,) array of the number of protons (Z) of each atom
+# electrons: (B,) array of the number of electrons of each atom (1 to Z)
+# RETURNS distance (B, S) array of orbital distances in Bohr radii, amplitude (B, S) array of amplitude factors (Zeff),
+#     and the number of orbitals of each atom
+#------------------------------------------------------------------------------------------------------
+
+def solve_many(protons, electrons):
+    filled = [occupancy(int(e)) for e in electrons]
+    orbitals = np.array([len(f) for f in filled])
+    m = np.zeros((len(filled), max(orbitals)))
+    for a, f in enumerate(filled):
+        m[a, :len(f)] = f
+    orbits = {
+        "protons": np.asarray(protons, dtype=np.float64)[:, None],
+        "electrons": m,
+        "shells": shell_numbers[:m.shape[1]][None, :] * np.ones_like(m),
+        "self_repulsion": np.divide(repulsion_energy[m.astype(int)], m, out=np.zeros_like(m), where=m > 0),
+        "empty": m == 0,
+    }
+    diagonal = np.eye(m.shape[1], dtype=bool)
+    empty_pairs = orbits["empty"][:, :, None] | orbits["empty"][:, None, :]
+
+    # Start from orbitals screened by the electrons of lower shells and half of the other electrons of the same shell.  Screening
+    # by the fill sequence instead (e.g. 3d by 4s) starts Newton's method in the wrong order of orbitals, where it may not converge.
+    n = orbits["shells"]
+    inner = np.einsum("bst,bt->bs", (n[:, None, :] < n[:, :, None]) + 0.5 * ((n[:, None, :] == n[:, :, None]) & ~diagonal), m)
+    r = n ** 2 / np.maximum(orbits["protons"] - orbits["self_repulsion"] - inner, 1)
+    residual, zeff, slope = residuals(r, orbits)
+
+    for _ in range(max_iterations):
+
+        # Jacobian of the residuals by the distances.  Empty orbitals have an identity row so that they do not move.
+        jacobian = 2 * r[:, :, None] ** 2 * m[:, None, :] * slope / r[:, None, :] ** 2
+        jacobian[:, diagonal] = zeff - r * np.einsum("bst,bt->bs", slope * 2 / r[:, None, :], m)
+        jacobian[empty_pairs] = 0
+        jacobian[:, diagonal] += orbits["empty"]
+        step = -np.linalg.solve(jacobian, residual[:, :, None])[:, :, 0]
+
+        # Steps are limited to halving or doubling a distance, so distances stay positive.  Each atom's step is halved
+        # until its residuals decrease (backtracking), since a full Newton step can overshoot far from the solution.
+        step = np.clip(step, -r / 2, r)
+        norm = np.linalg.norm(residual, axis=1)
+        scale = np.ones((len(r), 1))
+        for _ in range(30):
+            trial = r + scale * step
+            trial_residual, trial_zeff, trial_slope = residuals(trial, orbits)
+            worse = np.linalg.norm(trial_residual, axis=1) > norm
+            if not worse.any():
+                break
+            scale[worse] /= 2
+        converged = np.all(np.abs(trial - r) <= tolerance * r)
+        r, residual, zeff, slope = trial, trial_residual, trial_zeff, trial_slope
+        if converged:
+            break
+    else:
+        raise RuntimeError("orbital distances did not converge")
+
+    r[orbits["empty"]] = 0
+    zeff[orbits["empty"]] = 0
+    return r, zeff, orbitals
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the file of a solved atom on disk.  Files are keyed by the atom and the source of the solver, so they are not reused
+# after the equations change.
+# source: the hash of the solver's source (see cache.source_hash)
+#------------------------------------------------------------------------------------------------------
+
+def cache_path(protons, electrons, source):
+    return os.path.join(cache_directory, cache.key("orbitals", protons, electrons, source) + ".npz")
+
+
+#------------------------------------------------------------------------------------------------------
+# Saves a solved atom to disk.  Saving is only a cache, so if the directory cannot be written the atom is kept in memory and
+# solved again in the next session.
+# path: the file of the atom (see cache_path)
+# atom: the dictionary of the solved atom
+#------------------------------------------------------------------------------------------------------
+
+def save_atom(path, atom):
+    temporary = path + "." + str(os.getpid()) + ".tmp.npz"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(temporary, **atom)
+        os.replace(temporary, path)                                     # Other processes never read a partly written file
+    except OSError:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the orbital distances and amplitude factors of atoms and ions.  Atoms that have not been solved before (in this
+# session or on disk) are solved together and saved.
+# protons: a list of the number of protons (Z) of each atom
+# electrons: a list of the number of electrons of each atom (1 to Z)
+# RETURNS a list of dictionaries of the number of orbitals, the ratio of each orbital distance to the Bohr radius and the
+#     amplitude factor of each orbital, for the orbitals of the fill sequence (data.orbital_names)
+#------------------------------------------------------------------------------------------------------
+
+def solve_atoms(protons, electrons):
+    atoms = [(int(z), int(e)) for z, e in zip(protons, electrons)]
+    source = cache.source_hash(data, cache, sys.modules[__name__])
+    missing = []
+    for z, e in atoms:
+        if not 1 <= e <= z:
+            raise ValueError("atoms need 1 to Z electrons: " + str(z) + " protons, " + str(e) + " electrons")
+        if (z, e) in solved:
+            continue
+        try:
+            with np.load(cache_path(z, e, source)) as f:
+                solved[(z, e)] = {"orbitals": int(f["orbitals"]), "ratio": f["ratio"], "amplitude": f["amplitude"]}
+        except (OSError, ValueError, KeyError):
+            missing.append((z, e))
+
+    if missing:
+        missing = sorted(set(missing))
+        distance, amplitude, orbitals = solve_many([z for z, _ in missing], [e for _, e in missing])
+        padding = (0, len(data.orbital_names) - distance.shape[1])
+        for i, (z, e) in enumerate(missing):
+            atom = {"orbitals": int(orbitals[i]), "ratio": np.pad(distance[i], padding), "amplitude": np.pad(amplitude[i], padding)}
+            solved[(z, e)] = atom
+            save_atom(cache_path(z, e, source), atom)
+    return [solved[atom] for atom in atoms]
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the orbital distances and amplitude factors of an atom or ion (see solve_atoms)
+# protons: the number of protons (Z)
+# electrons: the number of electrons (1 to Z)
+#------------------------------------------------------------------------------------------------------
+
+def solve(protons, electrons):
+    return solve_atoms([protons], [electrons])[0]
@@ -0,0 +1,276 @@
+# Parallel
+
+#------------------------------------------------------------------------------------------------------
+# PARALLEL FORCE EVALUATION
+# Splits the force calculation of the particle engine (common/engine.py) between worker processes on all CPU cores.
+# The particle positions, velocities, forces and drag are held in shared memory (multiprocessing.shared_memory) that the main
+# process and every worker use as NumPy arrays, so no particle data is pickled: each step only sends each worker the frame
+# number and its range of particles.  Each worker has its own copy of the system's fields and effectors, sent once when the
+# pool starts, and calculates the forces on its range of particles from every source.  The main process waits for all workers
+# and then integrates the step.  Workers are Python processes running common/force_worker.py, which talk to the main process
+# through their standard input and output.  Results are the same as the serial engine for any number of workers, except with the octree
+# backend, whose approximation depends on how particles are grouped.
+#
+#   python -m common.parallel --particles 20000 --frames 3
+#
+# prints the speedup from 1 worker to the number of CPUs for a supernova-like explosion of charged particles.
+# This module does not import bpy so that it can be used outside of Blender.
+#------------------------------------------------------------------------------------------------------
+
+import sys
+import os
+import argparse
+import copy
+import importlib
+import pickle
+import subprocess
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+from common import engine
+importlib.reload(engine)
+
+
+# Systems with fewer particles than this are run in one process, because starting workers takes longer than the steps saved
+parallel_minimum = 2000
+
+# Arrays shared between processes and their number of values per particle
+shared_arrays = {"positions": 3, "velocities": 3, "forces": 3, "drag": 1}
+
+# The Python interpreter that runs the workers.  Inside Blender (2.91 and later) this is Blender's own Python.
+executable = sys.executable
+
+project_dir = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns NumPy arrays of every shared array in shared memory blocks
+# memory: a dictionary of shared memory blocks by array name
+# count: the number of particles
+#------------------------------------------------------------------------------------------------------
+
+def shared_views(memory, count):
+    return {name: np.ndarray((count, width) if width > 1 else (count,), dtype=np.float64, buffer=memory[name].buf)
+        for name, width in shared_arrays.items()}
+
+
+#------------------------------------------------------------------------------------------------------
+# Sends a message to a worker process (see common/force_worker.py)
+#------------------------------------------------------------------------------------------------------
+
+def send(process, message):
+    pickle.dump(message, process.stdin, protocol=pickle.HIGHEST_PROTOCOL)
+    process.stdin.flush()
+
+
+#------------------------------------------------------------------------------------------------------
+# Waits for the answer of a worker process to a task, and raises the worker's error if its forces failed
+#------------------------------------------------------------------------------------------------------
+
+def receive(process):
+    try:
+        error = pickle.load(process.stdout)
+    except EOFError:
+        raise RuntimeError("a force worker stopped (exit code " + str(process.wait()) + ")") from None
+    if error is not None:
+        raise RuntimeError("a force worker failed:\n" + error)
+
+
+#------------------------------------------------------------------------------------------------------
+# Starts a pool of worker processes for a system.  The system's positions and velocities are moved to shared memory until stop is called.
+# system: the system created by engine.create_system, with all particles and effectors added
+# workers (optional): the number of worker processes (0 for the number of CPUs)
+# RETURNS pool - a dictionary of the processes and shared memory that is passed to forces and stop
+#------------------------------------------------------------------------------------------------------
+
+def start(system, workers=0):
+    workers = workers or os.cpu_count() or 1
+    count = len(system["positions"])
+    memory = {name: shared_memory.SharedMemory(create=True, size=max(1, count * width * 8)) for name, width in shared_arrays.items()}
+    arrays = shared_views(memory, count)
+    arrays["positions"][:] = system["positions"]
+    arrays["velocities"][:] = system["velocities"]
+    system["positions"] = arrays["positions"]
+    system["velocities"] = arrays["velocities"]
+
+    # Workers receive the system once, without its particle arrays (they are in shared memory) or cell lists (each worker builds its own).
+    # They are new processes rather than forks, because forking Blender's process is not safe.
+    worker_system = dict(system, positions=None, velocities=None, neighbors={})
+    names = {name: m.name for name, m in memory.items()}
+    processes = []
+    try:
+        for _ in range(workers):
+            processes.append(subprocess.Popen([executable, "-m", "common.force_worker"], cwd=project_dir, stdin=subprocess.PIPE, stdout=subprocess.PIPE))
+            send(processes[-1], (worker_system, names))
+    except BaseException:
+        stop_processes(processes)
+        release(memory, arrays, system)
+        raise
+    bounds = np.linspace(0, count, workers + 1).astype(int).tolist()
+
+    pool = {
+        "processes": processes,
+        "memory": memory,
+        "arrays": arrays,
+        "ranges": list(zip(bounds[:-1], bounds[1:])),
+    }
+    return pool
+
+
+#------------------------------------------------------------------------------------------------------
+# Calculates the force and drag on every particle of a system using the worker processes.  Used as the evaluate function of engine.step.
+# pool: the pool returned by start
+# system: the system the pool was started for
+# RETURNS forces (N, 3) array and drag (N,) array, in shared memory
+#------------------------------------------------------------------------------------------------------
+
+def forces(pool, system):
+    for process, (start, end) in zip(pool["processes"], pool["ranges"]):
+        send(process, (system["frame"], start, end))
+    for process in pool["processes"]:
+        receive(process)
+    return pool["arrays"]["forces"], pool["arrays"]["drag"]
+
+
+#------------------------------------------------------------------------------------------------------
+# Stops the worker processes and moves the system's positions and velocities back from shared memory
+# pool: the pool returned by start
+# system: the system the pool was started for
+#------------------------------------------------------------------------------------------------------
+
+def stop(pool, system):
+    stop_processes(pool["processes"])
+    release(pool["memory"], pool["arrays"], system)
+
+
+#------------------------------------------------------------------------------------------------------
+# Stops worker processes by closing their input, and waits for them to finish
+#------------------------------------------------------------------------------------------------------
+
+def stop_processes(processes):
+    for process in processes:
+        try:
+            process.stdin.close()
+        except OSError:
+            pass                                                        # The worker has already stopped
+    for process in processes:
+        process.wait()
+        process.stdout.close()
+
+
+#------------------------------------------------------------------------------------------------------
+# Copies the system's positions and velocities out of shared memory and frees the shared memory
+# memory: the shared memory blocks by array name
+# arrays: the arrays of the shared memory (see shared_views)
+# system: the system using the arrays
+#------------------------------------------------------------------------------------------------------
+
+def release(memory, arrays, system):
+    system["positions"] = np.array(arrays["positions"])
+    system["velocities"] = np.array(arrays["velocities"])
+    arrays.clear()                                                      # Shared memory cannot be closed while arrays use it
+    for block in memory.values():
+        block.close()
+        block.unlink()
+
+
+#------------------------------------------------------------------------------------------------------
+# Runs a system for a number of frames with the forces calculated by worker processes.  Small systems are run in this process.
+# system: the system created by engine.create_system
+# frames: the number of frames to step
+# workers (optional): the number of worker processes (0 for the number of CPUs, 1 to run in this process)
+# RETURNS trajectory (frames + 1, N, 3) float32 array (see engine.run)
+#------------------------------------------------------------------------------------------------------
+
+def run(system, frames, workers=0):
+    trajectory = np.empty((frames + 1, len(system["positions"]), 3), dtype=np.float32)
+    for i, state in enumerate(steps(system, frames, workers)):
+        trajectory[i] = state["positions"]
+    return trajectory
+
+
+#------------------------------------------------------------------------------------------------------
+# Runs a system for a number of frames with the forces calculated by worker processes, yielding the system before the first
+# step and after each frame (see engine.steps).  The workers are stopped when the frames are finished or the loop ends early.
+# system: the system created by engine.create_system
+# frames: the number of frames to step
+# workers (optional): the number of worker processes (0 for the number of CPUs, 1 to run in this process)
+#------------------------------------------------------------------------------------------------------
+
+def steps(system, frames, workers=0):
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(system["positions"]) < parallel_minimum:
+        yield from engine.steps(system, frames)
+        return
+    pool = start(system, workers)
+    try:
+        yield from engine.steps(system, frames, evaluate=lambda s: forces(pool, s))
+    finally:
+        stop(pool, system)
+
+
+#------------------------------------------------------------------------------------------------------
+# Measures the speedup of running a system with 1 to N worker processes.  Each run starts from a copy of the system.
+# The time to start the workers is not included, because it does not depend on the number of frames.
+# system: the system created by engine.create_system
+# frames: the number of frames to run
+# max_workers (optional): the largest number of workers (0 for the number of CPUs)
+# RETURNS a list of dictionaries with the workers, seconds and speedup relative to 1 worker
+#------------------------------------------------------------------------------------------------------
+
+def benchmark(system, frames, max_workers=0):
+    results = []
+    for workers in range(1, (max_workers or os.cpu_count() or 1) + 1):
+        trial = copy.deepcopy(system)
+        pool = start(trial, workers) if workers > 1 else None
+        try:
+            begin = time.perf_counter()
+            engine.run(trial, frames, evaluate=None if pool is None else lambda s: forces(pool, s))
+            seconds = time.perf_counter() - begin
+        finally:
+            if pool is not None:
+                stop(pool, trial)
+        results.append({"workers": workers, "seconds": seconds, "speedup": results[0]["seconds"] / seconds if results else 1.0})
+    return results
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns a system like the supernova explosion of Phase 5: charged particles emitted from a sphere pushed out by an
+# external force, with a vortex spin and a wind along the z axis
+# particles: the number of particles
+# backend (optional): the engine backend for charge fields
+# seed (optional): the seed for emitting particles
+#------------------------------------------------------------------------------------------------------
+
+def explosion_system(particles, backend="auto", seed=1):
+    system = engine.create_system(backend=backend)
+    engine.add_particles(system, "Neutrino Emitter", engine.emit_sphere(particles, 10, seed=seed), size=0.1,
+        fields=[engine.field("CHARGE", 1, falloff_power=2)])
+    engine.add_effector(system, engine.field("FORCE", 500, falloff_power=1), [(0, 0, 0)])
+    engine.add_effector(system, engine.field("VORTEX", 5, max_distance=50), [(0, 0, 0)])
+    engine.add_effector(system, engine.field("WIND", 1, flow=0.1), [(0, 0, -20)])
+    return system
+
+
+#------------------------------------------------------------------------------------------------------
+# Command line entry point
+#------------------------------------------------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the speedup of the particle engine with 1 to N worker processes.")
+    parser.add_argument("--particles", type=int, default=20000, help="the number of particles")
+    parser.add_argument("--frames", type=int, default=3, help="the number of frames to run for each number of workers")
+    parser.add_argument("--workers", type=int, default=0, help="the largest number of workers (0 for the number of CPUs)")
+    parser.add_argument("--backend", default="auto", choices=["direct", "octree", "auto"], help="the engine backend for charge fields")
+    args = parser.parse_args(argv)
+
+    results = benchmark(explosion_system(args.particles, args.backend), args.frames, args.workers)
+    print("workers  seconds  speedup")
+    for result in results:
+        print("%7d  %7.2f  %6.2fx" % (result["workers"], result["seconds"], result["speedup"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+# Profiler
+
+#------------------------------------------------------------------------------------------------------
+# SCENE BUILD PROFILER
+# Times where the seconds go when a phase builds.  While profiling is on, a trace function (sys.settrace) records every call of
+# the common helpers (common/functions.py and common/meshes.py, e.g. add_emitter, add_nucleon, add_color, spin_object), every
+# bpy.ops operator and each section of the phase's main function.  Sections are found from the phase's own section comments
+# (a dashed line followed by an upper case title, e.g. "# NEUTRINO EMITTER"), so phases need no changes to be profiled.
+# Each call records its time, its time excluding the calls inside it (self time) and the objects and datablocks it created.
+# The trace is written as Chrome trace JSON, which opens in Perfetto (ui.perfetto.dev) or chrome://tracing, with a summary table
+# of the calls by total time.  Helpers are found by their source file, so they are traced even after the phases reload them.
+# Profiling is off unless it is started (runner --profile, or profile_build in the config for the UI), and costs nothing when off.
+#------------------------------------------------------------------------------------------------------
+
+import bpy
+import sys
+import os
+import bisect
+import json
+import re
+import tempfile
+import time
+
+
+project_dir = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Modules of common helpers that are traced
+traced_modules = ["functions", "meshes"]
+
+# Datablock collections counted before and after each call
+datablock_types = ["objects", "meshes", "materials", "particles", "collections", "curves", "metaballs", "node_groups", "textures", "actions"]
+
+# Where traces of builds from the UI are written
+default_path = os.path.join(tempfile.gettempdir(), "qscope", "profile.json")
+
+# The profile being recorded: the events, the stack of open calls and the open section.  Empty when profiling is off.
+profile = {}
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the number of objects and the number of datablocks of the counted types
+#------------------------------------------------------------------------------------------------------
+
+def datablock_count():
+    return len(bpy.data.objects), sum(len(getattr(bpy.data, name)) for name in datablock_types)
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the section titles of a phase source file and the line numbers they start at
+#------------------------------------------------------------------------------------------------------
+
+def section_headers(path):
+    lines, titles = [], []
+    with open(path) as f:
+        source = f.read().splitlines()
+    for number, (line, next_line) in enumerate(zip(source, source[1:]), start=2):
+        match = re.match(r"\s*# ([A-Z][A-Z0-9 ,&/()\-]+)$", next_line)
+        if line.strip().startswith("#-----") and match:
+            lines.append(number)
+            titles.append(match.group(1).strip())
+    return lines, titles
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns how a function is traced: (name, category) or None if it is not traced.  Only functions defined at the top of a module
+# are traced, not comprehensions or functions defined inside other functions.
+# code: the code object of the function
+#------------------------------------------------------------------------------------------------------
+
+def classify(code):
+    name = code.co_name
+    path = os.path.realpath(code.co_filename)
+    directory, module = os.path.split(os.path.splitext(path)[0])
+    package = os.path.basename(directory)
+    if name == "__call__" and package == "bpy" and module == "ops":
+        return None, "bpy.ops"
+    if getattr(code, "co_qualname", name) != name or name.startswith("<") or os.path.dirname(directory) != project_dir:
+        return None
+    if package == "common" and module in traced_modules:
+        return module + "." + name, module
+    if package.startswith("phase") and name == "main":
+        return package + "." + module + ".main", "phase"
+    return None
+
+
+#------------------------------------------------------------------------------------------------------
+# Opens a call or section: its name, category, start time, the time of the calls inside it and the datablock counts
+#------------------------------------------------------------------------------------------------------
+
+def open_event(name, category):
+    return {"name": name, "category": category, "start": time.perf_counter_ns(), "children": 0, "counts": datablock_count()}
+
+
+#------------------------------------------------------------------------------------------------------
+# Closes a call or section and records it.  Chrome trace events are complete events ("X") with times in microseconds.
+#------------------------------------------------------------------------------------------------------
+
+def close_event(event):
+    end = time.perf_counter_ns()
+    objects, datablocks = datablock_count()
+    duration = end - event["start"]
+    profile["events"].append({"name": event["name"], "cat": event["category"], "ph": "X", "pid": 1, "tid": 1,
+        "ts": (event["start"] - profile["origin"]) / 1000, "dur": duration / 1000,
+        "args": {"self": (duration - event["children"]) / 1000, "objects": objects - event["counts"][0], "datablocks": datablocks - event["counts"][1]}})
+    return duration
+
+
+#------------------------------------------------------------------------------------------------------
+# Trace functions.  trace is called for every Python call while profiling.  Traced calls are pushed on the stack and their frame
+# is traced by trace_call, which pops them when they return.  The phase's main function is traced line by line by trace_phase,
+# which switches sections when a line of a new section runs.
+#------------------------------------------------------------------------------------------------------
+
+def trace(frame, event, arg):
+    codes = profile["codes"]
+    code = frame.f_code
+    if code not in codes:
+        codes[code] = classify(code)
+    kind = codes[code]
+    if kind is None:
+        return None
+
+    name, category = kind
+    if category == "bpy.ops":
+        operator = frame.f_locals.get(code.co_varnames[0]) if code.co_argcount else None
+        name = "bpy.ops." + str(getattr(operator, "_module", "?")) + "." + str(getattr(operator, "_func", "?"))
+    profile["stack"].append(open_event(name, category))
+    if category == "phase":
+        path = code.co_filename
+        if path not in profile["headers"]:
+            profile["headers"][path] = section_headers(path)
+        return trace_phase
+    frame.f_trace_lines = False
+    return trace_call
+
+
+def trace_call(frame, event, arg):
+    if event == "return":
+        pop_call()
+    return trace_call
+
+
+def trace_phase(frame, event, arg):
+    if event == "line":
+        lines, titles = profile["headers"][frame.f_code.co_filename]
+        index = bisect.bisect_right(lines, frame.f_lineno) - 1
+        title = titles[index] if index >= 0 else None
+        section = profile["section"]
+        if section is None or section["name"] != title:
+            close_section()
+            if title:
+                profile["section"] = open_event(title, "section")
+    elif event == "return":
+        close_section()
+        pop_call()
+    return trace_phase
+
+
+#------------------------------------------------------------------------------------------------------
+# Closes the call on the top of the stack and adds its time to the call that it was made from, or to the open section for
+# calls made directly by the phase
+#------------------------------------------------------------------------------------------------------
+
+def pop_call():
+    stack = profile["stack"]
+    duration = close_event(stack.pop())
+    if stack:
+        stack[-1]["children"] += duration
+        if stack[-1]["category"] == "phase" and profile["section"] is not None:
+            profile["section"]["children"] += duration
+
+
+#------------------------------------------------------------------------------------------------------
+# Closes the open section, if any
+#------------------------------------------------------------------------------------------------------
+
+def close_section():
+    if profile["section"] is not None:
+        close_event(profile["section"])
+        profile["section"] = None
+
+
+#------------------------------------------------------------------------------------------------------
+# Starts profiling.  Every call of a traced helper, operator and phase section is recorded until stop.
+#------------------------------------------------------------------------------------------------------
+
+def start():
+    profile.clear()
+    profile.update({"events": [], "stack": [], "section": None, "codes": {}, "headers": {}, "origin": time.perf_counter_ns()})
+    sys.settrace(trace)
+
+
+#------------------------------------------------------------------------------------------------------
+# Stops profiling.  Calls that are still open are closed.
+# RETURNS report - a dictionary of the trace events, the wall time in seconds and the summary (see summarize)
+#------------------------------------------------------------------------------------------------------
+
+def stop():
+    sys.settrace(None)
+    if not profile:
+        return {"events": [], "wall_time": 0, "summary": []}
+    close_section()
+    while profile["stack"]:
+        pop_call()
+    events = sorted(profile["events"], key=lambda e: e["ts"])
+    report = {"events": events, "wall_time": (time.perf_counter_ns() - profile["origin"]) / 1e9, "summary": summarize(events)}
+    profile.clear()
+    return report
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns a summary of trace events: one row for each name with its category, the number of calls, the total and self time in
+# milliseconds and the objects and datablocks created, sorted by total time
+#------------------------------------------------------------------------------------------------------
+
+def summarize(events):
+    rows = {}
+    for e in events:
+        row = rows.setdefault(e["name"], {"name": e["name"], "category": e["cat"], "calls": 0, "total_ms": 0.0, "self_ms": 0.0, "objects": 0, "datablocks": 0})
+        row["calls"] += 1
+        row["total_ms"] += e["dur"] / 1000
+        row["self_ms"] += e["args"]["self"] / 1000
+        row["objects"] += e["args"]["objects"]
+        row["datablocks"] += e["args"]["datablocks"]
+    for row in rows.values():
+        row["mean_ms"] = row["total_ms"] / row["calls"]
+    return sorted(rows.values(), key=lambda row: row["total_ms"], reverse=True)
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the summary as a text table
+# summary: the summary rows (see summarize)
+# limit (optional): the number of rows to include (0 for all)
+#------------------------------------------------------------------------------------------------------
+
+def format_summary(summary, limit=0):
+    lines = ["{:<48} {:<9} {:>7} {:>11} {:>11} {:>10} {:>8} {:>11}".format("Name", "Category", "Calls", "Total (ms)", "Self (ms)", "Mean (ms)", "Objects", "Datablocks")]
+    for row in summary[:limit or None]:
+        lines.append("{:<48} {:<9} {:>7} {:>11.2f} {:>11.2f} {:>10.3f} {:>8} {:>11}".format(row["name"][:48], row["category"], row["calls"],
+            row["total_ms"], row["self_ms"], row["mean_ms"], row["objects"], row["datablocks"]))
+    return "\n".join(lines)
+
+
+#------------------------------------------------------------------------------------------------------
+# Writes a report as a Chrome trace JSON file, and its summary table beside it (the same name with .txt)
+# report: the report returned by stop
+# path: the trace file
+# name (optional): the name of the process shown in the trace viewer
+#------------------------------------------------------------------------------------------------------
+
+def write_trace(report, path, name="Quantum Microscope"):
+    os.makedirs(os.path.dirname(os.path.realpath(path)), exist_ok=True)
+    metadata = [{"name": "process_name", "ph": "M", "pid": 1, "tid": 1, "args": {"name": name}},
+        {"name": "thread_name", "ph": "M", "pid": 1, "tid": 1, "args": {"name": "Scene build"}}]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": metadata + report["events"], "displayTimeUnit": "ms",
+            "otherData": {"wall_time": report["wall_time"], "blender": bpy.app.version_string}}, f)
+    with open(os.path.splitext(path)[0] + ".txt", "w") as f:
+        f.write(format_summary(report["summary"]) + "\n")
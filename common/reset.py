@@ -2,52 +2,148 @@
 
 #------------------------------------------------------------------------------------------------------
 # RESET SIMULATION
-# Reset the simulation by clearing everything and start fresh
+# Reset the simulation by clearing everything the simulator created and start fresh.
+# Data created while building a phase (objects, meshes, materials, particle settings, collections, actions, etc.) is tagged
+# with a custom property.  Only tagged data is removed, in a single bulk removal, so content owned by the user is left alone.
+# The frame change handlers that phases add, and the trajectory files replayed by the particle engine, are removed with it.
+# Files built by earlier versions have no tagged data.  When nothing is tagged, the collections and objects the phases create are
+# found by name instead (see legacy_data), so the first run in an older file replaces its simulation rather than adding to it.
 #------------------------------------------------------------------------------------------------------
 
 import bpy
+import re
+
+# Custom property that marks data created by the simulator
+tag = "qscope"
+
+# The types of data (bpy.data collections) that phases create
+data_types = ["objects", "meshes", "curves", "metaballs", "materials", "particles", "collections", "actions", "lights", "textures",
+    "fonts", "node_groups"]
+
+# Frame change handlers added by phases (common/bake.py, phase5/molecules.py and phase1/spacetime.py), by function name
+frame_handlers = ["update_particles", "update_molecule_count", "update_granules"]
+
+# Names of the collections and objects that phases create.  Only used for files built before simulator data was tagged.
+# A name also matches the names the phases and Blender derive from it (e.g. "Orbital - 1s", "Wavelength 2", "Electron.001").
+legacy_collections = ["Granules", "Neutrinos", "Wavelength", "Standing Waves", "Nodes", "Nucleus", "Orbital", "Molecule"]
+legacy_objects = ["Spacetime", "Granule", "Granule Lattice", "Granule Energy", "Granule Force", "Granule Array", "Neutrino", "Antineutrino",
+    "Neutrino Shell", "Neutrino Emitter", "Wave", "Wavelength", "Standing Wave Sphere", "Standing Wave Core", "Standing Wave Harmonic",
+    "Standing Wave Harmonic Core", "Node", "Emitter", "Electron", "Electron Emitter", "Positron", "Positron Emitter", "Proton",
+    "Proton Radius", "Neutron", "Particle Shell", "Particle Count", "Particle Accelerator", "Axis", "External Force",
+    "External Force Indicator", "Calculations", "Molecule Count", "Wave Center Count", "Hydrogen Emitter", "Helium Emitter", "H", "He"]
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the data that currently exists, to be passed to tag_simulation after a phase is built
+#------------------------------------------------------------------------------------------------------
+
+def snapshot():
+    return {id_data.as_pointer() for data_type in data_types for id_data in getattr(bpy.data, data_type)}
+
+
+#------------------------------------------------------------------------------------------------------
+# Tags all data created since a snapshot as simulator data, so that it is removed by the next clear_simulation
+# before: the set returned by snapshot before the phase was built
+#------------------------------------------------------------------------------------------------------
+
+def tag_simulation(before):
+    for data_type in data_types:
+        for id_data in getattr(bpy.data, data_type):
+            if id_data.as_pointer() not in before:
+                id_data[tag] = True
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns True if a name is one of the names, optionally followed by " - " and a part name, a number or a Blender duplicate
+# number (".001")
+#------------------------------------------------------------------------------------------------------
+
+def legacy_name(name, names):
+    return any(re.fullmatch(re.escape(n) + r"( - .+| \d+)?(\.\d{3})?", name) for n in names)
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the simulator data of a file built before simulator data was tagged: the collections of the phases, the objects in
+# them or named like the objects of the phases, and their children
+#------------------------------------------------------------------------------------------------------
+
+def legacy_data():
+    collections = [c for c in bpy.data.collections if legacy_name(c.name, legacy_collections)]
+    objects = {o for c in collections for o in c.all_objects}
+    objects.update(o for o in bpy.data.objects if legacy_name(o.name, legacy_objects))
+    children = list(objects)
+    while children:
+        for child in children.pop().children:
+            if child not in objects:
+                objects.add(child)
+                children.append(child)
+    return collections + list(objects)
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the data that no object or other data uses, other than objects and collections
+#------------------------------------------------------------------------------------------------------
+
+def orphan_data():
+    return [id_data for data_type in data_types if data_type not in ("objects", "collections")
+        for id_data in getattr(bpy.data, data_type) if id_data.users == 0]
+
+
+#------------------------------------------------------------------------------------------------------
+# Removes data at once.  Blender versions without batch_remove remove each item from its own collection.
+#------------------------------------------------------------------------------------------------------
+
+def remove_data(ids):
+    if hasattr(bpy.data, "batch_remove"):
+        bpy.data.batch_remove(ids)
+        return
+    pointers = {id_data.as_pointer() for id_data in ids}
+    for data_type in data_types:
+        collection = getattr(bpy.data, data_type)
+        for id_data in [i for i in collection if i.as_pointer() in pointers]:
+            collection.remove(id_data)
+
+
+#------------------------------------------------------------------------------------------------------
+# Removes the frame change handlers of previous runs, which would otherwise keep updating data that no longer exists
+#------------------------------------------------------------------------------------------------------
+
+def remove_handlers():
+    for handlers in (bpy.app.handlers.frame_change_pre, bpy.app.handlers.frame_change_post):
+        for handler in [h for h in handlers if h.__name__ in frame_handlers]:
+            handlers.remove(handler)
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns all data tagged as simulator data
+#------------------------------------------------------------------------------------------------------
+
+def simulation_data():
+    return [id_data for data_type in data_types for id_data in getattr(bpy.data, data_type) if id_data.get(tag)]
+
 
 def clear_simulation():
     context = bpy.context
-    scene = context.scene
 
     # Ensure that Blender is in Object mode before starting
     if context.active_object:
         if context.active_object.mode == 'EDIT':
             bpy.ops.object.editmode_toggle()
 
-    # Unhide collections and delete items in collections.
-    for c in bpy.data.collections:
-        c.hide_viewport = False
-        obs = [o for o in c.objects if o.users == 1]
-        while obs:
-            bpy.data.objects.remove(obs.pop())
-
-    # Unhide all other objects to be deleted.
-    for o in bpy.data.objects:
-        o.hide_set(False)
-        o.hide_viewport = False
-
-    # Select the remaining objects to be deleted
-    for o in bpy.context.scene.objects:
-        o.select_set(True)
-
-    # Delete all objects
-    bpy.ops.object.delete()
-
-    # Unlink all the child collections
-    for c in scene.collection.children:
-        scene.collection.children.unlink(c)
-
-    # Running this after removes the orphan collection
-    for c in bpy.data.collections:
-        if not c.users:
-            bpy.data.collections.remove(c)
-
-    # Delete all materials
-    for m in bpy.data.materials:             
-        bpy.data.materials.remove(m)
-
-    # Delete all particle systems
-    for p in bpy.data.particles:
-        bpy.data.particles.remove(p)
+    # Stop updating the previous simulation and close its trajectory files.  The bake module is not reloaded here, because
+    # reloading it would forget the open trajectories before they are closed.
+    remove_handlers()
+    from common import bake
+    bake.clear_trajectories()
+
+    # Remove all simulator data at once
+    ids = simulation_data()
+    if ids:
+        remove_data(ids)
+        return
+
+    # Nothing is tagged in a file built by an earlier version: remove its simulation by name, then the meshes, materials and
+    # other data that only the removed objects used
+    orphans = {id_data.as_pointer() for id_data in orphan_data()}
+    remove_data(legacy_data())
+    remove_data([id_data for id_data in orphan_data() if id_data.as_pointer() not in orphans])
@@ -0,0 +1,334 @@
+# Runner
+
+#------------------------------------------------------------------------------------------------------
+# SIMULATION RUNNER
+# Builds, bakes and exports a phase of the simulation from a dictionary of settings, without the UI or a screen context.
+# The Run buttons in the UI (__init__.py) build scenes through this module, and it can also be run from the command line
+# in background mode so that simulations can run on render-farm nodes:
+#
+#   blender -b -P common/runner.py -- --phase 2 --params params.json --output results/
+#   python -m common.runner --phase 2 --params params.json --output results/     (from the project directory, with bpy as a module)
+#
+# With --profile, the scene build is profiled (common/profiler.py) and profile.json (Chrome trace) and profile.txt are written to the output.
+# The parameter file is JSON using the same names as the UI settings (see default_settings).  Missing settings use the UI defaults.
+#------------------------------------------------------------------------------------------------------
+
+import bpy
+import sys
+import os
+import importlib
+import argparse
+import json
+import time
+
+# The project directory must be on the path to import the phases when run from the command line
+project_dir = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+if project_dir not in sys.path:
+    sys.path.append(project_dir)
+
+
+#------------------------------------------------------------------------------------------------------
+# DEFAULT SETTINGS
+# The settings of the UI panels and their defaults.  Names match the Scene properties registered in __init__.py.
+#------------------------------------------------------------------------------------------------------
+
+default_settings = {
+    "wave_centers": 1,
+    "anti_wave_centers": 0,
+    "neutrinos": 10,
+    "electrons_nucleons": 4,
+    "positrons": 1,
+    "electrons_atoms": 1,
+    "protons": 1,
+    "neutrons": 0,
+    "hydrogen_atoms": 10,
+    "show_electron_cloud": False,
+    "show_calculations": True,
+    "show_forces": True,
+    "show_neutrino_motion": False,
+    "spin": True,
+    "external_force": True,
+    "ext_force_strength": 100,
+    "ext_force_strength_molecules": 100,
+    "particle_accelerator": False,
+    "accelerator_force": 100,
+    "spacetime_length": 20,
+    "wave_amplitude": 2,
+    "wave_speed": 0.1,
+    "longitudinal_wave": True,
+    "transverse_wave": False,
+    "num_frames": 1000,
+    "dimensions_enum": '2',
+    "view_enum": 'G',
+}
+
+
+# The module that builds each phase
+phase_modules = {1: "phase1.spacetime", 2: "phase2.particles", 3: "phase3.nucleons", 4: "phase4.atoms", 5: "phase5.molecules"}
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the settings of the UI panels from a Blender scene, in the format used by build
+# scene: the Blender scene with the Qscope properties
+#------------------------------------------------------------------------------------------------------
+
+def scene_settings(scene):
+    return {name: getattr(scene, name) for name in default_settings}
+
+
+#------------------------------------------------------------------------------------------------------
+# Clears the simulation and builds the scene for a phase
+# phase: the phase number (1 to 5)
+# settings (optional): a dictionary of settings. Settings that are not set use default_settings.
+#------------------------------------------------------------------------------------------------------
+
+def build(phase, settings=None):
+    s = dict(default_settings)
+    s.update(settings or {})
+
+    # Clear the simulation
+    from common import reset
+    importlib.reload(reset)
+    reset.clear_simulation()
+    before = reset.snapshot()
+
+    # Import configs
+    from common import config
+    importlib.reload(config)
+
+    # Set common config variables to the settings
+    config.show_neutrino_motion = s["show_neutrino_motion"]
+    config.wave_amplitude = s["wave_amplitude"]
+    config.wave_speed = s["wave_speed"]
+    config.spin = s["spin"]
+    config.external_force = s["external_force"]
+    config.ext_force_strength = s["ext_force_strength"]
+    config.show_calculations = s["show_calculations"]
+    config.show_forces = s["show_forces"]
+    config.num_frames = s["num_frames"]
+    config.longitudinal_wave = s["longitudinal_wave"]
+    config.transverse_wave = s["transverse_wave"]
+    config.spacetime_length = s["spacetime_length"]
+    config.dimensions = int(s["dimensions_enum"])
+
+    if s["view_enum"] == "G":
+        config.show_granules = True
+    else:
+        config.show_granules = False
+
+    # Tag everything the phase created so that the next reset removes only simulator data, even if the phase fails part-way
+    try:
+        # Execute the correct module based on phase
+        if phase == 1:
+            from phase1 import spacetime
+            importlib.reload(spacetime)
+            spacetime.main(wave_centers = s["wave_centers"],
+            anti_wave_centers = s["anti_wave_centers"])
+
+        if phase == 2:
+            from phase2 import particles
+            importlib.reload(particles)
+            particles.main(neutrinos = s["neutrinos"])
+
+        if phase == 3:
+            from phase3 import nucleons
+            importlib.reload(nucleons)
+            nucleons.main(electrons = s["electrons_nucleons"],
+                positrons = s["positrons"],
+                particle_accelerator = s["particle_accelerator"],
+                accelerator_force = s["accelerator_force"])
+
+        if phase == 4:
+            from phase4 import atoms
+            importlib.reload(atoms)
+            atoms.main(protons = s["protons"],
+                neutrons = s["neutrons"],
+                electrons = s["electrons_atoms"],
+                show_electron_cloud = s["show_electron_cloud"])
+
+        if phase == 5:
+            config.ext_force_strength = s["ext_force_strength_molecules"]
+            from phase5 import molecules
+            importlib.reload(molecules)
+            molecules.main(hydrogen_atoms = s["hydrogen_atoms"])
+
+        bpy.context.scene.frame_end = config.num_frames
+    finally:
+        reset.tag_simulation(before)
+
+
+#------------------------------------------------------------------------------------------------------
+# Builds the scene for a phase while profiling, and writes the trace and its summary table (see common/profiler.py)
+# phase: the phase number (1 to 5)
+# settings (optional): a dictionary of settings. Settings that are not set use default_settings.
+# path (optional): the trace file.  The summary table is written beside it (profile.txt).
+# RETURNS the profile report
+#------------------------------------------------------------------------------------------------------
+
+def profile_build(phase, settings=None, path=""):
+    from common import profiler
+    importlib.reload(profiler)
+    profiler.start()
+    try:
+        build(phase, settings)
+    finally:
+        report = profiler.stop()
+    path = path or profiler.default_path
+    profiler.write_trace(report, path, name="Phase " + str(phase))
+    print(profiler.format_summary(report["summary"], limit=20))
+    print("Profile: " + path)
+    return report
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the bake cache key of the scene built for a phase: the settings, the effective config after the phase changed it,
+# the seeds of every particle system, the Blender version and the source of the modules that built the scene.
+# Call after build, because phases change the config and the seeds.
+# phase: the phase number (1 to 5)
+# settings (optional): the settings the phase was built with
+#------------------------------------------------------------------------------------------------------
+
+def scene_key(phase, settings=None):
+    from common import config, functions, cache, data, calculations, orbitals, cloud
+    seeds = {o.name: [ps.seed for ps in o.particle_systems] for o in bpy.context.scene.objects if o.particle_systems}
+    state = cache.module_state(config, exclude=("bake_cache", "bake_cache_size", "track_clusters", "cluster_distance", "profile_build"))
+    return cache.key("scene", phase, dict(default_settings, **(settings or {})), state, seeds, tuple(bpy.app.version),
+        cache.source_hash(functions, data, calculations, orbitals, cloud, sys.modules[phase_modules[phase]]))
+
+
+#------------------------------------------------------------------------------------------------------
+# Bakes the particle systems of the scene by stepping every frame.  Stepping frames in order fills the point caches without needing an operator context.
+# entry_key (optional): if set, the trajectories are recorded and stored in the bake cache with this key (see scene_key),
+#     or replayed without stepping any frames if the cache has the key.  Trajectories are also recorded when the phase tracks
+#     clusters (config.cluster_distance), so that their formation and decay are logged.
+# RETURNS the number of frames baked (0 if the trajectories were loaded from the cache)
+#------------------------------------------------------------------------------------------------------
+
+def bake(entry_key=None):
+    scene = bpy.context.scene
+    from common import config, bake as particle_bake
+    if entry_key or config.cluster_distance:
+        if particle_bake.bake_scene(entry_key, config.bake_cache_size, config.cluster_distance):
+            return 0
+    else:
+        for frame in range(scene.frame_start, scene.frame_end + 1):
+            scene.frame_set(frame)
+    return scene.frame_end - scene.frame_start + 1
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns a summary of the particles at the current frame: the count and mean location for each particle system
+#------------------------------------------------------------------------------------------------------
+
+def particle_summary():
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    summary = {}
+    for o in bpy.context.scene.objects:
+        if not o.particle_systems:
+            continue
+        for ps in o.evaluated_get(depsgraph).particle_systems:
+            locations = [tuple(p.location) for p in ps.particles if p.alive_state == 'ALIVE']
+            mean = [sum(axis) / len(locations) for axis in zip(*locations)] if locations else [0, 0, 0]
+            summary[o.name + " - " + ps.name] = {"count": len(locations), "mean_location": mean}
+    return summary
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the number of datablocks of each type counted by the profiler (objects, meshes, materials, ...)
+#------------------------------------------------------------------------------------------------------
+
+def datablock_summary():
+    from common import profiler
+    return {name: len(getattr(bpy.data, name)) for name in profiler.datablock_types}
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the peak memory (resident set size) of this process in bytes, or None if it cannot be determined (e.g. on Windows)
+#------------------------------------------------------------------------------------------------------
+
+def peak_memory():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024        # Bytes on macOS, kilobytes on Linux
+
+
+#------------------------------------------------------------------------------------------------------
+# Builds, bakes and writes the outputs of a phase
+# phase: the phase number (1 to 5)
+# settings (optional): a dictionary of settings. Settings that are not set use default_settings.
+# output (optional): a directory for the outputs. The .blend file and a results.json summary are written here.
+# bake_frames (optional): if True, the simulation is baked by stepping through every frame
+# profile (optional): if True, the scene build is profiled and the trace is written to the output (profile.json)
+# RETURNS the results summary
+#------------------------------------------------------------------------------------------------------
+
+def run(phase, settings=None, output="", bake_frames=True, profile=False):
+    start = time.perf_counter()
+    if profile:
+        report = profile_build(phase, settings, os.path.join(output, "profile.json") if output else "")
+    else:
+        build(phase, settings)
+    build_time = time.perf_counter() - start
+
+    from common import config, bake as particle_bake
+    start = time.perf_counter()
+    frames = bake(scene_key(phase, settings) if config.bake_cache else None) if bake_frames else 0
+    bake_time = time.perf_counter() - start
+
+    results = {
+        "phase": phase,
+        "settings": dict(default_settings, **(settings or {})),
+        "build_time": build_time,
+        "bake_time": bake_time,
+        "frames": frames,
+        "objects": len(bpy.data.objects),
+        "materials": len(bpy.data.materials),
+        "datablocks": datablock_summary(),
+        "peak_memory": peak_memory(),
+        "blender": bpy.app.version_string,
+        "particles": particle_summary(),
+        "clusters": particle_bake.cluster_statistics(),
+    }
+    if profile:
+        results["profile"] = report["summary"]
+
+    if output:
+        os.makedirs(output, exist_ok=True)
+        bpy.ops.wm.save_as_mainfile(filepath=os.path.join(os.path.realpath(output), "phase" + str(phase) + ".blend"))
+        with open(os.path.join(output, "results.json"), "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+#------------------------------------------------------------------------------------------------------
+# Command line entry point.  Arguments after "--" are used when running inside Blender (blender -b -P common/runner.py -- ...)
+#------------------------------------------------------------------------------------------------------
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    parser = argparse.ArgumentParser(description="Run a Quantum Microscope phase without the UI")
+    parser.add_argument("--phase", type=int, required=True, choices=[1, 2, 3, 4, 5], help="the phase number to simulate")
+    parser.add_argument("--params", default="", help="JSON file of settings (names from default_settings)")
+    parser.add_argument("--output", default="", help="directory for the .blend file and results.json")
+    parser.add_argument("--no-bake", action="store_true", help="only build the scene")
+    parser.add_argument("--profile", action="store_true", help="profile the scene build and write profile.json (Chrome trace) and profile.txt")
+    args = parser.parse_args(argv)
+
+    settings = {}
+    if args.params:
+        with open(args.params) as f:
+            settings = json.load(f)
+    unknown = set(settings) - set(default_settings)
+    if unknown:
+        parser.error("unknown settings in " + args.params + ": " + ", ".join(sorted(unknown)))
+
+    results = run(args.phase, settings, output=args.output, bake_frames=not args.no_bake, profile=args.profile)
+    print(json.dumps({k: results[k] for k in ("phase", "build_time", "bake_time", "frames", "objects")}))
+
+
+if __name__ == "__main__":
+    main()
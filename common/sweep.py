@@ -0,0 +1,188 @@
+# Sweep
+
+#------------------------------------------------------------------------------------------------------
+# PARAMETER SWEEP
+# Runs a grid of settings for a phase in parallel, one background Blender process per configuration, and collects the
+# results into a single table (CSV).  Each worker runs common/runner.py, so each configuration is the same as pressing Run
+# in the UI with those settings.  The number of workers is limited by the CPU count and the memory available.
+#
+#   python -m common.sweep --phase 2 --grid grid.json --output sweep/
+#
+# The grid file is JSON where each setting has a list of values, e.g. {"neutrinos": [1, 10, 100], "ext_force_strength": [100, 500]}.
+# Settings with a single value may be given without a list.  Every combination of values is run.
+# This module does not import bpy; it runs outside of Blender and starts Blender for each configuration.
+#------------------------------------------------------------------------------------------------------
+
+import sys
+import os
+import argparse
+import csv
+import itertools
+import json
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+project_dir = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+runner_script = os.path.join(project_dir, "common", "runner.py")
+
+# Estimated peak memory of one background Blender worker (bytes).  Large scenes (e.g. supernova, electron clouds) may need more.
+worker_memory = 2 * 1024 ** 3
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns every combination of settings in a grid
+# grid: a dictionary of setting names to a list of values (or a single value)
+# RETURNS a list of settings dictionaries
+#------------------------------------------------------------------------------------------------------
+
+def expand_grid(grid):
+    names = list(grid)
+    values = [v if isinstance(v, list) else [v] for v in grid.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the memory available for new processes in bytes, or None if it cannot be determined
+#------------------------------------------------------------------------------------------------------
+
+def available_memory():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the number of workers to run at once, limited by CPU count, available memory and the number of tasks
+# tasks: the number of configurations to run
+# threads_per_worker (optional): the number of threads each Blender worker uses
+# memory_per_worker (optional): the estimated peak memory of each worker in bytes
+# max_workers (optional): an upper limit set by the user (0 for no limit)
+#------------------------------------------------------------------------------------------------------
+
+def worker_count(tasks, threads_per_worker=1, memory_per_worker=worker_memory, max_workers=0):
+    workers = max(1, (os.cpu_count() or 1) // threads_per_worker)
+    memory = available_memory()
+    if memory is not None:
+        workers = min(workers, max(1, memory // memory_per_worker))
+    if max_workers:
+        workers = min(workers, max_workers)
+    return max(1, min(workers, tasks))
+
+
+#------------------------------------------------------------------------------------------------------
+# Runs one configuration in a background Blender process
+# phase: the phase number (1 to 5)
+# settings: the settings dictionary for this configuration
+# directory: the output directory of this configuration
+# blender (optional): the Blender executable
+# threads (optional): the number of threads for Blender to use
+# bake (optional): if False, the scene is only built
+# RETURNS a row of the results table
+#------------------------------------------------------------------------------------------------------
+
+def run_configuration(phase, settings, directory, blender="blender", threads=1, bake=True):
+    os.makedirs(directory, exist_ok=True)
+    params = os.path.join(directory, "params.json")
+    with open(params, "w") as f:
+        json.dump(settings, f, indent=2)
+
+    command = [blender, "-b", "--factory-startup", "-t", str(threads), "-P", runner_script, "--",
+        "--phase", str(phase), "--params", params, "--output", directory]
+    if not bake:
+        command.append("--no-bake")
+
+    start = time.perf_counter()
+    with open(os.path.join(directory, "log.txt"), "w") as log:
+        process = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, cwd=project_dir)
+    row = dict(settings)
+    row["status"] = "ok" if process.returncode == 0 else "failed (" + str(process.returncode) + ")"
+    row["wall_time"] = time.perf_counter() - start
+
+    # Flatten the runner's results into the row
+    results_file = os.path.join(directory, "results.json")
+    if process.returncode == 0 and os.path.exists(results_file):
+        with open(results_file) as f:
+            results = json.load(f)
+        for key in ("build_time", "bake_time", "frames", "objects", "materials"):
+            row[key] = results[key]
+        for name, particles in results["particles"].items():
+            row[name + " - count"] = particles["count"]
+        for name, statistics in results.get("clusters", {}).items():
+            row[name + " - clusters formed"] = statistics["formed"]
+            row[name + " - clusters split"] = statistics["split"]
+            row[name + " - median lifetime"] = statistics["split_lifetime"]["median"] if statistics["split_lifetime"] else ""
+    return row
+
+
+#------------------------------------------------------------------------------------------------------
+# Runs every configuration of a grid in parallel and writes the results table
+# phase: the phase number (1 to 5)
+# grid: a dictionary of setting names to a list of values
+# output: the directory for the results.  Each configuration has its own directory, and results.csv has one row per configuration.
+# blender (optional): the Blender executable
+# threads_per_worker (optional): the number of threads each Blender worker uses
+# memory_per_worker (optional): the estimated peak memory of each worker in bytes
+# max_workers (optional): an upper limit on the number of workers (0 for no limit)
+# bake (optional): if False, scenes are only built
+# RETURNS the rows of the results table
+#------------------------------------------------------------------------------------------------------
+
+def run_sweep(phase, grid, output, blender="blender", threads_per_worker=1, memory_per_worker=worker_memory, max_workers=0, bake=True):
+    configurations = expand_grid(grid)
+    workers = worker_count(len(configurations), threads_per_worker, memory_per_worker, max_workers)
+    print("Sweep: " + str(len(configurations)) + " configurations on " + str(workers) + " workers")
+
+    # Threads only wait on the Blender processes, which do the work
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_configuration, phase, settings, os.path.join(output, "run" + str(i).zfill(4)), blender, threads_per_worker, bake)
+            for i, settings in enumerate(configurations)]
+        rows = [future.result() for future in futures]
+
+    # A table of all rows; columns are the union of every row's keys in the order first seen
+    columns = []
+    for row in rows:
+        columns += [key for key in row if key not in columns]
+    os.makedirs(output, exist_ok=True)
+    with open(os.path.join(output, "results.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+
+#------------------------------------------------------------------------------------------------------
+# Command line entry point
+#------------------------------------------------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a parameter sweep of a Quantum Microscope phase in parallel")
+    parser.add_argument("--phase", type=int, required=True, choices=[1, 2, 3, 4, 5], help="the phase number to simulate")
+    parser.add_argument("--grid", required=True, help="JSON file of settings, each with a list of values")
+    parser.add_argument("--output", required=True, help="directory for the results")
+    parser.add_argument("--blender", default="blender", help="the Blender executable")
+    parser.add_argument("--threads", type=int, default=1, help="threads per Blender worker")
+    parser.add_argument("--memory", type=float, default=worker_memory / 1024 ** 3, help="estimated peak memory per worker (GB)")
+    parser.add_argument("--workers", type=int, default=0, help="maximum number of workers (default: CPU and memory limits)")
+    parser.add_argument("--no-bake", action="store_true", help="only build the scenes")
+    args = parser.parse_args(argv)
+
+    with open(args.grid) as f:
+        grid = json.load(f)
+    rows = run_sweep(args.phase, grid, args.output, blender=args.blender, threads_per_worker=args.threads,
+        memory_per_worker=int(args.memory * 1024 ** 3), max_workers=args.workers, bake=not args.no_bake)
+    failed = [row for row in rows if row["status"] != "ok"]
+    print("Sweep complete: " + str(len(rows) - len(failed)) + " ok, " + str(len(failed)) + " failed. Results in " + os.path.join(args.output, "results.csv"))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# Trajectory
+
+#------------------------------------------------------------------------------------------------------
+# TRAJECTORY FILES
+# Stores the particles of a simulation on disk, one record per frame, so that the length of a run is not limited by memory.
+# A file starts with a header (the particle count, the first frame and metadata as JSON) followed by one fixed-size record
+# per frame: float32 positions (N, 3), float32 velocities (N, 3) and int32 particle IDs (N,).  Frames are appended while
+# the simulation runs and the file is read with numpy.memmap, so reading a frame only reads that frame's record from disk.
+# A file that is still being written (or was interrupted) can be read up to its last complete frame.
+# This module does not import bpy so that it can be used outside of Blender.
+#------------------------------------------------------------------------------------------------------
+
+import os
+import json
+import numpy as np
+
+
+# Files start with this identifier followed by the format version
+magic = b"QTRJ"
+version = 1
+
+# Size of the header in bytes.  Records start after the header, so frames are aligned for memory mapping.
+header_size = 4096
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the NumPy dtype of one frame record for a number of particles
+#------------------------------------------------------------------------------------------------------
+
+def record_dtype(count):
+    return np.dtype([("positions", "<f4", (count, 3)), ("velocities", "<f4", (count, 3)), ("ids", "<i4", (count,))])
+
+
+#------------------------------------------------------------------------------------------------------
+# Creates a trajectory file and returns a writer to append frames to it
+# path: the file to write
+# count: the number of particles in every frame
+# first_frame (optional): the Blender frame of the first record
+# metadata (optional): a dictionary saved in the header (must be JSON serializable), e.g. the particle range of each emitter
+# RETURNS writer - a dictionary that is passed to write_frame and close_writer
+#------------------------------------------------------------------------------------------------------
+
+def open_writer(path, count, first_frame=0, metadata=None):
+    header = json.dumps({"count": int(count), "first_frame": int(first_frame), "metadata": metadata or {}}).encode()
+    if len(header) > header_size - len(magic) - 4:
+        raise ValueError("trajectory metadata is too large for the header")
+    f = open(path, "wb")
+    f.write(magic + np.uint32(version).tobytes() + header.ljust(header_size - len(magic) - 4))
+    writer = {
+        "file": f,
+        "path": path,
+        "count": int(count),
+        "frames": 0,
+        "record": np.zeros((), dtype=record_dtype(count)),
+    }
+    return writer
+
+
+#------------------------------------------------------------------------------------------------------
+# Appends a frame to a trajectory file
+# writer: the writer returned by open_writer
+# positions: (N, 3) array of particle locations
+# velocities (optional): (N, 3) array of particle velocities.  Zero by default.
+# ids (optional): (N,) array of particle IDs.  By default the index of each particle.
+#------------------------------------------------------------------------------------------------------
+
+def write_frame(writer, positions, velocities=None, ids=None):
+    record = writer["record"]
+    record["positions"] = positions
+    record["velocities"] = 0 if velocities is None else velocities
+    record["ids"] = np.arange(writer["count"]) if ids is None else ids
+    writer["file"].write(record.tobytes())
+    writer["frames"] += 1
+
+
+#------------------------------------------------------------------------------------------------------
+# Finishes writing a trajectory file
+# RETURNS the number of frames written
+#------------------------------------------------------------------------------------------------------
+
+def close_writer(writer):
+    writer["file"].close()
+    return writer["frames"]
+
+
+#------------------------------------------------------------------------------------------------------
+# Opens a trajectory file for reading.  Frames are memory mapped, so no frame is read until it is used.
+# path: the file to read
+# RETURNS reader - a dictionary with the count, first_frame, metadata, frames (the number of complete frames) and records
+#     (a memory mapped array of frame records, or None if there are no frames)
+#------------------------------------------------------------------------------------------------------
+
+def open_reader(path):
+    with open(path, "rb") as f:
+        start = f.read(header_size)
+    if len(start) != header_size or start[:len(magic)] != magic:
+        raise ValueError("not a trajectory file: " + path)
+    if int(np.frombuffer(start[len(magic):len(magic) + 4], dtype=np.uint32)[0]) != version:
+        raise ValueError("unsupported trajectory file version: " + path)
+    header = json.loads(start[len(magic) + 4:].decode().rstrip())
+
+    dtype = record_dtype(header["count"])
+    frames = (os.path.getsize(path) - header_size) // dtype.itemsize if dtype.itemsize else 0
+    reader = {
+        "path": path,
+        "count": header["count"],
+        "first_frame": header["first_frame"],
+        "metadata": header["metadata"],
+        "frames": frames,
+        "records": np.memmap(path, dtype=dtype, mode="r", offset=header_size, shape=(frames,)) if frames else None,
+    }
+    return reader
+
+
+#------------------------------------------------------------------------------------------------------
+# Closes a reader.  Its memory map is released once no frame read from it is still in use, and it reads as an empty file.
+#------------------------------------------------------------------------------------------------------
+
+def close_reader(reader):
+    reader["records"] = None
+    reader["frames"] = 0
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns one field of a frame record, reading only that frame from disk
+# reader: the reader returned by open_reader
+# frame: the index of the frame in the file.  Frames outside the file are clamped to the first or last frame.
+# field (optional): 'positions', 'velocities' or 'ids'
+#------------------------------------------------------------------------------------------------------
+
+def read_frame(reader, frame, field="positions"):
+    if reader["records"] is None:
+        return np.zeros((reader["count"], 3) if field != "ids" else reader["count"], dtype=record_dtype(0)[field].base)
+    return reader["records"][min(max(int(frame), 0), reader["frames"] - 1)][field]
@@ -0,0 +1,228 @@
+# Granules
+
+#------------------------------------------------------------------------------------------------------
+# GRANULE LATTICE SOLVER
+# Steps the displacement of spacetime granules from equilibrium as a finite-difference wave equation on a 1D, 2D or 3D lattice.
+# All granules are stepped together as NumPy arrays, so the solver is independent of Blender and Blender only displays the results.
+# Because granules are now simulated, the wave center reflections, granule energy and inverse square falloff listed in the
+# Phase 1 TODOs are computed from granule motion instead of being set by Blender's wave modifier.
+# This module does not import bpy so that it can be used outside of Blender (e.g. batch runs and calculations).
+#------------------------------------------------------------------------------------------------------
+
+import math
+import numpy as np
+
+
+# Largest stable Courant number (wave speed * time step / granule spacing) for the leapfrog scheme is 1/sqrt(dimensions)
+courant_safety = 0.9
+
+
+#------------------------------------------------------------------------------------------------------
+# Creates a lattice of granules matching the spacetime array of Phase 1
+# spacetime_length: the length of the spacetime array in one dimension (same as the UI Grid Length)
+# dimensions: the number of dimensions of the lattice (1, 2 or 3)
+# wave_speed: the speed of the wave through spacetime, measured in distance per Blender frame
+# wave_amplitude: the displacement distance of granules at a wave source
+# granule_wavelength (optional): the wavelength of waves generated by sources (Phase 1 uses 2)
+# granules_per_wavelength (optional): the lattice resolution.  A larger number is more accurate but slower.
+# damping (optional): a fraction of granule velocity removed each step (0 for no damping)
+# RETURNS lattice - a dictionary of arrays and properties that is passed to the other functions in this module
+#------------------------------------------------------------------------------------------------------
+
+def create_lattice(spacetime_length, dimensions, wave_speed, wave_amplitude, granule_wavelength=2, granules_per_wavelength=4, damping=0.0):
+    granule_array_count = round(spacetime_length / 2)
+    array_size = granule_wavelength * granule_array_count                 # Same half length of the spacetime array as used in Phase 1
+    spacing = granule_wavelength / granules_per_wavelength
+    count = int(round(2 * array_size / spacing)) + 1                      # Granules in one row, including the granules at both walls
+    shape = (count,) * dimensions
+
+    # Substeps keep the solver stable when the wave speed is large relative to granule spacing
+    courant_max = courant_safety / math.sqrt(dimensions)
+    substeps = max(1, math.ceil(wave_speed / (spacing * courant_max))) if wave_speed > 0 else 1
+    courant = wave_speed / spacing / substeps
+
+    lattice = {
+        "dimensions": dimensions,
+        "shape": shape,
+        "spacing": spacing,
+        "array_size": array_size,
+        "wave_speed": wave_speed,
+        "wave_amplitude": wave_amplitude,
+        "granule_wavelength": granule_wavelength,
+        "damping": damping,
+        "substeps": substeps,
+        "courant_squared": courant ** 2,
+        "displacement": np.zeros(shape, dtype=np.float32),
+        "previous": np.zeros(shape, dtype=np.float32),
+        "laplacian": np.zeros(shape, dtype=np.float32),
+        "sources": [],
+        "reflectors": np.zeros(shape, dtype=bool),
+        "frame": 0,
+        "time": 0.0,
+    }
+    return lattice
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the lattice index nearest to a location in Blender coordinates (only the lattice dimensions are used)
+# lattice: the lattice created by create_lattice
+# location: the location in (x,y,z) coordinates
+#------------------------------------------------------------------------------------------------------
+
+def location_to_index(lattice, location):
+    index = []
+    for axis in range(lattice["dimensions"]):
+        i = int(round((location[axis] + lattice["array_size"]) / lattice["spacing"]))
+        index.append(min(max(i, 1), lattice["shape"][axis] - 2))          # Keep sources and reflectors off the fixed walls
+    return tuple(index)
+
+
+#------------------------------------------------------------------------------------------------------
+# Adds a wave source that displaces granules from equilibrium, like the external force at the corners of spacetime
+# lattice: the lattice created by create_lattice
+# location: the location of the source in (x,y,z) coordinates
+# phase (optional): the starting phase of the source in radians. Antineutrinos are on opposite nodes (pi).
+#------------------------------------------------------------------------------------------------------
+
+def add_source(lattice, location, phase=0.0):
+    lattice["sources"].append((location_to_index(lattice, location), phase))
+
+
+#------------------------------------------------------------------------------------------------------
+# Adds a wave center that reflects waves.  Granules inside the radius are held at equilibrium, which reflects incoming waves to create standing waves.
+# lattice: the lattice created by create_lattice
+# location: the center of the wave center in (x,y,z) coordinates
+# radius (optional): the radius of the reflecting wave center. By default one granule.
+#------------------------------------------------------------------------------------------------------
+
+def add_reflector(lattice, location, radius=0.0):
+    center = location_to_index(lattice, location)
+    reach = int(math.ceil(radius / lattice["spacing"]))
+    region = tuple(slice(max(c - reach, 0), min(c + reach + 1, n)) for c, n in zip(center, lattice["shape"]))
+    grids = np.ogrid[region]
+    distance_squared = sum(((g - c) * lattice["spacing"]) ** 2 for g, c in zip(grids, center))
+    lattice["reflectors"][region] |= distance_squared <= radius ** 2
+
+
+#------------------------------------------------------------------------------------------------------
+# Calculates the discrete Laplacian of the displacement in place.  Granules on the walls of spacetime are fixed, reflecting waves back inside.
+#------------------------------------------------------------------------------------------------------
+
+def _laplacian(u, out):
+    inner = (slice(1, -1),) * u.ndim
+    out[inner] = u[inner] * (-2 * u.ndim)
+    for axis in range(u.ndim):
+        forward = list(inner)
+        backward = list(inner)
+        forward[axis] = slice(2, None)
+        backward[axis] = slice(0, -2)
+        out[inner] += u[tuple(forward)]
+        out[inner] += u[tuple(backward)]
+
+
+#------------------------------------------------------------------------------------------------------
+# Steps the lattice forward by one Blender frame
+# lattice: the lattice created by create_lattice
+#------------------------------------------------------------------------------------------------------
+
+def step(lattice):
+    substeps = lattice["substeps"]
+    dt = 1 / substeps
+    omega = 2 * math.pi * lattice["wave_speed"] / lattice["granule_wavelength"]   # Angular frequency in radians per frame
+    keep = 1 - lattice["damping"] / substeps
+
+    for _ in range(substeps):
+        u = lattice["displacement"]
+        u_previous = lattice["previous"]
+        lap = lattice["laplacian"]
+
+        # Leapfrog step: u_next = u + keep * (u - u_previous) + courant^2 * laplacian(u).  Written into u_previous to avoid new arrays.
+        _laplacian(u, lap)
+        lap *= lattice["courant_squared"]
+        np.subtract(u, u_previous, out=u_previous)
+        u_previous *= keep
+        u_previous += u
+        u_previous += lap
+        lattice["displacement"], lattice["previous"] = u_previous, u
+        lattice["time"] += dt
+
+        # Sources are driven granules; reflectors (wave centers) are held at equilibrium
+        u_next = lattice["displacement"]
+        for index, phase in lattice["sources"]:
+            u_next[index] = lattice["wave_amplitude"] * math.sin(omega * lattice["time"] + phase)
+        u_next[lattice["reflectors"]] = 0
+
+    lattice["frame"] += 1
+
+
+#------------------------------------------------------------------------------------------------------
+# Steps the lattice to a Blender frame.  Stepping backwards restarts the lattice from equilibrium at frame 0.
+# lattice: the lattice created by create_lattice
+# frame: the frame number to step to
+#------------------------------------------------------------------------------------------------------
+
+def step_to_frame(lattice, frame):
+    if frame < lattice["frame"]:
+        lattice["displacement"].fill(0)
+        lattice["previous"].fill(0)
+        lattice["frame"] = 0
+        lattice["time"] = 0.0
+    while lattice["frame"] < frame:
+        step(lattice)
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the equilibrium position of every granule as an (N, 3) array in Blender coordinates
+# lattice: the lattice created by create_lattice
+#------------------------------------------------------------------------------------------------------
+
+def rest_positions(lattice):
+    axes = [np.linspace(-lattice["array_size"], lattice["array_size"], n, dtype=np.float32) for n in lattice["shape"]]
+    grids = np.meshgrid(*axes, indexing="ij")
+    positions = np.zeros((grids[0].size, 3), dtype=np.float32)
+    for axis, grid in enumerate(grids):
+        positions[:, axis] = grid.ravel()
+    return positions
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the displaced position of every granule as an (N, 3) array, in the same order as rest_positions
+# lattice: the lattice created by create_lattice
+# rest: the array returned by rest_positions (passed in so that it is not recalculated every frame)
+# longitudinal (optional): granules are displaced in the direction of wave propagation
+# transverse (optional): granules are displaced perpendicular to wave propagation (in the z direction)
+#------------------------------------------------------------------------------------------------------
+
+def granule_positions(lattice, rest, longitudinal=True, transverse=False):
+    u = lattice["displacement"]
+    positions = rest.copy()
+
+    # Longitudinal displacement is along the gradient of the wave, scaled so that its size matches the wave amplitude
+    if longitudinal:
+        scale = lattice["granule_wavelength"] / (2 * math.pi)
+        gradients = np.gradient(u, lattice["spacing"]) if u.ndim > 1 else [np.gradient(u, lattice["spacing"])]
+        for axis, gradient in enumerate(gradients):
+            positions[:, axis] -= gradient.ravel() * scale
+
+    # Transverse displacement is in the z direction, perpendicular to waves travelling in the x and y directions
+    if transverse:
+        positions[:, 2] += u.ravel()
+    return positions
+
+
+#------------------------------------------------------------------------------------------------------
+# Calculates the total energy of granules as the sum of their kinetic energy and their potential energy of displacement from equilibrium
+# lattice: the lattice created by create_lattice
+# granule_mass (optional): the mass of each granule
+# RETURNS the energy of all granules in simulation units
+#------------------------------------------------------------------------------------------------------
+
+def granule_energy(lattice, granule_mass=1.0):
+    u = lattice["displacement"]
+    velocity = (u - lattice["previous"]) * lattice["substeps"]
+    kinetic = 0.5 * granule_mass * float(np.sum(velocity.astype(np.float64) ** 2))
+    potential = 0.0
+    for axis in range(u.ndim):
+        strain = np.diff(u, axis=axis) / lattice["spacing"]
+        potential += 0.5 * granule_mass * lattice["wave_speed"] ** 2 * float(np.sum(strain.astype(np.float64) ** 2))
+    return kinetic + potential
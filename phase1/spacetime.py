@@ -27,6 +27,7 @@ import sys
 import os
 import random
 import importlib
+import math
 
 
 # Import Config Variables & Common Functions
@@ -35,6 +36,12 @@ from common import config
 importlib.reload(config)
 from common import functions
 importlib.reload(functions)
+from common import meshes
+importlib.reload(meshes)
+from common import calculations
+importlib.reload(calculations)
+from phase1 import granules
+importlib.reload(granules)
 
 
 #------------------------------------------------------------------------------------------------------
@@ -67,6 +74,7 @@ def main(wave_centers, anti_wave_centers):
     # Array properties
     array_size = granule_wavelength * granule_array_count     # A grid is created of granule "wavelengths", using half the total length as the array_size because it is duplicated for opposite direction in x, y and z.
     position = (array_size - granule_wavelength/2)            # Position of outer array used for calculation of forces and array creation
+    wave_sample_spacing = granule_wavelength / 8              # Vertex spacing of the spacetime container.  Blender's wave modifier needs about 8 vertices per wavelength for a smooth wave.
 
     # Properties that change based on dimension.
     if config.dimensions == 3:
@@ -115,14 +123,11 @@ def main(wave_centers, anti_wave_centers):
     # Calculations used in this phase use EWT equations for neutrinos - see https://energywavetheory.com/subatomic-particles/neutrino/
     #------------------------------------------------------------------------------------------------------
 
-    # Neutrino standing wavelength is the fundamental wavelength.
-    calc_radius = config.fundamental_wavelength
-
-    # Neutrino energy should be calculated by collective energy of standing wave granules.  It is calculated based on EWT equations for now.  TODO: use granule physics to calculate total energy.
-    calc_energy_joules = ( (4/3) * config.pi * config.fundamental_density * (config.fundamental_amplitude ** 6) * config.fundamental_wavespeed ** 2 ) / (config.fundamental_wavelength_no_gfactor ** 3)
-
-    # Neutrino energy is first calculated in joules.  To convert to electron-volts (eV), the following conversion is used: 6.242e+18 J to eV.
-    calc_energy = calc_energy_joules * 6.242e+18
+    # Neutrino standing wavelength is the fundamental wavelength.  The energy is first calculated in joules and converted to electron-volts (eV).
+    # Neutrino energy should be calculated by collective energy of standing wave granules.  It is calculated based on EWT equations for now (see common/calculations.py).  TODO: use granule physics to calculate total energy.
+    neutrino_calc = calculations.query("neutrino")
+    calc_radius = neutrino_calc["radius"]
+    calc_energy = neutrino_calc["energy"]
 
     # Determine the time it takes for the wave to reach the center, measured in number of keyframes in Blender.  TODO: This would be automatically displaced when a wave center can reflect granules to create standing waves.
     if config.wave_speed > 0:
@@ -265,14 +270,12 @@ def main(wave_centers, anti_wave_centers):
     # The spacetime container is also used to show wave motion, as an aggregate of granule motion when "Wave" view is selected.
     #------------------------------------------------------------------------------------------------------
 
-    bpy.ops.mesh.primitive_cube_add(size=granule_wavelength, enter_editmode=True, location=(0, 0, 0))
-    bpy.context.active_object.name = "Spacetime"
-    s = bpy.data.objects["Spacetime"]
-    bpy.ops.transform.resize(value=transform_value)
-    bpy.ops.mesh.subdivide(number_cuts = (array_size * 2) ** 2)    # The number of cuts is used for wave modifiers.  Since spacetime cube is set by user, this is proportional
-    bpy.ops.object.mode_set(mode="OBJECT")
-    bpy.ops.object.shade_smooth()
-    bpy.ops.object.modifier_add(type='COLLISION')                  # Spacetime is set as a collision object in Blender to keep particles within the "universe"
+    # The container mesh is built directly from vertex buffers.  The cuts are used for wave modifiers and grow linearly with the grid length set by the user.
+    container_size = [granule_wavelength * t for t in transform_value]
+    container_cuts = [max(math.ceil(length / wave_sample_spacing) - 1, 0) for length in container_size]
+    vertices, faces = meshes.box_grid(size=container_size, cuts=container_cuts)
+    s = meshes.new_mesh_object(name="Spacetime", vertices=vertices, faces=faces)
+    s.modifiers.new("Collision", type='COLLISION')                 # Spacetime is set as a collision object in Blender to keep particles within the "universe"
     bpy.ops.rigidbody.object_add()
     s.rigid_body.type = 'PASSIVE'
 
@@ -291,6 +294,16 @@ def main(wave_centers, anti_wave_centers):
     #------------------------------------------------------------------------------------------------------
 
     # Granule array is used to illustrate waves in scenarios with zero or one neutrinos.  Otherwise, spacetime volume is filled with granules because of complexity of multiple particles.
+    # In granule view, the granules may instead be simulated by the lattice solver so that waves reflect, fall off by inverse square and have a calculated energy.
+    use_granule_solver = config.granule_solver and config.show_granules and total_neutrinos < 2
+    if use_granule_solver:
+        lattice = granules.create_lattice(spacetime_length=config.spacetime_length,
+            dimensions=config.dimensions,
+            wave_speed=config.wave_speed,
+            wave_amplitude=config.wave_amplitude,
+            granule_wavelength=granule_wavelength,
+            granules_per_wavelength=config.granules_per_wavelength)
+
     if total_neutrinos < 2:
 
         # Determine the corner positions to create an array of granules where waves are directed toward the center.
@@ -300,49 +313,47 @@ def main(wave_centers, anti_wave_centers):
             y = multiplier[1] * position
             z = multiplier[2] * position
 
-            # Set the first granule cube, which is one wavelength.
-            name = "Granule Array " + str(multiplier)
-            bpy.ops.mesh.primitive_cube_add(size=granule_wavelength, enter_editmode=True, location=(x, y, z))
-            bpy.context.active_object.name = name
-            o = bpy.data.objects[name]
-            functions.link_collection(collection=granules_collection)
-            bpy.ops.mesh.subdivide(number_cuts = number_cuts)
-            bpy.ops.object.mode_set(mode="OBJECT")
-            bpy.ops.object.shade_smooth()
-
-            # Create an array of granule wavelengths in the x or -x direction
-            bpy.ops.object.modifier_add(type='ARRAY')
-            o.modifiers["Array"].name = name + "x"
-            o.modifiers[name + "x"].count = granule_array_count
-            o.modifiers[name + "x"].relative_offset_displace[0] = -multiplier[0]
-
-            # Expand the array in the y direction if 2D or 3D set
-            if config.dimensions == 2 or config.dimensions == 3:
-                bpy.ops.object.modifier_add(type='ARRAY')
-                o.modifiers["Array"].name = name + "y"
-                o.modifiers[name + "y"].count = granule_array_count
-                o.modifiers[name + "y"].relative_offset_displace[1] = -multiplier[1]
-                o.modifiers[name + "y"].relative_offset_displace[0] = 0
-
-            # Expand the array in the z direction if 3D set
-            if config.dimensions == 3:
-                bpy.ops.object.modifier_add(type='ARRAY')
-                o.modifiers["Array"].name = name + "z"
-                o.modifiers[name + "z"].count = granule_array_count
-                o.modifiers[name + "z"].relative_offset_displace[2] = -multiplier[2]
-                o.modifiers[name + "z"].relative_offset_displace[0] = 0
-
-            # Create a wave using Blender's wave modifier.
-            m = o.modifiers.new(str(multiplier), type='WAVE')
-            wave_mods(mod=m)
-
-            # Create the granule particle system.
-            pset = add_granules(name = name)
+            # If the granule solver is used, the corners are wave sources in the lattice instead of wave modifiers
+            if use_granule_solver:
+                granules.add_source(lattice, (x, y, z))
 
-            if config.show_granules == True:
-                pset.count = granule_count
             else:
-                pset.count = 0    # If show_granules is not selected, then wave motion is shown and no granules are used in the particle emitter
+                # Set the first granule cube, which is one wavelength.
+                name = "Granule Array " + str(multiplier)
+                vertices, faces = meshes.box_grid(size=(granule_wavelength,) * 3, cuts=(number_cuts,) * 3)
+                o = meshes.new_mesh_object(name=name, vertices=vertices, faces=faces, location=(x, y, z))
+                functions.link_collection(collection=granules_collection)
+
+                # Create an array of granule wavelengths in the x or -x direction
+                m = o.modifiers.new(name + "x", type='ARRAY')
+                m.count = granule_array_count
+                m.relative_offset_displace[0] = -multiplier[0]
+
+                # Expand the array in the y direction if 2D or 3D set
+                if config.dimensions == 2 or config.dimensions == 3:
+                    m = o.modifiers.new(name + "y", type='ARRAY')
+                    m.count = granule_array_count
+                    m.relative_offset_displace[1] = -multiplier[1]
+                    m.relative_offset_displace[0] = 0
+
+                # Expand the array in the z direction if 3D set
+                if config.dimensions == 3:
+                    m = o.modifiers.new(name + "z", type='ARRAY')
+                    m.count = granule_array_count
+                    m.relative_offset_displace[2] = -multiplier[2]
+                    m.relative_offset_displace[0] = 0
+
+                # Create a wave using Blender's wave modifier.
+                m = o.modifiers.new(str(multiplier), type='WAVE')
+                wave_mods(mod=m)
+
+                # Create the granule particle system.
+                pset = add_granules(name = name)
+
+                if config.show_granules == True:
+                    pset.count = granule_count
+                else:
+                    pset.count = 0    # If show_granules is not selected, then wave motion is shown and no granules are used in the particle emitter
 
             # Granules use the wave modifier and physics cannot be used.  Substituting all granules for a collective force at the origination point. TODO: Real physics should be used for granules and this should be removed.
             name = "Granule Force " + str(multiplier)
@@ -385,7 +396,7 @@ def main(wave_centers, anti_wave_centers):
             functions.link_collection(collection=neutrinos_collection)
             bpy.context.active_object.name = "Neutrino"
             o = bpy.data.objects["Neutrino"]
-            bpy.ops.transform.resize(value=transform_value)
+            o.scale = transform_value
             o.show_instancer_for_viewport = False
 
             # Add a neutrino using a particle emitter
@@ -434,17 +445,17 @@ def main(wave_centers, anti_wave_centers):
                 pset.display_color = 'VELOCITY'
                 functions.hide_at_keyframe(name = name, init_hide=True, start_frame=1, end_frame=frame_to_center)
 
+                # With the granule solver, the wave center reflects granules to create the standing wave instead of it being simulated
+                if use_granule_solver:
+                    granules.add_reflector(lattice, (0, 0, 0), radius=granule_size * 2)
+
             # Show a single neutrino - wave view
             else:
                 # Show a standing wave pattern at the center in wave format instead of granule format to match the rest of the simulation.
-                bpy.ops.mesh.primitive_plane_add(size=granule_wavelength * 2, enter_editmode=True, location=(0, 0, -config.wave_amplitude /2 ))
-                functions.link_collection(collection=neutrinos_collection)
                 name = "Neutrino - Standing Wave"
-                bpy.context.active_object.name = name
-                o = bpy.data.objects[name]
-                bpy.ops.mesh.subdivide(number_cuts = 50)
-                bpy.ops.object.mode_set(mode="OBJECT")
-                bpy.ops.object.shade_smooth()
+                vertices, faces = meshes.grid_plane(size=granule_wavelength * 2, cuts=50)
+                o = meshes.new_mesh_object(name=name, vertices=vertices, faces=faces, location=(0, 0, -config.wave_amplitude /2 ))
+                functions.link_collection(collection=neutrinos_collection)
                 add_waves(mod_name = name)
                 functions.hide_at_keyframe(name = name, init_hide=True, start_frame=1, end_frame=frame_to_center)
 
@@ -484,6 +495,49 @@ def main(wave_centers, anti_wave_centers):
             pset = add_granules(name = "Spacetime")
             pset.count = granule_count * (2 ** config.dimensions)
 
+
+
+    #------------------------------------------------------------------------------------------------------
+    # GRANULE LATTICE
+    # If the granule solver is used, granules are displayed at the vertices of a mesh that is updated from the solver each frame.
+    # Blender only displays the granules; their motion, reflections and energy are calculated in phase1/granules.py
+    #------------------------------------------------------------------------------------------------------
+
+    if use_granule_solver:
+
+        # A mesh of vertices only, one vertex per granule at its equilibrium position
+        rest = granules.rest_positions(lattice)
+        mesh = bpy.data.meshes.new("Granule Lattice")
+        mesh.vertices.add(len(rest))
+        mesh.vertices.foreach_set("co", rest.ravel())
+        lattice_object = bpy.data.objects.new("Granule Lattice", mesh)
+        granules_collection.objects.link(lattice_object)
+
+        # A low detail sphere is instanced at each vertex to display the granules
+        bpy.ops.mesh.primitive_uv_sphere_add(segments=8, ring_count=4, radius=granule_size, enter_editmode=False, location=(0, 0, 0))
+        bpy.context.active_object.name = "Granule"
+        functions.link_collection(collection=granules_collection)
+        bpy.data.objects["Granule"].parent = lattice_object
+        lattice_object.instance_type = 'VERTS'
+
+        # Step the solver to the frame being viewed and move the granules.  The granule energy is updated if calculations are shown.
+        def update_granules(scene, depsgraph=None):
+            o = bpy.data.objects.get("Granule Lattice")
+            if o is None:
+                return
+            granules.step_to_frame(lattice, scene.frame_current)
+            positions = granules.granule_positions(lattice, rest, longitudinal=config.longitudinal_wave, transverse=config.transverse_wave)
+            o.data.vertices.foreach_set("co", positions.ravel())
+            o.data.update()
+            t = bpy.data.objects.get("Granule Energy")
+            if t is not None:
+                t.data.body = "Granule Energy: " + f"{granules.granule_energy(lattice):.3e}"
+
+        # Replace the handler from a previous run of the simulation
+        for h in [h for h in bpy.app.handlers.frame_change_pre if h.__name__ == "update_granules"]:
+            bpy.app.handlers.frame_change_pre.remove(h)
+        bpy.app.handlers.frame_change_pre.append(update_granules)
+
     # This modifier helps to make the waves looks better (smoother) in the simulation
     m = s.modifiers.new("Smoother", type='CORRECTIVE_SMOOTH')
 
@@ -501,3 +555,7 @@ def main(wave_centers, anti_wave_centers):
 
         # Display only after neutrino has formed
         functions.hide_at_keyframe(name = "Calculations", init_hide=True, start_frame=1, end_frame=frame_to_center)
+
+        # The granule solver calculates the energy of all granules, updated each frame (see GRANULE LATTICE)
+        if use_granule_solver:
+            functions.add_text(name="Granule Energy", text="Granule Energy: 0", location=(array_size + 2, -6, 0), radius=2)
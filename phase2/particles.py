@@ -7,7 +7,8 @@
 # The particle's wavelength and number of standing waves determines its size (radius) and is also based on constructive wave interference
 # TODO: A standing wave grid is added for Blender as a workaround to create standing wave nodes since wave centers are not reflecting waves. Standing waves should occur naturally.
 # TODO: A particle force is added for Blender as a workaround for the rule that only one wave center may reside in a specific location/node.
-# TODO: Based on changes above for true standing waves, certain geometries of particles should be stable and others unstable. The time to decay should be tracked for unstable particles.
+# TODO: Based on changes above for true standing waves, certain geometries of particles should be stable and others unstable.
+# The time to decay of unstable particles is tracked when track_clusters is set: bound clusters of wave centers and their lifetimes are logged while baking (common/clusters.py).
 # TODO: Particle spin needs to use real physics.  It is currently animated using Blender keyframe animation.
 # For more details, visit www.energywavetheory.com
 
@@ -29,6 +30,10 @@ from common import config
 importlib.reload(config)
 from common import functions
 importlib.reload(functions)
+from common import bake
+importlib.reload(bake)
+from common import calculations
+importlib.reload(calculations)
 
 
 #------------------------------------------------------------------------------------------------------
@@ -73,6 +78,10 @@ def main(neutrinos):
     config.emitter_radius = config.ext_force_radius / 2
     config.particle_force = config.particle_charge * 5  # TODO: Standing waves should form naturally and not need this force
 
+    # CLUSTERS - wave centers at neighboring standing wave nodes (including diagonal nodes) are bound in the same particle
+    if config.track_clusters:
+        config.cluster_distance = config.grid_spacing * 1.75
+
 
     ############################################ PROGRAM #####################################################
 
@@ -105,47 +114,13 @@ def main(neutrinos):
     # TODO: In the future, the standing wave nodes should form naturally from reflections off wave centers.
     #------------------------------------------------------------------------------------------------------
 
-    x = 0   # Standing wave node grid starting point - positive forces
-    y = 0
-    z = 0
-    nodeNum = 0
-    while x < config.grid_size:
-        while y < config.grid_size:
-            while z < config.grid_size:
-                bpy.ops.object.effector_add(type='CHARGE', enter_editmode=False, location=(x*config.grid_spacing, y*config.grid_spacing, z*config.grid_spacing))
-                if ((x+y+z) % 2) == 0:
-                    bpy.context.active_object.name = "Node - Positive (" + str(nodeNum) + ")"
-                    o = bpy.data.objects["Node - Positive (" + str(nodeNum) + ")"]
-                    o.field.strength = config.grid_strength
-                else:
-                    bpy.context.active_object.name = "Node - Negative (" + str(nodeNum) + ")"
-                    o = bpy.data.objects["Node - Negative (" + str(nodeNum) + ")"]
-                    o.field.strength = -config.grid_strength
-                o.field.flow = config.flow
-                o.field.falloff_power = 2
-                functions.link_collection(collection=nodes_collection)
-                nodeNum += 1
-                z += 1
-            z = 0
-            y += 1
-        y = 0
-        x += 1
-
-    # Move the standing wave node grid to the origin
-    offset = -((config.grid_size-1) / 2 * config.grid_spacing)
-    bpy.ops.object.select_pattern(pattern="Node*")
-    bpy.ops.transform.translate(value=(offset, offset, offset))
-
-    # Add a plain axis to the center of the node grid and join the objects together
-    bpy.ops.object.empty_add(type='PLAIN_AXES', location=(0, 0, 0))
-    bpy.context.active_object.name = "Node - Axis"
-    p = bpy.context.active_object
-    functions.link_collection(collection=nodes_collection)
-    bpy.ops.object.select_all(action='DESELECT')
-    bpy.ops.object.select_pattern(pattern="Node*")
-    p.select_set(True)
-    bpy.context.view_layer.objects.active = p
-    bpy.ops.object.parent_set(type='OBJECT')
+    # The node grid is built in a single pass and centered on a plain axis at the origin, which is the parent of all nodes
+    p = functions.add_node_grid(name="Node - Axis",
+        collection=nodes_collection,
+        size=config.grid_size,
+        spacing=config.grid_spacing,
+        strength=config.grid_strength,
+        flow=config.flow)
 
 
     #------------------------------------------------------------------------------------------------------
@@ -277,6 +252,19 @@ def main(neutrinos):
             o.keyframe_insert(data_path='hide_viewport', frame=config.ext_force_endframe)
 
 
+    #------------------------------------------------------------------------------------------------------
+    # PARTICLE ENGINE
+    # If set, wave centers are moved by the NumPy particle engine instead of Blender's particle solver, using the same forces:
+    # the emitter's charge and particle force, the standing wave node charges, the standing wave harmonics and the external force.
+    # The simulation is calculated once here for all frames; the same seed always gives the same result.
+    #------------------------------------------------------------------------------------------------------
+
+    if config.particle_engine:
+        bake.bake_emitters(["Emitter"], frames=config.num_frames, seed=config.engine_seed or None, substeps=config.engine_substeps,
+            backend=config.engine_backend, theta=config.octree_theta, workers=config.engine_workers,
+            use_cache=config.bake_cache, cache_budget=config.bake_cache_size, cluster_distance=config.cluster_distance)
+
+
     #------------------------------------------------------------------------------------------------------
     # SHOW CALCULATIONS
     # If set to True, the calculations of particle energy and radius are shown
@@ -285,23 +273,18 @@ def main(neutrinos):
     if config.show_calculations:
 
         # The simulation is a fundamental wavelength of 2 meters.  To scale, divide by 2.  Then scale by fundamental wavelength.  Proportional to number of wavelengths and wavelength.
-        calc_radius = "Radius: " + f"{(config.fundamental_wavelength * config.num_waves * particle_core_wavelength / 2):.3e}" + " (m)"
-
         # The simulation doesn't automatically calc energy.  A fundamental energy value is used and the EWT equation from https://energywavetheory.com/subatomic-particles/equation/
-        shell_multiplier = 0
-        n = 1
-        while n <= config.neutrinos:
-            shell_multiplier = shell_multiplier + (n**3 - ((n-1)**3)) / n**4
-            n +=1
-        calc_energy = "Energy: " + str(round(config.fundamental_energy * (config.neutrinos ** 5) * shell_multiplier)) + " (eV)"
-
-        # Calculation is the same, but formatting for eV vs MeV
+        # Both are looked up in the particle table for K (see common/calculations.py).
+        particle_calc = calculations.query("particle", config.neutrinos)
+        calc_radius = "Radius: " + f"{particle_calc['radius']:.3e}" + " (m)"
+
+        # Formatting for eV vs MeV vs GeV
         if config.neutrinos < 6:
-            calc_energy = "Energy: " + str(round(config.fundamental_energy * (config.neutrinos ** 5) * shell_multiplier, 3)) + " (eV)"
+            calc_energy = "Energy: " + str(round(particle_calc["energy"], 3)) + " (eV)"
         elif config.neutrinos < 40:
-            calc_energy = "Energy: " + str(round(config.fundamental_energy * (config.neutrinos ** 5) * shell_multiplier / 1000000, 3)) + " (MeV)"
+            calc_energy = "Energy: " + str(round(particle_calc["energy"] / 1000000, 3)) + " (MeV)"
         else:
-            calc_energy = "Energy: " + str(round(config.fundamental_energy * (config.neutrinos ** 5) * shell_multiplier / 1000000000, 3)) + " (GeV)"
+            calc_energy = "Energy: " + str(round(particle_calc["energy"] / 1000000000, 3)) + " (GeV)"
         functions.add_text(name="Calculations", text=calc_energy + "\n" + calc_radius, location=(config.num_waves * particle_core_wavelength + 10, 20, 0), radius=10)
 
         # Display the K value for the particle.  K is a variable count of neutrinos at the core of a particle, analogous to Z as the variable count of protons at the core of an atom.
@@ -0,0 +1,289 @@
+# Equilibrium
+
+#------------------------------------------------------------------------------------------------------
+# COMPOSITE PARTICLE EQUILIBRIUM SOLVER
+# Finds the stable arrangement of the electrons and positrons of a composite particle (meson, baryon, tetraquark, proton or
+# neutron) directly, instead of simulating frames of particles that are pushed together by the external force until they settle.
+# The forces are the ones Phase 3 switches to when particles are within standing wave range (see phase3/nucleons.py):
+#   electrons:      the strong force (Lennard-Jones) between electrons, and a constant force pulling the other particles in
+#   positrons:      charge, attracting the free electron of a neutron and repelling other positrons (held by weak forces)
+#   free electrons: charge (neutron only)
+# Particles also have cores that do not overlap: positrons and free electrons closer than two core radii to another particle are
+# pushed away, as the collisions of Blender particles keep the positron from reaching an electron.  A solution with overlapping
+# cores has collapsed and is not stable.
+# The force laws are the same as the particle engine (common/engine.py).  Particles are moved to their stable positions with the
+# FIRE method (fast inertial relaxation): particles follow the forces with inertia that is steered towards the force, the step
+# grows while the motion goes downhill and the particles stop when it goes uphill.  Many composite particles are relaxed together
+# as NumPy arrays, so a sweep of particle combinations takes milliseconds for each combination.
+# This module does not import bpy so that it can be used outside of Blender (e.g. sweeps of composite particles).
+#------------------------------------------------------------------------------------------------------
+
+import sys
+import os
+import argparse
+import importlib
+import numpy as np
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+from common import config
+importlib.reload(config)
+from common import engine
+importlib.reload(engine)
+
+
+# Particles of a composite particle, in the order of the counts passed to the solver
+particle_kinds = ["electron", "positron", "free electron"]
+
+# Counts of electrons, positrons and free electrons of the composite particles named in Phase 3
+composite_particles = {
+    "Meson": (1, 1, 0),
+    "Baryon": (3, 0, 0),
+    "Tetraquark": (4, 0, 0),
+    "Tetraquark (2 positrons)": (2, 2, 0),
+    "Proton (pentaquark)": (4, 1, 0),
+    "Neutron": (4, 1, 1),
+}
+
+# FIRE settings: the step grows by step_increase after min_downhill downhill steps, up to max_step_factor times the timestep,
+# and is cut by step_decrease when the motion goes uphill.  The inertia is steered towards the force by alpha.
+min_downhill = 5
+step_increase = 1.1
+step_decrease = 0.5
+max_step_factor = 10
+alpha_start = 0.1
+alpha_decrease = 0.99
+
+# The core repulsion balances the strongest pull on a particle when its core is pressed in by 1 / core_repulsion of a core radius
+core_repulsion = 10
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the sizes, charges, force fields and effector weights of the particles of a composite particle, after the forces
+# switch to the strong force in Phase 3
+# strong_force (optional): the Lennard-Jones strength of the strong force between electrons
+# charge (optional): the charge of the positron (the free electron has the opposite charge)
+# particle_force (optional): the constant force of electrons pulling the positron to the center
+# core_radius (optional): the electron core radius.  The strong force acts within ten core diameters, and the cores of two
+#     particles touch at two core radii.
+#------------------------------------------------------------------------------------------------------
+
+def particle_table(strong_force=config.particle_strong_force, charge=config.electron_charge, particle_force=config.particle_force, core_radius=config.electron_core_radius):
+    core = core_radius * 4
+    return {
+        "sizes": np.array([core * 2, core, core]),                                   # Lennard-Jones needs twice the core size for separation
+        "charges": np.array([0.0, charge, -charge]),                                 # Electrons have switched their charge to the strong force
+        "fields": [
+            [engine.field("LENNARDJ", strong_force, max_distance=core_radius * 40), engine.field("FORCE", -particle_force)],
+            [engine.field("CHARGE", charge, falloff_power=2)],
+            [engine.field("CHARGE", -charge, falloff_power=2)],
+        ],
+        "weights": {"LENNARDJ": np.array([1.0, 0.0, 0.0])},                          # The strong force only applies to electrons at vertices
+        "softening": core_radius,                                                    # Forces do not grow within a particle's core
+        "contact": core_radius * 2,                                                  # Cores touch at this distance
+        "core_stiffness": max(particle_force, abs(charge) / core_radius ** 2) * core_repulsion / core_radius,
+    }
+
+
+#------------------------------------------------------------------------------------------------------
+# Calculates the forces on the particles of composite particles
+# positions: (B, N, 3) array of particle locations of B composite particles
+# kinds: (B, N) array of the index of each particle in particle_kinds, or -1 for padding where a composite particle has fewer particles
+# table: the particle table (see particle_table)
+# RETURNS forces (B, N, 3) array
+#------------------------------------------------------------------------------------------------------
+
+def forces(positions, kinds, table):
+    d = positions[:, :, None, :] - positions[:, None, :, :]                         # From each source to each target
+    r2 = np.einsum("btsk,btsk->bts", d, d)
+    valid = (kinds[:, :, None] >= 0) & (kinds[:, None, :] >= 0) & (r2 > 0)         # A particle does not act on itself
+    r = np.sqrt(np.maximum(r2, table["softening"] ** 2))
+    target = np.maximum(kinds, 0)
+    sizes = table["sizes"][target][:, :, None]
+    total = np.zeros_like(positions)
+    for kind, fields in enumerate(table["fields"]):
+        for f in fields:
+            active = valid & (kinds[:, None, :] == kind)
+            if f["max_distance"]:
+                active &= r2 <= f["max_distance"] ** 2
+            magnitude = engine.radial_force(r, f["strength"], f, sizes) / r * active
+            if f["type"] in table["weights"]:
+                magnitude *= table["weights"][f["type"]][target][:, :, None]
+            if f["type"] == "CHARGE":
+                magnitude *= table["charges"][target][:, :, None]
+            total += np.einsum("bts,btsk->btk", magnitude, d)
+
+    # Core repulsion between particles closer than the contact distance, growing with the overlap of their cores.  Electrons are
+    # held by the strong force, so only the positrons and free electrons are pushed, as the electrons' force fields only act on them.
+    touching = valid & (r2 < table["contact"] ** 2) & (kinds[:, :, None] > 0)
+    distance = np.sqrt(np.where(touching, r2, 1))
+    magnitude = table["core_stiffness"] * (table["contact"] - distance) / distance * touching
+    total += np.einsum("bts,btsk->btk", magnitude, d)
+    return total
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns which composite particles have collapsed: two of their particles are closer than one core radius (half of the contact
+# distance), so their cores overlap by more than half
+# positions: (B, N, 3) array of particle locations
+# kinds: (B, N) array of particle kinds (see forces)
+# table: the particle table (see particle_table)
+# RETURNS (B,) booleans
+#------------------------------------------------------------------------------------------------------
+
+def overlapping(positions, kinds, table):
+    d = positions[:, :, None, :] - positions[:, None, :, :]
+    r2 = np.einsum("btsk,btsk->bts", d, d)
+    pairs = (kinds[:, :, None] >= 0) & (kinds[:, None, :] >= 0) & ~np.eye(kinds.shape[1], dtype=bool)
+    return (pairs & (r2 < (table["contact"] / 2) ** 2)).any(axis=(1, 2))
+
+
+#------------------------------------------------------------------------------------------------------
+# Moves the particles of composite particles to their stable positions with the FIRE method.  Each composite particle has its
+# own step and stops when the largest force on its particles is below the tolerance.
+# positions: (B, N, 3) array of starting particle locations
+# kinds: (B, N) array of particle kinds (see forces)
+# table: the particle table (see particle_table)
+# timestep (optional): the starting step.  Steps grow up to max_step_factor times this step.
+# max_steps (optional): the most steps taken
+# tolerance (optional): the largest force left on a particle at a stable position
+# max_move (optional): the farthest a particle moves in one step.  By default a tenth of the smallest particle size.
+# path (optional): if True, the positions after every step are returned as well
+# RETURNS a dictionary of the positions (B, N, 3), converged (B,) booleans, the steps taken by each composite particle, the
+#     largest remaining force of each, and the path (steps + 1, B, N, 3) float32 array if requested
+#------------------------------------------------------------------------------------------------------
+
+def relax(positions, kinds, table, timestep=0.04, max_steps=5000, tolerance=1e-3, max_move=None, path=False):
+    x = np.array(positions, dtype=np.float64)
+    kinds = np.asarray(kinds)
+    max_move = table["sizes"].min() / 10 if max_move is None else max_move
+    count = len(x)
+    v = np.zeros_like(x)
+    dt = np.full(count, float(timestep))
+    alpha = np.full(count, alpha_start)
+    downhill = np.zeros(count, dtype=int)
+    steps = np.zeros(count, dtype=int)
+    moving = np.ones(count, dtype=bool)
+    trail = [x.astype(np.float32)] if path else None
+
+    f = forces(x, kinds, table)
+    for _ in range(max_steps):
+        largest = np.linalg.norm(f, axis=2).max(axis=1, initial=0)
+        moving &= largest > tolerance
+        if not moving.any():
+            break
+
+        # Steer the inertia towards the force while going downhill, and stop the particles when the motion goes uphill
+        power = np.einsum("bnk,bnk->b", f, v)
+        speed = np.linalg.norm(v, axis=(1, 2))
+        direction = f / np.maximum(np.linalg.norm(f, axis=(1, 2)), 1e-300)[:, None, None]
+        uphill = power < 0
+        v = np.where(uphill[:, None, None], 0, (1 - alpha)[:, None, None] * v + (alpha * speed)[:, None, None] * direction)
+        grow = ~uphill & (downhill >= min_downhill)
+        dt = np.where(uphill, dt * step_decrease, np.where(grow, np.minimum(dt * step_increase, timestep * max_step_factor), dt))
+        alpha = np.where(uphill, alpha_start, np.where(grow, alpha * alpha_decrease, alpha))
+        downhill = np.where(uphill, 0, downhill + 1)
+
+        # Semi-implicit Euler step (unit masses), with the distance moved limited so that stiff short-range forces stay stable
+        v += f * dt[:, None, None]
+        move = v * dt[:, None, None]
+        move *= np.minimum(1, max_move / np.maximum(np.linalg.norm(move, axis=2, keepdims=True), 1e-300))
+        move[~moving] = 0
+        v[~moving] = 0
+        x += move
+        steps += moving
+        f = forces(x, kinds, table)
+        if path:
+            trail.append(x.astype(np.float32))
+
+    result = {"positions": x, "converged": np.linalg.norm(f, axis=2).max(axis=1, initial=0) <= tolerance, "steps": steps,
+        "force": np.linalg.norm(f, axis=2).max(axis=1, initial=0)}
+    if path:
+        result["path"] = np.stack(trail)
+    return result
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the starting positions of composite particles, like the Phase 3 emitters: electrons on a sphere, positrons on a sphere
+# a quarter of its size and free electrons on a sphere half of its size
+# counts: a list of (electrons, positrons, free electrons) counts of each composite particle
+# radius: the radius of the electron sphere
+# seed (optional): the seed of the random locations
+# RETURNS positions (B, N, 3) array and kinds (B, N) array, padded to the largest composite particle
+#------------------------------------------------------------------------------------------------------
+
+def starting_positions(counts, radius, seed=0):
+    size = max(sum(c) for c in counts)
+    positions = np.zeros((len(counts), size, 3))
+    kinds = np.full((len(counts), size), -1)
+    for b, c in enumerate(counts):
+        start = 0
+        for kind, (n, scale) in enumerate(zip(c, (1, 1 / 4, 1 / 2))):
+            positions[b, start:start + n] = engine.emit_sphere(n, radius * scale, seed=(seed, b, kind))
+            kinds[b, start:start + n] = kind
+            start += n
+    return positions, kinds
+
+
+#------------------------------------------------------------------------------------------------------
+# Finds the stable configurations of composite particles
+# counts: a list of (electrons, positrons, free electrons) counts of each composite particle
+# seed (optional): the seed of the starting positions
+# path (optional): if True, the relaxation path is returned as well (see relax)
+# Other optional arguments are the forces of the particles (see particle_table)
+# RETURNS the dictionary of relax, with the particle kinds (B, N) of each composite particle, which have overlapping cores
+#     (see overlapping) and which are stable (converged without overlapping cores)
+#------------------------------------------------------------------------------------------------------
+
+def solve_many(counts, seed=0, path=False, strong_force=config.particle_strong_force, charge=config.electron_charge,
+        particle_force=config.particle_force, core_radius=config.electron_core_radius):
+    table = particle_table(strong_force, charge, particle_force, core_radius)
+    positions, kinds = starting_positions(counts, table["sizes"][0], seed)
+    result = relax(positions, kinds, table, path=path)
+    result["kinds"] = kinds
+    result["overlapping"] = overlapping(result["positions"], kinds, table)
+    result["stable"] = result["converged"] & ~result["overlapping"]
+    return result
+
+
+#------------------------------------------------------------------------------------------------------
+# Finds the stable configuration of a composite particle
+# electrons: the number of electrons bound by the strong force
+# positrons: the number of positrons
+# free_electrons (optional): the number of free electrons (1 for the neutron)
+# Other optional arguments are the same as solve_many
+# RETURNS a dictionary of positions (N, 3) array, kinds (N,) array, converged, overlapping, stable, steps, force and path
+#     (steps + 1, N, 3) if requested
+#------------------------------------------------------------------------------------------------------
+
+def solve(electrons, positrons, free_electrons=0, seed=0, path=False, **settings):
+    result = solve_many([(electrons, positrons, free_electrons)], seed=seed, path=path, **settings)
+    solution = {name: value[0] for name, value in result.items() if name != "path"}
+    if path:
+        solution["path"] = result["path"][:, 0]
+    return solution
+
+
+#------------------------------------------------------------------------------------------------------
+# Command line entry point: solves the composite particles of Phase 3 and prints their radius (the largest distance of a
+# particle from the center) and the distances between electrons
+#------------------------------------------------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stable configurations of composite particles")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    names = list(composite_particles)
+    result = solve_many([composite_particles[name] for name in names], seed=args.seed)
+    for b, name in enumerate(names):
+        particles = result["positions"][b][result["kinds"][b] >= 0]
+        electrons = result["positions"][b][result["kinds"][b] == 0]
+        radius = np.linalg.norm(particles - particles.mean(axis=0), axis=1).max()
+        spacing = np.linalg.norm(electrons[:, None] - electrons[None, :], axis=2)[np.triu_indices(len(electrons), 1)]
+        print(name + ": radius " + f"{radius:.3f}" + ", electron spacing " + (f"{spacing.min():.3f}-{spacing.max():.3f}" if len(spacing) else "-")
+            + ", steps " + str(result["steps"][b]) + ("" if result["converged"][b] else " (not converged)")
+            + (" (overlapping cores)" if result["overlapping"][b] else ""))
+
+
+if __name__ == "__main__":
+    main()
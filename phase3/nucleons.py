@@ -21,6 +21,7 @@ import bpy
 import sys
 import os
 import importlib
+import numpy as np
 
 # Import Config Variables & Common Functions
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
@@ -28,6 +29,12 @@ from common import config
 importlib.reload(config)
 from common import functions
 importlib.reload(functions)
+from common import calculations
+importlib.reload(calculations)
+from common import bake
+importlib.reload(bake)
+from phase3 import equilibrium
+importlib.reload(equilibrium)
 
 
 #------------------------------------------------------------------------------------------------------
@@ -63,8 +70,13 @@ def main(electrons, positrons, particle_accelerator=False, accelerator_force=100
     # Emitter size
     config.emitter_radius = config.ext_force_radius
 
+    # The equilibrium solver places particles at their stable configuration directly, without an external force.  The particle accelerator needs Blender physics.
+    use_solver = config.composite_solver and not config.particle_accelerator and config.electrons + config.positrons > 0
+    if use_solver:
+        config.external_force = False
+
     # Disable spin and calculation of particles if no external force pushes particles together
-    if not config.external_force:
+    if not config.external_force and not use_solver:
         config.spin = False
         config.show_calculations = False
 
@@ -95,13 +107,11 @@ def main(electrons, positrons, particle_accelerator=False, accelerator_force=100
     show_radius = False
     neutron = False
 
-    calc_radius_simulation = (config.wavelength * 5) * ((3/8) ** (1/2))    # The simulation is a fundamental wavelength of 2 meters.  To scale, divide by 2.  Then scale by fundamental wavelength.  See https://energywavetheory.com/physics-constants/proton-radius
-    calc_radius = calc_radius_simulation / 2 * config.fundamental_wavelength_no_gfactor
-    calc_radius_text = "Radius: " + f"{calc_radius:.3e}" + " (m)"
-    attractive_force = config.electron_energy * config.electron_radius      # Coulomb force of positron from Electric Force equation at https://energywavetheory.com/equations/classical-constants/
-    attractive_force_text = "Attractive: " + f"{attractive_force:.3e}" + " (J*m) - decreasing at 1/r^2"
-    repelling_force = config.electron_energy * (config.electron_radius ** 2) / (config.fine_structure ** 2)    # Repelling force from Orbital Force equation at https://energywavetheory.com/equations/classical-constants/
-    repelling_force_text = "Repelling: " + f"{repelling_force:.3e}" + " (J*m^2) - decreasing at 1/r^3"
+    proton_calc = calculations.query("proton")                              # Proton radius, and the Electric Force and Orbital Force equations at https://energywavetheory.com/equations/classical-constants/
+    calc_radius_simulation = proton_calc["radius_simulation"]              # The simulation is a fundamental wavelength of 2 meters.  To scale, divide by 2.  Then scale by fundamental wavelength.  See https://energywavetheory.com/physics-constants/proton-radius
+    calc_radius_text = "Radius: " + f"{proton_calc['radius']:.3e}" + " (m)"
+    attractive_force_text = "Attractive: " + f"{proton_calc['attractive_force']:.3e}" + " (J*m) - decreasing at 1/r^2"
+    repelling_force_text = "Repelling: " + f"{proton_calc['repelling_force']:.3e}" + " (J*m^2) - decreasing at 1/r^3"
 
     # Determine the type of composite particle based on electron and positron count
     if ((config.electrons == 1) and (config.positrons == 1)):
@@ -210,10 +220,7 @@ def main(electrons, positrons, particle_accelerator=False, accelerator_force=100
         p.keyframe_insert(data_path='force_field_1.use_max_distance', frame=config.ext_force_endframe - 10)
         p.keyframe_insert(data_path='force_field_1.distance_max', frame=config.ext_force_endframe - 10)
         p.keyframe_insert(data_path='force_field_2.strength', frame=config.ext_force_endframe - 10)
-        old_type = bpy.context.area.type      # Make the switch a constant on/off for the transition of forces. Blender default is gradual changes.
-        bpy.context.area.type = 'GRAPH_EDITOR'
-        bpy.ops.graph.interpolation_type(type='CONSTANT')
-        bpy.context.area.type = old_type
+        functions.set_constant_interpolation(p)      # Make the switch a constant on/off for the transition of forces. Blender default is gradual changes.
 
 
     #------------------------------------------------------------------------------------------------------
@@ -260,6 +267,30 @@ def main(electrons, positrons, particle_accelerator=False, accelerator_force=100
         pset.force_field_1.flow = 0
         shell_color = config.neutron_color
 
+
+    #------------------------------------------------------------------------------------------------------
+    # EQUILIBRIUM SOLVER
+    # If set, the stable configuration of the composite particle is found by the equilibrium solver (phase3/equilibrium.py) using the
+    # same strong, charge and positron forces, and the emitters replay its relaxation path instead of simulating their particles.
+    # The path is shown from the first frame and the particles stay at their stable positions once it ends.
+    #------------------------------------------------------------------------------------------------------
+
+    solver_text = ""
+    if use_solver:
+        counts = {"Emitter - Electron": config.electrons, "Emitter - Positron": config.positrons, "Emitter - Electron - Free": config.positrons if neutron else 0}
+        solution = equilibrium.solve(*counts.values(), seed=config.engine_seed, path=True,
+            strong_force=config.particle_strong_force, charge=config.electron_charge, particle_force=config.particle_force, core_radius=config.electron_core_radius)
+        if not solution["converged"]:                                                          # Shown with the calculations
+            solver_text = "\n" + "Not stable: the equilibrium solver did not converge (force " + f"{solution['force']:.2e}" + ")"
+        elif solution["overlapping"]:
+            solver_text = "\n" + "Not stable: the particles collapsed onto each other"
+        path = solution["path"] - solution["positions"].mean(axis=0).astype(np.float32)      # Center the stable configuration
+        path = path[np.linspace(0, len(path) - 1, min(len(path), config.num_frames + 1)).round().astype(int)]    # Long paths are shown in fewer frames
+        frames = ((path[min(i, len(path) - 1)], None) for i in range(config.num_frames + 1))
+        ends = np.cumsum(list(counts.values()))
+        groups = {name: [int(end - count), int(end)] for (name, count), end in zip(counts.items(), ends) if count}
+        bake.replay(bake.write_trajectory(frames, len(path[0]), 1, groups))
+
     #------------------------------------------------------------------------------------------------------
     # PROTON SPIN
     # If spin is set to True, the particles at the center of the simulation will spin using a Vortex force.
@@ -368,7 +399,7 @@ def main(electrons, positrons, particle_accelerator=False, accelerator_force=100
         if show_radius:
             bpy.ops.mesh.primitive_circle_add(radius=calc_radius_simulation, enter_editmode=False, location=(0, 0, 0))
             bpy.context.active_object.name = "Proton Radius"
-        functions.add_text(name="Calculations", text=str(particle_type), location=(100, 100, 0), radius=10)
+        functions.add_text(name="Calculations", text=str(particle_type) + solver_text, location=(100, 100, 0), radius=10)
 
         # Hide everything except for the particle emitter and particle
         for o in bpy.data.objects:
@@ -386,5 +417,6 @@ def main(electrons, positrons, particle_accelerator=False, accelerator_force=100
         functions.add_text(name="Particle Count", text=text, location=(-100, 100, 0), radius=10)
 
         # Display during the duration of the external force so that it is apparent when it is turned off.
-        functions.add_text(name="External Force Indicator", text="External Force: ON", location=(100, -100, 0), radius=10)
-        functions.hide_at_keyframe(name = "External Force Indicator", init_hide=False, start_frame=1, end_frame=config.ext_force_endframe)
+        if config.external_force:
+            functions.add_text(name="External Force Indicator", text="External Force: ON", location=(100, -100, 0), radius=10)
+            functions.hide_at_keyframe(name = "External Force Indicator", init_hide=False, start_frame=1, end_frame=config.ext_force_endframe)
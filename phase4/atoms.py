@@ -4,16 +4,16 @@
 # This phase combines nucleons (protons and neutrons) merging together to form the core of an atom, then attracting electrons in orbitals.
 # Electrons are contained in orbitals due to attractive and repelling forces decreasing by the inverse square and cube respectively.
 # This simulation is not to scale in terms of particle size relative to distance between particles (so that atoms can be viewed).
-# An electron cloud option has been added which simulates electrons in various positions in the atom to show its probability cloud.
+# An electron cloud option has been added which draws electrons in various positions in the atom to show its probability cloud (common/cloud.py).
 # Orbitals are isolated to Blender effector groups so that attractive and repulsive forces can be simulated (required because nucleus is not forming correctly)
 # Ionization energy is calculated using Coulomb's Law for energy by determining the constructive wave interference on an electron from all particles, and its distance
 # TODO: The core issue to be resolved is the structure of the nucleus.  Once resolved, many of these TODO items are automatically fixed.
 # TODO: Nucleons should arrange at standing wave nodes, similar to particles.  Thus, this development is dependent on Phase 2.
 # TODO: The repelling force uses a Blender "Wind" force to simulate the axial, magnetic force.  This needs to be improved.
-# TODO: The orbital distances for all atoms (up to calcium) can be calculated if simultaneous equation solving is possible in Blender/Python
+# Orbital distances of atoms heavier than calcium (the data file) are calculated by the orbital solver (common/orbitals.py) and marked "~solver"
 # TODO: Effector groups should be replaced with the true physics of each and every electron affecting each other - in all orbitals.
 # TODO: The electron ionization energies may be improved when electron positions are simulated and a more accurate method of wave interference is established.
-# TODO: The nucleus only supports up to calcium (Z=20) because of above, and also because the nucleus is unstable at large numbers of Z
+# TODO: The nucleus is unstable at large numbers of Z, and atoms beyond calcium (Z=20) use the approximate orbital solver
 # TODO: The shapes of orbitals will depend on alignment of spin and the magnetic forces when the nucleus forms correctly.
 # For more details, visit www.energywavetheory.com/atoms
 
@@ -26,7 +26,6 @@ import bpy
 import sys
 import os
 import importlib
-import math
 
 # Import Config Variables & Common Functions
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
@@ -36,6 +35,12 @@ from common import functions
 importlib.reload(functions)
 from common import data
 importlib.reload(data)
+from common import bake
+importlib.reload(bake)
+from common import calculations
+importlib.reload(calculations)
+from common import cloud
+importlib.reload(cloud)
 
 
 #------------------------------------------------------------------------------------------------------
@@ -43,7 +48,7 @@ importlib.reload(data)
 # protons: the count of protons for the simulation
 # neutrons: the count of neutrons for the simulation
 # electrons: the count of electrons for the simulation
-# show_electron_cloud (optional): if True, electrons are simulated at different positions to illustrate their probability cloud
+# show_electron_cloud (optional): if True, electrons are drawn at different positions to illustrate their probability cloud
 #------------------------------------------------------------------------------------------------------
 
 def main(protons, neutrons, electrons, show_electron_cloud=False):
@@ -115,46 +120,38 @@ def main(protons, neutrons, electrons, show_electron_cloud=False):
     # solving simultaneous equations.  Math-cad was used, not Blender.  The table is here: https://energywavetheory.com/atoms/calculations-atoms/
     # Energy calculations are shown for the ionized electron. It uses amplitude factors from https://energywavetheory.com/atoms/calculations-amplitude-factors/
     # This emitter generates free electrons that will be subject to an attractive force and repelling force of the nucleus to remain in an orbital.
-    # TODO: If Blender/Python can support simultaneous equation solvers, the equations can be imported here. Instead, they use a data file.
+    # Atoms heavier than calcium are calculated by the orbital solver in common/orbitals.py (see common/calculations.py) and marked "~solver".
     # TODO: Nucleus forces on electrons in orbitals is placed here as temporary workaround until nucleus forces are completed.
     # TODO: Each electron needs to affect other electrons to determine placement of electrons.  Distances should be nearly accurate, but not placement.
     #------------------------------------------------------------------------------------------------------
 
-    # Check to make sure the current atom array in the data file supports the atomic configuration (num of protons)
+    # Check to make sure the atom symbols support the atomic configuration (num of protons)
     if config.protons >= len(data.atoms):
         # reset protons to hydrogen if not supported by simulation
         config.protons = 1
 
-    # Determine what type of atom (ionized, neutral or not a supported atom)
-    if config.electrons == config.protons:           # Neutral atom
-        atom_name = data.atoms[config.protons]
-        orbital_ratio = data.neutral_atom
-        amplitude_ratio = data.amp_neutral
-    elif config.electrons < config.protons:          # Ionized atom
-        ions = config.protons - config.electrons
-        atom_name = data.atoms[config.protons] + str(ions) + "+"
-        orbital_ratio, amplitude_ratio, atom_name = data.get_orbital_array(config.electrons, atom_name)
-    else:                                            # Unsupported atom (there are more electrons than protons)
-        orbital_ratio = data.neutral_atom
-        amplitude_ratio = data.amp_neutral
-        atom_name = "Atom not supported"
+    # Look up the type of atom (ionized, neutral or not a supported atom) and its orbital distances and energies (see common/calculations.py)
+    atom_calc = calculations.query("atom", config.protons, config.electrons)
+    atom_name = atom_calc["name"]
+    orbital_ratio = atom_calc["ratio"]
 
     # Loop through each orbital, calculating the distance and adding an electron emitter.
     orbital_text = ""
     energy_text = ""
     e = config.electrons
+    engine_emitters = []                # Emitters moved by the particle engine, if set
 
     i=1
-    while i <= len(orbital_ratio):
-        orbital = orbital_ratio[i-1][config.protons] * config.hydrogen_radius       # The calculated distance scaled for the simulation
-        orbital_calc = orbital_ratio[i-1][config.protons] * config.bohr_radius      # The calculated orbital distance relative to the Bohr radius
-        orbital_name = orbital_ratio[i-1][0]
+    while i <= atom_calc["orbitals"]:
+        orbital = orbital_ratio[i-1] * config.hydrogen_radius                      # The calculated distance scaled for the simulation
+        orbital_calc = atom_calc["distance"][i-1]                                   # The calculated orbital distance relative to the Bohr radius
+        orbital_name = calculations.orbital_names[i-1]
         orbital_text = orbital_name + ": " + f"{orbital_calc:.2e}" + " (m)"
-        energy_constants = (1/2) * config.coulomb_constant * config.elementary_charge ** 2      # Orbital energy is based on Coulomb's law - these are constants applied to next line.
-        if orbital_calc != 0:
-            energy_calc = energy_constants * amplitude_ratio[i-1][config.protons] / orbital_calc    # Energy constants multiplied by constructive wave interference / divide radius
-            if energy_calc != 0:
-                energy_text = ";  E: ~" + f"{energy_calc:.2e}" + " (J)"
+        if atom_calc["solved"]:
+            orbital_text = orbital_text + " ~solver"                                 # Values estimated by the orbital solver, not the data file
+        energy_calc = atom_calc["energy"][i-1]                                      # Orbital energy is based on Coulomb's law: constructive wave interference / divide radius
+        if energy_calc != 0:
+            energy_text = ";  E: ~" + f"{energy_calc:.2e}" + " (J)"
 
         # Ensure that the right number of electrons are emitted for each shell following the electron sequence for shells: s, p, d, f
         shell_max = data.electron_sequence[i-1]
@@ -185,76 +182,57 @@ def main(protons, neutrons, electrons, show_electron_cloud=False):
                 functions.add_text(name=orbital_name, text=orbital_text, location=(orbital, i*5, 0), radius=5 )
                 functions.link_collection(collection=orbital_collection)
 
-            # If displaying an electron cloud, disable electrons affecting themselves and set count higher to simulate the electron's probable positions.
+            # If displaying an electron cloud, the probable positions of the orbital's electrons are drawn by the cloud sampler and shown at once,
+            # instead of simulating many electrons that do not affect each other (see common/cloud.py).  P orbitals have the dumbbell shape of
+            # the axial forces, one for each pair of valence electrons or three if the orbital is not the valence orbital.
             if config.show_electron_cloud:
-                self_effect = False
-                electron_count = int(config.num_frames / 10 * (int(orbital_name[:1])**2))   # Start with a smaller number of electrons near the core and increase with each shell for visibility
-                if config.protons == 1:                                                     # ...except hydrogen
-                    electron_count = config.num_frames
-            else:
-                self_effect = True
-
-            # Add the electron particle emitter at each orbital
-            pset = functions.add_emitter(name=orbital_name + " - Emitter",
-                particle_type = "electron",
-                color = config.electron_color,
-                radius = orbital,
-                count = electron_count,
-                self_effect = True,
-                core_only = False)
-            pset.force_field_1.flow = config.flow
-            pset.emit_from = 'FACE'
-            pset.use_emit_random = False
-
-            # Rotate the p emitter. TODO: electrons from s shell should repel electrons in p shell instead of manual rotation; see note about use of effector groups
-            if (orbital_name == "2p" or orbital_name == "3p"):
-                o = bpy.data.objects[orbital_name + " - Emitter"]
-                o.rotation_euler[2] = config.pi /2
-
-            # If showing an electron cloud, ensure that the electrons in the same orbitals do not affect each other
-            if config.show_electron_cloud:
-                pset.use_self_effect = False
-            functions.link_collection(collection=orbital_collection)
-
-            # Atoms greater than hydrogen use collection effector groups to assist with isolating forces.
-            if config.protons > 1:
-                pset.effector_weights.collection = bpy.data.collections["Orbital - " + orbital_name]    # Create a collection for each shell.
-
-                # Add the attractive force.  Each orbital is assigned a different effector group as a workaround. TODO: This section and next should be replaced when nucleus structure is completed.
-                bpy.ops.object.effector_add(type='CHARGE', enter_editmode=False, location=(0, 0, 0))
-                bpy.context.active_object.name = orbital_name + " - Force - Attractive"
-                o = bpy.data.objects[orbital_name + " - Force - Attractive"]
-                o.field.strength = config.protons * config.electron_charge        # The attractive force of protons in the nucleus. Number of protons times proton charge.
-                o.field.falloff_power = 2                                         # This attractive electric force reduces at square of distance.
+                positions = cloud.sample(orbital_name, orbital, cloud.electron_count(orbital_name, config.protons, config.num_frames),
+                    axis_count=cloud.axial_count(valence_count, valence=(e == 0)), seed=(config.engine_seed, i) if config.engine_seed else None)
+                functions.add_electron_cloud(name=orbital_name + " - Cloud", color=config.electron_color, positions=positions)
                 functions.link_collection(collection=orbital_collection)
 
-                # Add the repulsive force.  This is added here because protons (and spin) need to align for quantum jumps, which is under construction.  See: https://energywavetheory.com/atoms/quantum-leaps/
-                repelling_force = config.orbital_force * orbital_ratio[i-1][config.protons] * config.protons       # Uses the data file for repelling force since already calculated.
-                bpy.ops.object.effector_add(type='CHARGE', enter_editmode=False, location=(0, 0, 0))
-                bpy.context.active_object.name = orbital_name + " - Force - Repelling"
-                o = bpy.data.objects[orbital_name + " - Force - Repelling"]
-                o.field.strength = -repelling_force    # TODO: this is simulated and needs to be occur naturally with proton alignment in nucleus
-                o.field.falloff_power = 3              # The repelling force is an inverse cube decreasing force
+            # Otherwise each electron is simulated, attracted and repelled by the nucleus
+            else:
+                # Add the electron particle emitter at each orbital
+                pset = functions.add_emitter(name=orbital_name + " - Emitter",
+                    particle_type = "electron",
+                    color = config.electron_color,
+                    radius = orbital,
+                    count = electron_count,
+                    self_effect = True,
+                    core_only = False)
+                pset.force_field_1.flow = config.flow
+                pset.emit_from = 'FACE'
+                pset.use_emit_random = False
+                engine_emitters.append(orbital_name + " - Emitter")
+
+                # Rotate the p emitter. TODO: electrons from s shell should repel electrons in p shell instead of manual rotation; see note about use of effector groups
+                if (orbital_name == "2p" or orbital_name == "3p"):
+                    o = bpy.data.objects[orbital_name + " - Emitter"]
+                    o.rotation_euler[2] = config.pi /2
+
                 functions.link_collection(collection=orbital_collection)
 
-                # Add the repulsive spin alignment causing electrons to jump at alignment. P orbital.  See: https://energywavetheory.com/atoms/orbital-shapes/.  TODO, this needs to be replaced when nucleus forms automatically.
-                if (orbital_name == "2p" or orbital_name == "3p") and config.show_electron_cloud:
-                    j = 1
-                    if e == 0:
-                        num_forces = math.ceil(valence_count/2)                                                # Valence electron shell.  Create an axial force for valence electrons up to 3 depending on valence count.
-                    else:
-                        num_forces = 3                                                                          # Defaults to three for p subshell if not valence electron shell
-                    while j <= num_forces:                                                                      # Create axial forces when protons align to push electrons further
-                        bpy.ops.object.effector_add(type='CHARGE', enter_editmode=False, location=(0, 0, 0))
-                        bpy.context.active_object.name = orbital_name + " - Force - Axial - " + str(j)
-                        o = bpy.data.objects[orbital_name + " - Force - Axial - " + str(j)]
-                        o.rotation_euler[j-1] = config.pi / 2                                  # Rotate for the x, y and z planes
-                        o.field.shape = 'LINE'
-                        o.field.strength = 1
-                        o.field.falloff_power = 3
-                        o.field.falloff_type = 'TUBE'
-                        functions.link_collection(collection=orbital_collection)
-                        j += 1
+                # Atoms greater than hydrogen use collection effector groups to assist with isolating forces.
+                if config.protons > 1:
+                    pset.effector_weights.collection = bpy.data.collections["Orbital - " + orbital_name]    # Create a collection for each shell.
+
+                    # Add the attractive force.  Each orbital is assigned a different effector group as a workaround. TODO: This section and next should be replaced when nucleus structure is completed.
+                    bpy.ops.object.effector_add(type='CHARGE', enter_editmode=False, location=(0, 0, 0))
+                    bpy.context.active_object.name = orbital_name + " - Force - Attractive"
+                    o = bpy.data.objects[orbital_name + " - Force - Attractive"]
+                    o.field.strength = config.protons * config.electron_charge        # The attractive force of protons in the nucleus. Number of protons times proton charge.
+                    o.field.falloff_power = 2                                         # This attractive electric force reduces at square of distance.
+                    functions.link_collection(collection=orbital_collection)
+
+                    # Add the repulsive force.  This is added here because protons (and spin) need to align for quantum jumps, which is under construction.  See: https://energywavetheory.com/atoms/quantum-leaps/
+                    repelling_force = config.orbital_force * orbital_ratio[i-1] * config.protons       # Uses the data file for repelling force since already calculated.
+                    bpy.ops.object.effector_add(type='CHARGE', enter_editmode=False, location=(0, 0, 0))
+                    bpy.context.active_object.name = orbital_name + " - Force - Repelling"
+                    o = bpy.data.objects[orbital_name + " - Force - Repelling"]
+                    o.field.strength = -repelling_force    # TODO: this is simulated and needs to be occur naturally with proton alignment in nucleus
+                    o.field.falloff_power = 3              # The repelling force is an inverse cube decreasing force
+                    functions.link_collection(collection=orbital_collection)
         i += 1
 
 
@@ -303,6 +281,7 @@ def main(protons, neutrons, electrons, show_electron_cloud=False):
         pset.particle_size = proton_radius
         pset.display_size = proton_radius
         functions.link_collection(collection=nucleus_collection)
+        engine_emitters.append("Emitter - Proton")
 
         # Neutron emitter
         pset = functions.add_emitter(name="Emitter - Neutron",
@@ -316,6 +295,7 @@ def main(protons, neutrons, electrons, show_electron_cloud=False):
         pset.particle_size = proton_radius
         pset.display_size = proton_radius
         functions.link_collection(collection=nucleus_collection)
+        engine_emitters.append("Emitter - Neutron")
 
         # Spin the entire nucleus of the atom (if set)
         if config.spin:
@@ -326,3 +306,17 @@ def main(protons, neutrons, electrons, show_electron_cloud=False):
             nucleus_collection.objects.link(b)
             default_collection.objects.unlink(a)
             default_collection.objects.unlink(b)
+
+
+    #------------------------------------------------------------------------------------------------------
+    # PARTICLE ENGINE
+    # If set, nucleons and electrons are moved by the NumPy particle engine instead of Blender's particle solver, using the same
+    # forces: the nucleus charges, the orbital forces (each orbital is isolated by its effector collection), the vortex spin and
+    # the repelling wind forces.  The strong and nuclear forces have a maximum distance, so each nucleon is only paired with the
+    # nucleons near it (a cell list).  Electron clouds are drawn by the cloud sampler as static points, so they are not moved by the engine.
+    #------------------------------------------------------------------------------------------------------
+
+    if config.particle_engine and engine_emitters:
+        bake.bake_emitters(engine_emitters, frames=config.num_frames, seed=config.engine_seed or None, substeps=config.engine_substeps,
+            backend=config.engine_backend, theta=config.octree_theta, workers=config.engine_workers,
+            use_cache=config.bake_cache, cache_budget=config.bake_cache_size)
@@ -0,0 +1,106 @@
+# Bonds
+
+#------------------------------------------------------------------------------------------------------
+# MOLECULE BOND DETECTOR
+# Counts the molecules and atoms of a frame from the atom locations, instead of predicting them from the number of hydrogen atoms.
+# Two hydrogen atoms are bonded as molecular hydrogen (H2) when they are closer than the bond distance, which is the distance
+# that the repulsive force of the Phase 5 atom emitters keeps them apart (hydrogen_radius * 2.75).  Each hydrogen atom shares
+# one electron, so it bonds with at most one other atom: when more than two atoms are close, the closest atoms are bonded first.
+# Helium atoms do not bond and are counted as atoms.
+# Atoms near each other are found with the cell list (common/neighbors.py), which is updated from the previous frame, so the cost
+# of a frame is linear in the number of atoms and counting keeps up with playback.
+# This module does not import bpy so that it can be used outside of Blender.
+#------------------------------------------------------------------------------------------------------
+
+import sys
+import os
+import importlib
+import numpy as np
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+from common import neighbors
+importlib.reload(neighbors)
+
+
+# Types of atoms, by their code in the kinds array
+atom_kinds = ["H", "He"]
+
+
+#------------------------------------------------------------------------------------------------------
+# Creates a molecule counter
+# distance: the bond distance.  Hydrogen atoms closer than this distance form a molecule.
+# RETURNS counter - a dictionary that is passed to count
+#------------------------------------------------------------------------------------------------------
+
+def create_counter(distance):
+    return {"distance": float(distance), "grid": None}
+
+
+#------------------------------------------------------------------------------------------------------
+# Pairs atoms that are closer than the bond distance, each atom with at most one other.  Atoms that are each other's closest
+# unpaired atom are paired, until no atoms within the distance are left.  The closest remaining pair is always paired, so this
+# finishes, and it usually takes only a few rounds.
+# grid: the cell list of the atoms
+# positions: (N, 3) array of atom locations
+# RETURNS (P, 2) array of the atoms of each pair
+#------------------------------------------------------------------------------------------------------
+
+def pair(grid, positions):
+    n = len(positions)
+    t, s, _, r2 = neighbors.pairs(grid, positions)
+    keep = t != s
+    t, s, r2 = t[keep], s[keep], r2[keep]
+
+    everyone = np.arange(n)
+    paired = np.zeros(n, dtype=bool)
+    found = []
+    while len(t):
+        # The closest candidate of each atom: candidates sorted by atom then distance, the first of each atom
+        order = np.lexsort((r2, t))
+        first = order[np.r_[True, t[order][1:] != t[order][:-1]]]
+        closest = np.full(n, -1, dtype=np.int64)
+        closest[t[first]] = s[first]
+        mutual = (closest >= 0) & (closest[closest] == everyone) & (everyone < closest)
+        a = np.flatnonzero(mutual)
+        found.append(np.stack([a, closest[a]], axis=1))
+        paired[a] = paired[closest[a]] = True
+
+        # Atoms that were paired are no longer candidates
+        keep = ~paired[t] & ~paired[s]
+        t, s, r2 = t[keep], s[keep], r2[keep]
+    return np.concatenate(found) if found else np.zeros((0, 2), dtype=np.int64)
+
+
+#------------------------------------------------------------------------------------------------------
+# Counts the molecules and atoms of a frame
+# counter: the counter returned by create_counter
+# positions: (N, 3) array of atom locations
+# kinds: array of the type of each atom, as its code in atom_kinds
+# RETURNS a dictionary of the number of H2 molecules, and hydrogen (H) and helium (He) atoms that are not in a molecule
+#------------------------------------------------------------------------------------------------------
+
+def count(counter, positions, kinds):
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    kinds = np.asarray(kinds)
+    hydrogen = positions[kinds == atom_kinds.index("H")]
+
+    molecules = 0
+    if len(hydrogen) > 1:
+        counter["grid"] = grid = neighbors.build(hydrogen, counter["distance"], counter["grid"])
+        molecules = len(pair(grid, hydrogen))
+    return {
+        "H2": molecules,
+        "H": len(hydrogen) - 2 * molecules,
+        "He": int(np.count_nonzero(kinds == atom_kinds.index("He"))),
+    }
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the counts of a frame as text, e.g. "4 H2 Molecules and 1 H Atoms".  Helium is only included when there are helium atoms.
+#------------------------------------------------------------------------------------------------------
+
+def describe(counts):
+    text = str(counts["H2"]) + " H2 Molecules and " + str(counts["H"]) + " H Atoms"
+    if counts["He"]:
+        text = str(counts["He"]) + " Helium Atoms, " + text
+    return text
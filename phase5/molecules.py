@@ -20,6 +20,7 @@ import os
 import importlib
 import math
 import random
+import numpy as np
 
 # Import Config Variables & Common Functions
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
@@ -29,6 +30,66 @@ from common import functions
 importlib.reload(functions)
 from common import data
 importlib.reload(data)
+from common import bake
+importlib.reload(bake)
+from phase5 import bonds
+importlib.reload(bonds)
+
+
+# The live molecule count: the bond counter, the atom objects and emitters with their type of atom, and the heading of the text
+molecule_count = {}
+
+
+#------------------------------------------------------------------------------------------------------
+# Returns the locations and types of the atoms shown at the current frame.  Atoms are particles of emitters, or objects without
+# particles.  Hidden emitters and objects (e.g. atoms after an explosion) are not counted.  Emitters replayed by the particle
+# engine are read from their trajectory, and other emitters from Blender's evaluated particles that are alive.
+# scene: the scene at the current frame
+# RETURNS positions (N, 3) and kinds (the code of each atom in bonds.atom_kinds)
+#------------------------------------------------------------------------------------------------------
+
+def atom_locations(scene):
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    positions = [np.zeros((0, 3))]
+    kinds = [np.zeros(0, dtype=np.int64)]
+    for name, atom in molecule_count["sources"]:
+        o = bpy.data.objects.get(name)
+        if o is None or o.hide_viewport:
+            continue
+        if not o.particle_systems:
+            locations = np.array([o.matrix_world.translation])
+        else:
+            locations = bake.baked_locations(name, scene.frame_current)
+            if locations is None:
+                locations = np.array([p.location for p in o.evaluated_get(depsgraph).particle_systems[0].particles if p.alive_state == 'ALIVE']).reshape(-1, 3)
+        positions.append(locations)
+        kinds.append(np.full(len(locations), bonds.atom_kinds.index(atom)))
+    return np.concatenate(positions), np.concatenate(kinds)
+
+
+#------------------------------------------------------------------------------------------------------
+# Updates the molecule count text with the molecules and atoms detected at the current frame
+#------------------------------------------------------------------------------------------------------
+
+def update_molecule_count(scene, depsgraph=None):
+    o = bpy.data.objects.get("Molecule Count")
+    if o is None or not molecule_count:
+        return
+    positions, kinds = atom_locations(scene)
+    counts = bonds.count(molecule_count["counter"], positions, kinds)
+    o.data.body = molecule_count["heading"] + "Now: " + bonds.describe(counts)
+
+
+#------------------------------------------------------------------------------------------------------
+# Adds the frame change handler that updates the molecule count.  It is added after the particle engine's handler, and handlers
+# from previous runs are replaced, because this module is reloaded with each run.
+#------------------------------------------------------------------------------------------------------
+
+def install_counter():
+    handlers = bpy.app.handlers.frame_change_post
+    for handler in [h for h in handlers if h.__name__ == update_molecule_count.__name__]:
+        handlers.remove(handler)
+    handlers.append(update_molecule_count)
 
 
 #------------------------------------------------------------------------------------------------------
@@ -104,6 +165,13 @@ def main(hydrogen_atoms):
     calc_text = "Natural Forces" + "\n\n" + "Begin: " + str(config.hydrogen_atoms) + " Hydrogen Atoms" + "\n" + "End: "
     calc_text = calc_text + str(math.floor(config.hydrogen_atoms/2)) + " H2 Molecules and " + str(config.hydrogen_atoms % 2) + " H Atoms"
 
+    # Atoms are counted at each frame when the scene ends in atoms (natural forces and fusion).  The End line is replaced by the live count.
+    # Hydrogen atoms closer than the distance kept by the repulsive atom emitters are bonded as molecules.
+    molecule_count.clear()
+    molecule_count["counter"] = bonds.create_counter(config.hydrogen_radius * 2.75)
+    molecule_count["heading"] = calc_text[:calc_text.index("End: ")]
+    molecule_count["sources"] = [(atom, atom)]
+
     # Add a hydrogen atom and move it from view (it will be used by the emitter).
     functions.add_atom(name=atom, color=config.hydrogen_color, atom_type=atom, scale_factor=phase_scale_factor)
     o = bpy.data.objects[atom]
@@ -147,6 +215,7 @@ def main(hydrogen_atoms):
             o.particle_systems[0].seed = random.randint(1,100)
             o.location = random_location
             functions.link_collection(collection=molecule_collection)
+            molecule_count["sources"].append(("Emitter - Atom 1" + ' - ' + str(i), atom))
 
         # Add second emitter with repulsive atoms to keep the atoms separated at distance, sharing electrons. Only if even number of atoms.
         if not ((i == math.ceil(config.hydrogen_atoms / 2)) and ((config.hydrogen_atoms % 2) == 1)):
@@ -163,6 +232,7 @@ def main(hydrogen_atoms):
             o.particle_systems[0].seed = random.randint(1,100)
             o.location = random_location
             functions.link_collection(collection=molecule_collection)
+            molecule_count["sources"].append(("Emitter - Atom 2" + ' - ' + str(i), atom))
 
         # An explosive force is used instead of external force, which accomplishes the same thing but then reverses force.  TODO: When effector groups removed, this should be moved out of collections.
         if config.external_force:
@@ -186,6 +256,7 @@ def main(hydrogen_atoms):
     #------------------------------------------------------------------------------------------------------
 
     if explosion:
+        explosion_emitters = []
 
         # The initial atoms created above will be hidden after the explosion.  Set the keyframes using animation.
         for o in bpy.data.objects:
@@ -202,27 +273,42 @@ def main(hydrogen_atoms):
         if config.ext_force_strength >= ext_force_strength_threshold and config.ext_force_strength < ext_force_strength_threshold*10:
             pset = functions.add_emitter(name="Helium Emitter", color = config.helium_color, radius=10, count=helium_atoms, scale_factor=150)
             pset.mass = 500  # Making helium heavier to slow it down relative to other particles when being emitted
+            explosion_emitters.append("Helium Emitter")
             functions.hide_at_keyframe(name="Helium Emitter", init_hide=True, start_frame=1, end_frame=config.ext_force_endframe)
             pset = functions.add_emitter(name="Hydrogen Emitter", color = config.hydrogen_color, radius=10, count=config.hydrogen_atoms % 4, scale_factor=100)  # Remainder is H atoms.
             pset.mass = 200
+            explosion_emitters.append("Hydrogen Emitter")
             functions.hide_at_keyframe(name="Hydrogen Emitter", init_hide=True, start_frame=1, end_frame=config.ext_force_endframe)
             calc_text = "Nuclear Fusion" + "\n\n" + "Begin: " + str(config.hydrogen_atoms) + " Hydrogen Atoms" + "\n" + "End: " + str(helium_atoms) + " Helium Atoms and " + str(config.hydrogen_atoms % 4) + " Hydrogen Atoms"
+            molecule_count["heading"] = calc_text[:calc_text.index("End: ")]
+            molecule_count["sources"] += [("Helium Emitter", "He"), ("Hydrogen Emitter", atom)]
 
         # ACCELERATORS. With a very large force, atomic nuclei separate and protons begin to separate to quarks. With sufficient energy in the future, these quarks should be separated to electrons/positrons.
         elif config.ext_force_strength >= ext_force_strength_threshold*10 and config.ext_force_strength < ext_force_strength_threshold*100:
             pset = functions.add_emitter(name="Electron Emitter", color = config.electron_color, radius=10, count=electrons, scale_factor=40)
+            explosion_emitters.append("Electron Emitter")
             functions.hide_at_keyframe(name="Electron Emitter", init_hide=True, start_frame=1, end_frame=config.ext_force_endframe)
             pset = functions.add_emitter(name="Positron Emitter", color = config.positron_color, radius=10, count=positrons, scale_factor=40)
             o = bpy.data.objects["Positron Emitter"]
             o.particle_systems[0].seed = random.randint(1,100)  # Make the seeding different from electrons, so they follow a different path
+            explosion_emitters.append("Positron Emitter")
             functions.hide_at_keyframe(name = "Positron Emitter", init_hide=True, start_frame=1, end_frame=config.ext_force_endframe)
             calc_text = "Accelerator Explosion" + "\n\n" + "Begin: " + str(config.hydrogen_atoms) + " Hydrogen Atoms" + "\n" + "End: " + str(electrons) + " Electrons and " + str(positrons) + " Positrons"
+            molecule_count.clear()
 
         # SUPERNOVA. With a very, very large force, all atoms break down to the fundamental particle (neutrinos).  99% of energy emitted from supernovas are neutrinos.
         elif config.ext_force_strength >= ext_force_strength_threshold*100:
             pset = functions.add_emitter(name="Neutrino Emitter", color = config.neutrino_color, radius = 10, scale_factor=10, count = neutrinos)
+            explosion_emitters.append("Neutrino Emitter")
             functions.hide_at_keyframe(name="Neutrino Emitter", init_hide=True, start_frame=1, end_frame=config.ext_force_endframe)
             calc_text = "Supernova Explosion" + "\n\n" + "Begin: " + str(config.hydrogen_atoms) + " Hydrogen Atoms" + "\n" + "End: " + str(neutrinos) + " Neutrinos"
+            molecule_count.clear()
+
+        # If set, the particles of the explosion are moved by the particle engine.  Thousands of particles use the octree for forces between particles.
+        if config.particle_engine and explosion_emitters:
+            bake.bake_emitters(explosion_emitters, frames=config.num_frames, seed=config.engine_seed or None, substeps=config.engine_substeps,
+                backend=config.engine_backend, theta=config.octree_theta, workers=config.engine_workers,
+                use_cache=config.bake_cache, cache_budget=config.bake_cache_size)
 
 
     #------------------------------------------------------------------------------------------------------
@@ -232,8 +318,11 @@ def main(hydrogen_atoms):
 
     if config.show_calculations:
 
-        # Display the beginning and ending atom and particle counts
+        # Display the beginning and ending atom and particle counts.  When atoms are counted, the ending count is updated at each frame.
         functions.add_text(name="Molecule Count", text=calc_text, location=(300, -300, 0), radius=50)
+        if molecule_count:
+            install_counter()
+            update_molecule_count(bpy.context.scene)
 
         # Display during the duration of the external force so that it is apparent when it is turned off.
         functions.add_text(name="External Force Indicator", text="External Force: ON", location=(300, -100, 0), radius=50)